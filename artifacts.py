@@ -0,0 +1,588 @@
+import mmap
+import re
+import struct
+
+import ast_nodes
+from errors import ArtifactError
+from line_table import LineTable
+from printf_format import PrintfFormat
+from symbol_table import Symbol, SymbolTable
+
+MAGIC = b'MCART'
+VERSION = 2
+# Trailer: offset of the index record, then the magic again
+TRAILER = struct.Struct('<Q5s')
+DOUBLE = struct.Struct('<d')
+# Instructions per IR record; random access decodes one record at a time
+IR_CHUNK = 256
+
+# Record kinds
+STRINGS, PROGRAM, STATEMENT, FUNCTION, SYMBOLS, IR, INDEX, LINES = range(8)
+
+# Attributes stored per node class, in order; the position in this table is
+# the node's tag, so changing it needs a new VERSION.
+NODE_FIELDS = [
+    (ast_nodes.Program, ('frame_size', 'slot_names')),
+    (ast_nodes.FunctionDef, ('return_type', 'name', 'params', 'body', 'frame_size', 'slot_names')),
+    (ast_nodes.Block, ('statements',)),
+    (ast_nodes.Declaration, ('datatype', 'name', 'init_value', 'size', 'slot')),
+    (ast_nodes.Assignment, ('name', 'expr', 'slot')),
+    (ast_nodes.IndexAssignment, ('name', 'index', 'expr', 'slot', 'size')),
+    (ast_nodes.PrintStatement, ('expr',)),
+    (ast_nodes.PrintfStatement, ('format_str', 'args', 'compiled')),
+    (ast_nodes.ReturnStatement, ('return_val',)),
+    (ast_nodes.IfStatement, ('condition', 'then_block', 'else_block', 'site')),
+    (ast_nodes.WhileStatement, ('condition', 'body', 'site', 'trips')),
+    (ast_nodes.ExpressionStatement, ('expr',)),
+    (ast_nodes.ForStatement, ('init', 'condition', 'step', 'body', 'site')),
+    (ast_nodes.BinaryOp, ('left', 'op', 'right', 'ctype', 'optype')),
+    (ast_nodes.Cast, ('ctype', 'expr')),
+    (ast_nodes.Call, ('name', 'args', 'ctype')),
+    (ast_nodes.Index, ('name', 'index', 'ctype', 'slot', 'size')),
+    (ast_nodes.Number, ('value', 'ctype')),
+    (ast_nodes.Identifier, ('name', 'ctype', 'slot')),
+]
+# Every node also stores its source span.
+NODE_FIELDS = [(cls, fields + ('line', 'end_line')) for cls, fields in NODE_FIELDS]
+NODE_TAGS = {cls: tag for tag, (cls, _) in enumerate(NODE_FIELDS)}
+# The writer pushes fields on a stack, last first
+REVERSED_FIELDS = [fields[::-1] for _, fields in NODE_FIELDS]
+
+# Value tags; node tags follow NODE_TAG
+NONE, FALSE, TRUE, INT, FLOAT, STR, LIST, FORMAT, NODE_TAG = range(9)
+
+# IR tokens stored as varints; anything else, like "-0" or "007", is interned
+INT_RE = re.compile(r'(0|-?[1-9]\d*)\Z')
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+SMALL_VARINTS = [bytes([value]) for value in range(0x80)]
+
+
+def varint_bytes(value):
+    if value < 0x80:
+        return SMALL_VARINTS[value]
+    out = bytearray()
+    write_varint(out, value)
+    return bytes(out)
+
+
+class Decoder:
+    # Reads the values of one record. buffer holds exactly the record's
+    # payload, so running off its end means the file is damaged. Varints
+    # below 128, which most tags, string indexes and small ints are, are
+    # read inline.
+    def __init__(self, buffer, strings, tokens=None, formats=None):
+        self.buffer = buffer
+        self.pos = 0
+        self.strings = strings
+        # IR token code -> text and string index -> PrintfFormat, shared by
+        # the records of one file
+        self.tokens = {} if tokens is None else tokens
+        self.formats = {} if formats is None else formats
+
+    def varint(self):
+        try:
+            return self._varint()
+        except IndexError:
+            raise ArtifactError("Error: Artifact record is truncated.") from None
+
+    def _varint(self):
+        buffer = self.buffer
+        result = shift = 0
+        while True:
+            byte = buffer[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def string(self):
+        return self.strings[self.varint()]
+
+    def value(self):
+        try:
+            return self._value()
+        except IndexError:
+            raise ArtifactError("Error: Artifact record is truncated.") from None
+
+    def _value(self):
+        # Explicit stack, like the writer: items collects the values of the
+        # innermost open list or node until it has count of them.
+        buffer, strings = self.buffer, self.strings
+        pos = self.pos
+        frames = []
+        items, count, spec = [], 1, None
+        while True:
+            if len(items) == count:
+                if not frames:
+                    self.pos = pos
+                    return items[0]
+                value = items
+                if spec is not None:
+                    value = object.__new__(spec[0])
+                    value.__dict__ = dict(zip(spec[1], items))
+                items, count, spec = frames.pop()
+                items.append(value)
+                continue
+            tag = buffer[pos]
+            pos += 1
+            if tag >= NODE_TAG:
+                frames.append((items, count, spec))
+                spec = NODE_FIELDS[tag - NODE_TAG]
+                items, count = [], len(spec[1])
+                continue
+            if tag == NONE:
+                items.append(None)
+                continue
+            if tag == FLOAT:
+                items.append(DOUBLE.unpack_from(buffer, pos)[0])
+                pos += DOUBLE.size
+                continue
+            if tag == FALSE or tag == TRUE:
+                items.append(tag == TRUE)
+                continue
+            number = buffer[pos]
+            pos += 1
+            if number >= 0x80:
+                self.pos = pos - 1
+                number = self._varint()
+                pos = self.pos
+            if tag == STR:
+                items.append(strings[number])
+            elif tag == INT:
+                items.append(number >> 1 if not number & 1 else -((number + 1) >> 1))
+            elif tag == LIST:
+                frames.append((items, count, spec))
+                items, count, spec = [], number, None
+            elif tag == FORMAT:
+                compiled = self.formats.get(number)
+                if compiled is None:
+                    compiled = self.formats[number] = PrintfFormat(strings[number])
+                items.append(compiled)
+            else:
+                raise ArtifactError(f"Error: Unknown artifact value tag {tag}.")
+
+    def instructions(self):
+        # Tokens with the low bit set are int literals, the others interned strings
+        try:
+            return self._instructions()
+        except IndexError:
+            raise ArtifactError("Error: Artifact record is truncated.") from None
+
+    def _instructions(self):
+        buffer, strings, tokens = self.buffer, self.strings, self.tokens
+        listing = []
+        for _ in range(self._varint()):
+            parts = []
+            count = buffer[self.pos]
+            if count < 0x80:
+                self.pos += 1
+            else:
+                count = self._varint()
+            for _ in range(count):
+                pos = self.pos
+                code = buffer[pos]
+                if code < 0x80:
+                    self.pos = pos + 1
+                else:
+                    code = self._varint()
+                text = tokens.get(code)
+                if text is None:
+                    text = tokens[code] = str(unzigzag(code >> 1)) if code & 1 else strings[code >> 1]
+                parts.append(text)
+            listing.append(' '.join(parts))
+        return listing
+
+
+class ArtifactWriter:
+    # Writes an artifact file record by record: the AST one top-level
+    # statement or function at a time, symbol tables and IR listings in
+    # chunks. Strings are interned across the whole file and each record is
+    # preceded by the strings it introduces, so the file can be read back
+    # as a stream; close() appends an index for random access.
+    def __init__(self, stream):
+        self.stream = stream
+        self.strings = {}
+        self.pending = []
+        # IR token -> its encoded bytes
+        self.tokens = {}
+        self.index = []
+        self.offset = 0
+        self._write(MAGIC + varint_bytes(VERSION))
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.offset += len(data)
+
+    def _record(self, kind, payload):
+        if self.pending:
+            strings = bytearray()
+            write_varint(strings, len(self.pending))
+            for text in self.pending:
+                data = text.encode('utf-8')
+                write_varint(strings, len(data))
+                strings += data
+            self.pending = []
+            self._record(STRINGS, strings)
+        self.index.append((kind, self.offset))
+        self._write(bytes([kind]) + varint_bytes(len(payload)))
+        self._write(payload)
+
+    def _intern(self, text):
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+            self.pending.append(text)
+        return index
+
+    def _value(self, out, value):
+        # Explicit stack, so deep expression trees do not hit the recursion limit
+        strings, append = self.strings, out.append
+        stack = [value]
+        while stack:
+            value = stack.pop()
+            kind = type(value)
+            if kind is str:
+                index = strings.get(value)
+                if index is None:
+                    index = self._intern(value)
+                append(STR)
+                if index < 0x80:
+                    append(index)
+                else:
+                    write_varint(out, index)
+            elif kind in NODE_TAGS:
+                tag = NODE_TAGS[kind]
+                append(NODE_TAG + tag)
+                attributes = value.__dict__
+                stack.extend([attributes.get(field) for field in REVERSED_FIELDS[tag]])
+            elif value is None:
+                append(NONE)
+            elif kind is int:
+                append(INT)
+                if 0 <= value < 0x40:
+                    append(value << 1)
+                else:
+                    write_varint(out, zigzag(value))
+            elif kind is list:
+                append(LIST)
+                write_varint(out, len(value))
+                stack.extend(reversed(value))
+            elif kind is float:
+                append(FLOAT)
+                out += DOUBLE.pack(value)
+            elif kind is bool:
+                append(TRUE if value else FALSE)
+            elif kind is PrintfFormat:
+                append(FORMAT)
+                write_varint(out, self._intern(value.format_str))
+            else:
+                raise ArtifactError(f"Error: Cannot store {kind.__name__} in an artifact.")
+
+    def write_program(self, program):
+        payload = bytearray()
+        self._value(payload, program)
+        self._record(PROGRAM, payload)
+        for stmt in program.statements:
+            self.write_statement(stmt)
+        for function in program.functions:
+            self.write_function(function)
+
+    def write_statement(self, stmt):
+        payload = bytearray()
+        self._value(payload, stmt)
+        self._record(STATEMENT, payload)
+
+    def write_function(self, function):
+        # The name comes first so the reader can index functions cheaply
+        payload = bytearray(varint_bytes(self._intern(function.name)))
+        self._value(payload, function)
+        self._record(FUNCTION, payload)
+
+    def write_symbols(self, function, table):
+        # function is None for main
+        payload = bytearray()
+        self._value(payload, function)
+        write_varint(payload, len(table.entries))
+        for symbol in table.entries:
+            self._value(payload, [symbol.name, symbol.datatype, symbol.size, symbol.depth, symbol.slot,
+                                  symbol.ir_name])
+        self._record(SYMBOLS, payload)
+
+    def write_ir(self, name, ir):
+        tokens = self.tokens
+        for start in range(0, len(ir), IR_CHUNK) or [0]:
+            chunk = ir[start:start + IR_CHUNK]
+            pieces = [varint_bytes(self._intern(name)), varint_bytes(len(chunk))]
+            for instr in chunk:
+                parts = instr.split(' ')
+                pieces.append(varint_bytes(len(parts)))
+                for part in parts:
+                    code = tokens.get(part)
+                    if code is None:
+                        if INT_RE.match(part):
+                            code = tokens[part] = varint_bytes(zigzag(int(part)) << 1 | 1)
+                        else:
+                            code = tokens[part] = varint_bytes(self._intern(part) << 1)
+                    pieces.append(code)
+            self._record(IR, b''.join(pieces))
+
+    def write_lines(self, name, table):
+        # The LineTable of the IR listing called name, run by run
+        payload = bytearray(varint_bytes(self._intern(name)))
+        write_varint(payload, len(table.runs))
+        for value in table.runs:
+            write_varint(payload, zigzag(value))
+        self._record(LINES, payload)
+
+    def close(self):
+        # Kinds, and offsets as deltas from the previous record
+        payload = bytearray()
+        write_varint(payload, len(self.index))
+        previous = 0
+        for kind, offset in self.index:
+            payload.append(kind)
+            write_varint(payload, offset - previous)
+            previous = offset
+        position = self.offset
+        self._record(INDEX, payload)
+        self._write(TRAILER.pack(position, MAGIC))
+
+
+class ArtifactReader:
+    # Random access over a complete artifact file held in a bytes-like
+    # buffer or an mmap. Only the index and the string table are read up
+    # front; statements, functions and IR chunks are copied out of the
+    # buffer and decoded when asked for.
+    def __init__(self, buffer):
+        self.buffer = buffer
+        magic = bytes(buffer[:len(MAGIC)])
+        check_header(magic, Decoder(bytes(buffer[len(MAGIC):len(MAGIC) + 10]), []).varint() if magic == MAGIC else None)
+        if len(buffer) < TRAILER.size:
+            raise ArtifactError("Error: Artifact file is truncated.")
+        position, magic = TRAILER.unpack_from(buffer, len(buffer) - TRAILER.size)
+        if magic != MAGIC:
+            raise ArtifactError("Error: Artifact file has no index; it was not closed.")
+        self.strings = []
+        self.tokens = {}
+        self.formats = {}
+        kind, decoder = self._open(position)
+        if kind != INDEX:
+            raise ArtifactError("Error: Artifact index is damaged.")
+        self.records = {kind: [] for kind in (STRINGS, PROGRAM, STATEMENT, FUNCTION, SYMBOLS, IR, LINES)}
+        offset = 0
+        for _ in range(decoder.varint()):
+            kind = decoder.varint()
+            offset += decoder.varint()
+            if kind not in self.records:
+                raise ArtifactError("Error: Artifact index is damaged.")
+            self.records[kind].append(offset)
+        for offset in self.records[STRINGS]:
+            read_strings(self._open(offset)[1], self.strings)
+        self.functions = {}
+        for offset in self.records[FUNCTION]:
+            self.functions[self._open(offset)[1].string()] = offset
+        self.ir_chunks = {}
+        for offset in self.records[IR]:
+            decoder = self._open(offset)[1]
+            self.ir_chunks.setdefault(decoder.string(), []).append((offset, decoder.varint()))
+        self.line_tables = {}
+        for offset in self.records[LINES]:
+            self.line_tables[self._open(offset)[1].string()] = offset
+        self.cache = {}
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as source:
+            return cls(mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _open(self, offset):
+        # The record's kind and a decoder over a copy of its payload
+        header = Decoder(self.buffer[offset:offset + 10], [])
+        kind = header.varint()
+        length = header.varint()
+        start = offset + header.pos
+        if start + length > len(self.buffer):
+            raise ArtifactError("Error: Artifact file is truncated.")
+        return kind, Decoder(self.buffer[start:start + length], self.strings, self.tokens, self.formats)
+
+    @property
+    def statement_count(self):
+        return len(self.records[STATEMENT])
+
+    def statement(self, i):
+        return self._open(self.records[STATEMENT][i])[1].value()
+
+    def function_names(self):
+        return list(self.functions)
+
+    def function(self, name):
+        decoder = self._open(self.functions[name])[1]
+        decoder.string()
+        return decoder.value()
+
+    def program(self):
+        if not self.records[PROGRAM]:
+            raise ArtifactError("Error: Artifact holds no AST.")
+        program = self._open(self.records[PROGRAM][0])[1].value()
+        program.statements = [self.statement(i) for i in range(self.statement_count)]
+        program.functions = [self.function(name) for name in self.functions]
+        return program
+
+    def symbols(self):
+        # {function name or None for main: SymbolTable}
+        tables = {}
+        for offset in self.records[SYMBOLS]:
+            decoder = self._open(offset)[1]
+            function = decoder.value()
+            tables[function] = read_table(decoder)
+        return tables
+
+    def ir_names(self):
+        return list(self.ir_chunks)
+
+    def ir_length(self, name):
+        return sum(count for _, count in self.ir_chunks[name])
+
+    def ir(self, name):
+        return [instr for offset, _ in self.ir_chunks[name] for instr in self._chunk(offset)]
+
+    def instruction(self, name, i):
+        for offset, count in self.ir_chunks[name]:
+            if i < count:
+                return self._chunk(offset)[i]
+            i -= count
+        raise IndexError(i)
+
+    def lines(self, name):
+        # LineTable of an IR listing; entries have line 0 when none was stored
+        if name not in self.line_tables:
+            return LineTable.filled(self.ir_length(name))
+        decoder = self._open(self.line_tables[name])[1]
+        decoder.string()
+        return read_lines(decoder)
+
+    def _chunk(self, offset):
+        chunk = self.cache.get(offset)
+        if chunk is None:
+            decoder = self._open(offset)[1]
+            decoder.string()
+            chunk = self.cache[offset] = decoder.instructions()
+        return chunk
+
+
+def check_header(magic, version):
+    if magic != MAGIC:
+        raise ArtifactError("Error: Not an artifact file.")
+    if version != VERSION:
+        raise ArtifactError(f"Error: Artifact format version {version} is not supported (expected {VERSION}).")
+
+
+def read_strings(decoder, strings):
+    for _ in range(decoder.varint()):
+        length = decoder.varint()
+        strings.append(decoder.buffer[decoder.pos:decoder.pos + length].decode('utf-8'))
+        decoder.pos += length
+
+
+def read_table(decoder):
+    table = SymbolTable()
+    for _ in range(decoder.varint()):
+        name, datatype, size, depth, slot, ir_name = decoder.value()
+        table.entries.append(Symbol(name, datatype, depth, slot, ir_name, size))
+    return table
+
+
+def read_lines(decoder):
+    return LineTable.from_runs([unzigzag(decoder.varint()) for _ in range(decoder.varint())])
+
+
+def read_stream(stream):
+    # Decodes records as they are read from a file object, without seeking:
+    # yields ("program", Program without its body), ("statement", node),
+    # ("function", FunctionDef), ("symbols", (function, SymbolTable)),
+    # ("ir", (name, instructions)) and ("lines", (name, LineTable)) in the
+    # order they were written.
+    def read_varint():
+        result = shift = 0
+        while True:
+            byte = stream.read(1)
+            if not byte:
+                raise ArtifactError("Error: Artifact file is truncated.")
+            result |= (byte[0] & 0x7f) << shift
+            if byte[0] < 0x80:
+                return result
+            shift += 7
+
+    magic = stream.read(len(MAGIC))
+    check_header(magic, read_varint() if magic == MAGIC else None)
+    strings = []
+    tokens = {}
+    formats = {}
+    while True:
+        kind = read_varint()
+        length = read_varint()
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise ArtifactError("Error: Artifact file is truncated.")
+        decoder = Decoder(payload, strings, tokens, formats)
+        if kind == INDEX:
+            return
+        if kind == STRINGS:
+            read_strings(decoder, strings)
+        elif kind == PROGRAM:
+            program = decoder.value()
+            program.statements, program.functions = [], []
+            yield "program", program
+        elif kind == STATEMENT:
+            yield "statement", decoder.value()
+        elif kind == FUNCTION:
+            decoder.string()
+            yield "function", decoder.value()
+        elif kind == SYMBOLS:
+            function = decoder.value()
+            yield "symbols", (function, read_table(decoder))
+        elif kind == IR:
+            name = decoder.string()
+            yield "ir", (name, decoder.instructions())
+        elif kind == LINES:
+            name = decoder.string()
+            yield "lines", (name, read_lines(decoder))
+        else:
+            raise ArtifactError(f"Error: Unknown artifact record kind {kind}.")
+
+
+def write_compilation(stream, result):
+    # The optimized AST, every symbol table and both IR listings of a
+    # Compilation, with their line tables
+    writer = ArtifactWriter(stream)
+    writer.write_program(result.ast_optimized)
+    writer.write_symbols(None, result.sem.table)
+    for function, table in result.sem.tables.items():
+        writer.write_symbols(function, table)
+    writer.write_ir("ir", result.ir_before)
+    writer.write_ir("ir-opt", result.ir)
+    writer.write_lines("ir", result.ir_before_lines)
+    writer.write_lines("ir-opt", result.ir_lines)
+    writer.close()
+
+
+def save_compilation(path, result):
+    with open(path, 'wb') as out:
+        write_compilation(out, result)
@@ -1,80 +1,177 @@
-class Program:
-    def __init__(self, statements):
+class Node:
+    # First and last source line of the node's tokens, set by the parser;
+    # nodes built later by the compiler keep None unless given one.
+    line = None
+    end_line = None
+
+class Program(Node):
+    def __init__(self, statements, functions=None):
+        # statements is the body of main; functions holds every other definition
         self.statements = statements
+        self.functions = functions or []
+        # Filled in by the semantic analyzer
+        self.frame_size = 0
+        self.slot_names = []
     def __repr__(self):
+        if self.functions:
+            return f"Program({self.statements}, {self.functions})"
         return f"Program({self.statements})"
 
-class Block:
+class FunctionDef(Node):
+    def __init__(self, return_type, name, params, body):
+        self.return_type = return_type
+        self.name = name
+        # Parameters are Declarations without initializers
+        self.params = params
+        self.body = body
+        self.frame_size = 0
+        self.slot_names = []
+    def __repr__(self):
+        return f"FunctionDef({self.return_type}, {self.name}, {self.params}, {self.body})"
+
+class Block(Node):
     def __init__(self, statements):
         self.statements = statements
     def __repr__(self):
         return f"Block({self.statements})"
 
-class Declaration:
-    def __init__(self, datatype, name, init_value=None):
+class Declaration(Node):
+    def __init__(self, datatype, name, init_value=None, size=None):
         self.datatype = datatype
         self.name = name
         self.init_value = init_value
+        # Element count for "int a[N]"; None for scalars
+        self.size = size
+        self.slot = None
     def __repr__(self):
+        if self.size is not None:
+            return f"Declaration({self.datatype}, {self.name}[{self.size}])"
         return f"Declaration({self.datatype}, {self.name}, {self.init_value})"
 
-class Assignment:
+class Assignment(Node):
     def __init__(self, name, expr):
         self.name = name
         self.expr = expr
+        self.slot = None
     def __repr__(self):
         return f"Assignment({self.name}, {self.expr})"
 
-class PrintStatement:
+class IndexAssignment(Node):
+    def __init__(self, name, index, expr):
+        self.name = name
+        self.index = index
+        self.expr = expr
+        self.slot = None
+        self.size = None
+    def __repr__(self):
+        return f"IndexAssignment({self.name}[{self.index}], {self.expr})"
+
+class PrintStatement(Node):
     def __init__(self, expr):
         self.expr = expr
     def __repr__(self):
         return f"Print({self.expr})"
 
-class PrintfStatement:
+class PrintfStatement(Node):
     def __init__(self, format_str, args):
         self.format_str = format_str
         self.args = args
+        # Parsed PrintfFormat, filled in by the semantic analyzer
+        self.compiled = None
     def __repr__(self):
         return f"Printf({self.format_str}, {self.args})"
 
-class ReturnStatement:
+class ReturnStatement(Node):
     def __init__(self, return_val=None):
         self.return_val = return_val
     def __repr__(self):
         return f"Return({self.return_val})"
 
-class IfStatement:
-    def __init__(self, condition, then_block, else_block=None):
+class IfStatement(Node):
+    def __init__(self, condition, then_block, else_block=None, site=None):
         self.condition = condition
         self.then_block = then_block
         self.else_block = else_block
+        # Source location key for execution profiles, e.g. "if@12"
+        self.site = site
     def __repr__(self):
         return f"If({self.condition}, {self.then_block}, {self.else_block})"
 
-class WhileStatement:
-    def __init__(self, condition, body):
+class WhileStatement(Node):
+    def __init__(self, condition, body, site=None, trips=None):
         self.condition = condition
         self.body = body
+        self.site = site
+        # Iterations per entry, when the pass that built the loop knows them
+        self.trips = trips
     def __repr__(self):
         return f"While({self.condition}, {self.body})"
 
-class BinaryOp:
-    def __init__(self, left, op, right):
+class ExpressionStatement(Node):
+    def __init__(self, expr):
+        self.expr = expr
+    def __repr__(self):
+        return f"ExpressionStatement({self.expr})"
+
+class ForStatement(Node):
+    def __init__(self, init, condition, step, body, site=None):
+        # init and step are statements or None; a missing condition is always true
+        self.init = init
+        self.condition = condition
+        self.step = step
+        self.body = body
+        self.site = site
+    def __repr__(self):
+        return f"For({self.init}, {self.condition}, {self.step}, {self.body})"
+
+class BinaryOp(Node):
+    def __init__(self, left, op, right, ctype=None, optype=None):
         self.left = left
         self.op = op
         self.right = right
+        # ctype is the result type, optype the type both operands share
+        self.ctype = ctype
+        self.optype = optype
     def __repr__(self):
         return f"({self.left} {self.op} {self.right})"
 
-class Number:
+class Cast(Node):
+    def __init__(self, ctype, expr):
+        self.ctype = ctype
+        self.expr = expr
+    def __repr__(self):
+        return f"({self.ctype}){self.expr}"
+
+class Call(Node):
+    def __init__(self, name, args, ctype=None):
+        self.name = name
+        self.args = args
+        self.ctype = ctype
+    def __repr__(self):
+        return f"{self.name}({', '.join(map(repr, self.args))})"
+
+class Index(Node):
+    def __init__(self, name, index, ctype=None):
+        self.name = name
+        self.index = index
+        self.ctype = ctype
+        # Resolved by the semantic analyzer
+        self.slot = None
+        self.size = None
+    def __repr__(self):
+        return f"{self.name}[{self.index}]"
+
+class Number(Node):
     def __init__(self, value):
         self.value = value
+        self.ctype = 'float' if isinstance(value, float) else 'int'
     def __repr__(self):
         return str(self.value)
 
-class Identifier:
-    def __init__(self, name):
+class Identifier(Node):
+    def __init__(self, name, ctype=None):
         self.name = name
+        self.ctype = ctype
+        self.slot = None
     def __repr__(self):
         return self.name
@@ -0,0 +1,411 @@
+import io
+import json
+import mmap
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+
+from ast_nodes import *
+from artifacts import NODE_FIELDS, NODE_TAGS, ArtifactReader, write_compilation
+from interpreter import Interpreter
+from ir_generator import IRGenerator
+from lexer import Lexer
+from optimizer import Optimizer
+from printf_format import PrintfFormat
+from semantic_analyzer import SemanticAnalyzer
+from visitor import NodeVisitor
+
+
+class NodeCounter(NodeVisitor):
+    def __init__(self, iterative=True):
+        self.iterative = iterative
+        self.count = 0
+
+    def generic_visit(self, node):
+        self.count += 1
+        for child in children(node):
+            yield child
+
+    def visit_Number(self, node):
+        self.count += 1
+
+    def visit_Identifier(self, node):
+        self.count += 1
+
+
+class PlainCounter(NodeVisitor):
+    # Cached dispatch with ordinary recursion, for comparison.
+    def __init__(self):
+        self.count = 0
+
+    def generic_visit(self, node):
+        self.count += 1
+        for child in children(node):
+            self.visit(child)
+
+    def visit_Number(self, node):
+        self.count += 1
+
+    def visit_Identifier(self, node):
+        self.count += 1
+
+
+class LegacyCounter:
+    # The per-node f-string + hasattr/getattr dispatch the passes used before.
+    def __init__(self):
+        self.count = 0
+
+    def visit(self, node):
+        method = f"visit_{node.__class__.__name__}"
+        if hasattr(self, method):
+            return getattr(self, method)(node)
+        self.count += 1
+        for child in children(node):
+            self.visit(child)
+
+    def visit_Number(self, node):
+        self.count += 1
+
+    def visit_Identifier(self, node):
+        self.count += 1
+
+
+def children(node):
+    if isinstance(node, Program):
+        return node.statements + node.functions
+    if isinstance(node, Block):
+        return node.statements
+    if isinstance(node, FunctionDef):
+        return node.params + [node.body]
+    if isinstance(node, Call):
+        return node.args
+    if isinstance(node, ExpressionStatement):
+        return [node.expr]
+    if isinstance(node, Index):
+        return [node.index]
+    if isinstance(node, IndexAssignment):
+        return [node.index, node.expr]
+    if isinstance(node, Declaration):
+        return [node.init_value] if node.init_value else []
+    if isinstance(node, (Assignment, Cast)):
+        return [node.expr]
+    if isinstance(node, BinaryOp):
+        return [node.left, node.right]
+    if isinstance(node, PrintfStatement):
+        return node.args
+    if isinstance(node, ReturnStatement):
+        return [node.return_val] if node.return_val else []
+    if isinstance(node, IfStatement):
+        return [node.condition, node.then_block] + ([node.else_block] if node.else_block else [])
+    if isinstance(node, WhileStatement):
+        return [node.condition, node.body]
+    if isinstance(node, ForStatement):
+        return [stmt for stmt in (node.init, node.condition, node.step) if stmt] + [node.body]
+    return []
+
+
+def build_program(statements=200, depth=20):
+    # Straight-line code over a handful of variables, with expressions deep
+    # enough that traversal rather than per-statement setup dominates.
+    body = [Declaration('int', f"v{i}", Number(i)) for i in range(4)]
+    for i in range(statements):
+        expr = Identifier(f"v{i % 4}")
+        for j in range(depth):
+            expr = BinaryOp(expr, '+' if j % 2 else '*', Identifier(f"v{j % 4}") if j % 3 else Number(j))
+        body.append(Assignment(f"v{(i + 1) % 4}", BinaryOp(expr, '%', Number(1000))))
+    body.append(ReturnStatement(Number(0)))
+    return Program(body)
+
+
+def measure(label, make, run, nodes, repeat):
+    best = None
+    for _ in range(repeat):
+        subject = make()
+        start = time.perf_counter()
+        run(subject)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<24} {best * 1000:>9.2f} ms {nodes / best:>14,.0f} nodes/s")
+
+
+def analyzed_program(statements, depth):
+    program = build_program(statements, depth)
+    SemanticAnalyzer().analyze(program)
+    return program
+
+
+def main(statements=200, depth=20, repeat=5):
+    program = build_program(statements, depth)
+    counter = NodeCounter()
+    counter.visit(program)
+    nodes = counter.count
+    print(f"{nodes} nodes, best of {repeat}")
+
+    measure("legacy getattr dispatch", LegacyCounter, lambda v: v.visit(program), nodes, repeat)
+    measure("cached dispatch", PlainCounter, lambda v: v.visit(program), nodes, repeat)
+    measure("visitor (recursive)", lambda: NodeCounter(iterative=False), lambda v: v.visit(program), nodes, repeat)
+    measure("visitor (explicit stack)", NodeCounter, lambda v: v.visit(program), nodes, repeat)
+    measure("SemanticAnalyzer", lambda: build_program(statements, depth),
+            lambda p: SemanticAnalyzer().analyze(p), nodes, repeat)
+    measure("IRGenerator", lambda: analyzed_program(statements, depth),
+            lambda p: IRGenerator().generate(p), nodes, repeat)
+    measure("Interpreter", lambda: analyzed_program(statements, depth),
+            lambda p: Interpreter().run(p), nodes, repeat)
+    measure("Optimizer.optimize_ast", lambda: analyzed_program(statements, depth),
+            lambda p: Optimizer().optimize_ast(p), nodes, repeat)
+
+
+def generate_source(path, megabytes):
+    # Machine-generated straight-line code, the kind of input the mmap path is for.
+    chunk = ''.join(f"    v{i % 4} = (v{(i + 1) % 4} + {i}) % 1000;\n" for i in range(1000))
+    with open(path, 'w') as out:
+        out.write("int main() {\n" + ''.join(f"    int v{i} = {i};\n" for i in range(4)))
+        while out.tell() < megabytes << 20:
+            out.write(chunk)
+        out.write("    return v0;\n}\n")
+
+
+def lex_child(mode, path):
+    import resource
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "text":
+        with open(path) as source:
+            count = len(Lexer(source.read()).tokenize())
+    else:
+        with open(path, 'rb') as source:
+            buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        lexer = Lexer(buffer)
+        count = len(lexer.tokenize()) if mode == "mmap" else sum(1 for _ in lexer.iter_tokens())
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    print(count, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+
+
+def lex_main(megabytes=50):
+    # Each mode runs in its own process so peak RSS is not shared between them.
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "generated.c")
+        generate_source(path, megabytes)
+        size = os.path.getsize(path)
+        print(f"{size / 2 ** 20:.1f} MB source")
+        for mode in ("text", "mmap", "stream"):
+            output = subprocess.run([sys.executable, __file__, "lex-child", mode, path],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            count, elapsed, peak = int(output[0]), float(output[1]), int(output[2]) * 1024
+            print(f"{mode:<8} {elapsed * 1000:>9.0f} ms {count / elapsed:>12,.0f} tokens/s "
+                  f"{peak / 2 ** 20:>8.1f} MB peak RSS {peak / size:>6.2f}x file size")
+
+
+def json_value(value):
+    # Nodes as {"node": tag, "fields": [...]}, the nearest JSON equivalent of the artifact format
+    if isinstance(value, list):
+        return [json_value(item) for item in value]
+    tag = NODE_TAGS.get(type(value))
+    if tag is not None:
+        return {"node": tag, "fields": [json_value(getattr(value, field)) for field in NODE_FIELDS[tag][1]]}
+    return value.format_str if isinstance(value, PrintfFormat) else value
+
+
+def from_json(value):
+    if isinstance(value, list):
+        return [from_json(item) for item in value]
+    if isinstance(value, dict):
+        cls, fields = NODE_FIELDS[value["node"]]
+        node = cls.__new__(cls)
+        node.__dict__.update(zip(fields, map(from_json, value["fields"])))
+        return node
+    return value
+
+
+def json_tables(result):
+    tables = [("main", result.sem.table)] + list(result.sem.tables.items())
+    return {name: [vars(symbol) for symbol in table.entries] for name, table in tables}
+
+
+def artifacts_main(lines=5000, repeat=5):
+    # One compilation stored as an artifact, a pickle and JSON: the AST,
+    # every symbol table and both IR listings.
+    from compiler import compile_source
+    source = ("#include <stdio.h>\nint main() {\n" + ''.join(f"    int v{i} = {i};\n" for i in range(4))
+              + ''.join(f"    v{i % 4} = (v{(i + 1) % 4} + {i}) % 1000;\n    printf(\"%d\\n\", v{i % 4});\n"
+                        for i in range(lines)) + "    return v0;\n}\n")
+    result = compile_source(source, level=0)
+    program = result.ast_optimized
+    print(f"{len(result.ir_before) + len(result.ir)} IR instructions, best of {repeat}")
+
+    def artifact_dump():
+        out = io.BytesIO()
+        write_compilation(out, result)
+        return out.getvalue()
+
+    def artifact_load(data):
+        reader = ArtifactReader(data)
+        return reader.program(), reader.symbols(), reader.ir("ir"), reader.ir("ir-opt")
+
+    def lazy_load(data):
+        reader = ArtifactReader(data)
+        return reader.instruction("ir-opt", len(result.ir) // 2)
+
+    def json_dump():
+        return json.dumps({"ast": json_value(program), "statements": json_value(program.statements),
+                           "functions": json_value(program.functions), "symbols": json_tables(result),
+                           "ir": result.ir_before, "ir-opt": result.ir}).encode()
+
+    def json_load(data):
+        loaded = json.loads(data)
+        program = from_json(loaded["ast"])
+        program.statements, program.functions = from_json(loaded["statements"]), from_json(loaded["functions"])
+        return program, loaded["symbols"], loaded["ir"], loaded["ir-opt"]
+
+    def pickle_dump():
+        return pickle.dumps((program, result.sem.table, result.sem.tables, result.ir_before, result.ir),
+                            pickle.HIGHEST_PROTOCOL)
+
+    formats = [("artifact", artifact_dump, artifact_load), ("artifact (one instr)", artifact_dump, lazy_load),
+               ("pickle", pickle_dump, pickle.loads), ("json", json_dump, json_load)]
+    for label, dump, load in formats:
+        data = dump()
+        timings = []
+        for run in (dump, lambda: load(data)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        print(f"{label:<22} {len(data) / 1024:>9.1f} KB write {timings[0] * 1000:>8.2f} ms "
+              f"read {timings[1] * 1000:>8.2f} ms")
+
+
+def watch_main(files=5000):
+    # A tree of small sources behind one header: the first build, a scan
+    # with nothing to do, a one-file edit, a header edit that touches a
+    # tenth of the files, and a restart that finds its outputs current.
+    from watch import Watcher
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, "src")
+        for i in range(files):
+            os.makedirs(os.path.join(root, f"d{i // 100}"), exist_ok=True)
+            include = '#include "../shared.h"\n' if i % 10 == 0 else ''
+            with open(os.path.join(root, f"d{i // 100}", f"f{i}.c"), 'w') as out:
+                out.write(f"#include <stdio.h>\n{include}int main() {{\n    int s = 0;\n"
+                          f"    for (int i = 0; i < {i % 50 + 1}; i = i + 1) {{ s = s + i * {i % 7}; }}\n"
+                          f"    printf(\"%d\\n\", s);\n    return 0;\n}}\n")
+        with open(os.path.join(root, "shared.h"), 'w') as out:
+            out.write("#define SHARED 1\n")
+
+        def timed(label, run):
+            start = time.perf_counter()
+            results = run()
+            elapsed = time.perf_counter() - start
+            print(f"{label:<28} {len(results):>6} rebuilt {elapsed * 1000:>10.1f} ms")
+
+        out_dir = os.path.join(directory, "build")
+        watcher = Watcher(root, out_dir, report=lambda line: None)
+        print(f"{files} files")
+        timed("first build", watcher.once)
+        timed("scan, nothing changed", lambda: watcher.scan() and watcher.build() or [])
+        with open(os.path.join(root, "d0", "f1.c"), 'a') as out:
+            out.write("int unused() { return 1; }\n")
+        timed("one file edited", lambda: watcher.scan() and watcher.build())
+        with open(os.path.join(root, "shared.h"), 'w') as out:
+            out.write("#define SHARED 2\n")
+        timed("shared header edited", lambda: watcher.scan() and watcher.build())
+        timed("restart", Watcher(root, out_dir, report=lambda line: None).once)
+
+
+JIT_PROGRAMS = {
+    "collatz": """#include <stdio.h>
+int main() {
+    int longest = 0;
+    int n = 1;
+    while (n < %(n)d) {
+        int x = n;
+        int length = 0;
+        while (x != 1) {
+            if (x %% 2 == 0) { x = x / 2; } else { x = 3 * x + 1; }
+            length = length + 1;
+        }
+        if (length > longest) { longest = length; }
+        n = n + 1;
+    }
+    printf("%%d\\n", longest);
+    return 0;
+}
+""",
+    "sieve": """#include <stdio.h>
+int main() {
+    int composite[%(n)d];
+    int count = 0;
+    for (int i = 2; i < %(n)d; i = i + 1) {
+        if (composite[i] == 0) {
+            count = count + 1;
+            for (int j = i * 2; j < %(n)d; j = j + i) { composite[j] = 1; }
+        }
+    }
+    printf("%%d\\n", count);
+    return 0;
+}
+""",
+    "float": """#include <stdio.h>
+int main() {
+    float x = 0.5;
+    float total = 0.0;
+    int i = 0;
+    while (i < %(n)d) {
+        x = x * 3.7 * (1.0 - x);
+        total = total + x;
+        i = i + 1;
+    }
+    printf("%%f\\n", total);
+    return 0;
+}
+""",
+}
+
+
+def jit_main(n=20000, repeat=3):
+    # RUN-mode time of loop-heavy programs with hot loops traced and with
+    # everything interpreted.
+    from compiler import compile_source
+    from ir_executor import IRExecutor
+    print(f"n = {n}, best of {repeat}")
+    print(f"{'program':<10} {'level':>5} {'interpreted':>14} {'traced':>12} {'speedup':>8}  jit")
+    for name, template in JIT_PROGRAMS.items():
+        for level in (0, 2):
+            result = compile_source(template % {"n": n}, level=level)
+            timings = []
+            for jit in (False, True):
+                best = None
+                for _ in range(repeat):
+                    executor = IRExecutor(jit=jit)
+                    start = time.perf_counter()
+                    executor.run(result.ir)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best)
+            stats = executor.jit_stats
+            traced = stats.traced_steps * 100 // max(stats.steps, 1)
+            print(f"{name:<10} {'-O%d' % level:>5} {timings[0] * 1000:>11.1f} ms {timings[1] * 1000:>9.1f} ms "
+                  f"{timings[0] / timings[1]:>7.1f}x  {stats.traces} trace(s), {stats.bridges} bridge(s), "
+                  f"{sum(stats.exits.values())} exits, {traced}% of steps traced")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["lex"]:
+        lex_main(*map(int, sys.argv[2:]))
+    elif sys.argv[1:2] == ["artifacts"]:
+        artifacts_main(*map(int, sys.argv[2:]))
+    elif sys.argv[1:2] == ["watch"]:
+        watch_main(*map(int, sys.argv[2:]))
+    elif sys.argv[1:2] == ["jit"]:
+        jit_main(*map(int, sys.argv[2:]))
+    elif sys.argv[1:2] == ["lex-child"]:
+        lex_child(*sys.argv[2:])
+    else:
+        main(*map(int, sys.argv[1:]))
@@ -1,8 +1,31 @@
+from itertools import repeat
+
+from ir_analysis import decode, is_constant
+from line_table import LineTable, line_marker, strip_lines
+from peephole import PeepholeOptimizer
+
+# Typed IR opcodes to mnemonics; float arithmetic uses the SSE scalar forms.
+ASM_OPS = {
+    '+': 'add', '-': 'sub', '*': 'imul', '/': 'idiv',
+    '<<': 'shl', '>>': 'sar', '&': 'and',
+    'f+': 'addsd', 'f-': 'subsd', 'f*': 'mulsd', 'f/': 'divsd',
+    'itof': 'cvtsi2sd', 'ftoi': 'cvttsd2si',
+}
+
+REGISTERS = [f"r{i}" for i in range(8)]
+# At most this many of the hottest names keep a register of their own
+PINNED_REGISTERS = 4
+
 class CodeGenerator:
-    def __init__(self):
+    def __init__(self, peephole=True, hot=None):
         self.register_count = 0
+        # Names ordered hottest first (from an execution profile)
+        self.hot = hot or []
+        self.registers = REGISTERS
         self.assembly_code = []
+        self.assembly_lines = LineTable()
         self.pseudocode = []
+        self.peephole = PeepholeOptimizer() if peephole else None
     
     def generate_pseudocode(self, ir_code):
         self.pseudocode = []
@@ -13,25 +36,29 @@ class CodeGenerator:
             if not instruction:
                 continue
             
+            ins = decode(instruction)
             if instruction.endswith(':'):
                 self.pseudocode.append(f"\n{instruction}")
-            elif instruction.startswith('if_false'):
-                parts = instruction.split()
-                var = parts[1]
-                label = parts[-1]
-                self.pseudocode.append(f"    if NOT {var} goto {label}")
-            elif instruction.startswith('goto'):
-                label = instruction.split()[-1]
-                self.pseudocode.append(f"    goto {label}")
-            elif 'printf' in instruction:
+            elif ins.kind == 'func':
+                self.pseudocode.append(f"\nFUNCTION {ins.target}({', '.join(ins.args)}):")
+            elif ins.kind == 'array':
+                self.pseudocode.append(f"    DECLARE {ins.dest}: {ins.op}[{ins.args[0]}]")
+            elif ins.kind == 'bounds':
+                self.pseudocode.append(f"    CHECK 0 <= {ins.args[0]} < {ins.args[1]}")
+            elif ins.kind == 'call':
+                call = f"CALL {ins.target}({', '.join(ins.args)})"
+                self.pseudocode.append(f"    {ins.dest} := {call}" if ins.dest else f"    {call}")
+            elif ins.kind == 'if_false':
+                self.pseudocode.append(f"    if NOT {ins.args[0]} goto {ins.target}")
+            elif ins.kind == 'goto':
+                self.pseudocode.append(f"    goto {ins.target}")
+            elif ins.kind == 'printf':
                 self.pseudocode.append(f"    OUTPUT: {instruction}")
-            elif 'print' in instruction:
-                var = instruction.split()[-1]
-                self.pseudocode.append(f"    PRINT {var}")
-            elif instruction.startswith('return'):
-                parts = instruction.split()
-                if len(parts) > 1:
-                    self.pseudocode.append(f"    RETURN {parts[1]}")
+            elif ins.kind == 'print':
+                self.pseudocode.append(f"    PRINT {ins.args[0]}")
+            elif ins.kind == 'return':
+                if ins.args:
+                    self.pseudocode.append(f"    RETURN {ins.args[0]}")
                 else:
                     self.pseudocode.append(f"    RETURN")
             elif '=' in instruction and not instruction.startswith('#'):
@@ -44,90 +71,152 @@ class CodeGenerator:
         
         return self.pseudocode
     
-    def generate_assembly(self, ir_code):
+    def generate_assembly(self, ir_code, lines=None):
+        # lines is the LineTable of ir_code; the source line of each
+        # assembly line ends up in self.assembly_lines.
         self.assembly_code = []
         self.assembly_code.append(".text")
         self.assembly_code.append("main:")
         
-        register_map = {}
+        register_map = self._pin_hot(ir_code)
         current_register = 0
+        # Element type of each array, for picking integer or SSE moves
+        array_types = {}
+        bounds_checked = False
+        marked = 0
         
-        for instruction in ir_code:
+        for instruction, line in zip(ir_code, repeat(0) if lines is None else lines):
             instruction = instruction.strip()
+            if line != marked:
+                self.assembly_code.append(f"    {line_marker(line)}")
+                marked = line
             
             if not instruction:
                 continue
             
+            ins = decode(instruction)
             if instruction.endswith(':'):
                 self.assembly_code.append(f"{instruction}")
-            elif instruction.startswith('if_false'):
-                parts = instruction.split()
-                var = parts[1]
-                label = parts[-1]
-                reg = self._get_register(var, register_map, current_register)
+            elif ins.kind == 'func':
+                # Arguments are pushed right to left, so the first one sits
+                # just above the return address.
+                self.assembly_code.append("")
+                self.assembly_code.append(f"{ins.target}:")
+                for i, param in enumerate(ins.args):
+                    reg = self._allocate_register(param, register_map, current_register)
+                    self.assembly_code.append(f"    mov {reg}, [rsp+{8 * (i + 1)}]")
+            elif ins.kind == 'array':
+                # Arrays live on the stack; the register holds the base address.
+                array_types[ins.dest] = ins.op
+                reg = self._allocate_register(ins.dest, register_map, current_register)
+                self.assembly_code.append(f"    sub rsp, {8 * int(ins.args[0])}")
+                self.assembly_code.append(f"    mov {reg}, rsp")
+            elif ins.kind == 'load':
+                move = 'movsd' if array_types.get(ins.target) == 'float' else 'mov'
+                reg = self._allocate_register(ins.dest, register_map, current_register)
+                address = self._element(ins.target, ins.args[0], register_map, current_register)
+                self.assembly_code.append(f"    {move} {reg}, {address}")
+            elif ins.kind == 'store':
+                move = 'movsd' if array_types.get(ins.target) == 'float' else 'mov'
+                address = self._element(ins.target, ins.args[0], register_map, current_register)
+                source = self._operand(ins.args[1], register_map, current_register)
+                self.assembly_code.append(f"    {move} {address}, {source}")
+            elif ins.kind == 'bounds':
+                # Unsigned compare: a negative index wraps to a huge value.
+                reg = self._operand(ins.args[0], register_map, current_register)
+                self.assembly_code.append(f"    cmp {reg}, {ins.args[1]}")
+                self.assembly_code.append(f"    jae bounds_error")
+                bounds_checked = True
+            elif ins.kind == 'call':
+                for arg in reversed(ins.args):
+                    self.assembly_code.append(f"    push {self._operand(arg, register_map, current_register)}")
+                self.assembly_code.append(f"    call {ins.target}")
+                if ins.args:
+                    self.assembly_code.append(f"    add rsp, {8 * len(ins.args)}")
+                if ins.dest:
+                    reg = self._allocate_register(ins.dest, register_map, current_register)
+                    self.assembly_code.append(f"    mov {reg}, rax")
+            elif ins.kind == 'if_false':
+                reg = self._get_register(ins.args[0], register_map, current_register)
                 self.assembly_code.append(f"    cmp {reg}, 0")
-                self.assembly_code.append(f"    je {label}")
-            elif instruction.startswith('goto'):
-                label = instruction.split()[-1]
-                self.assembly_code.append(f"    jmp {label}")
+                self.assembly_code.append(f"    je {ins.target}")
+            elif ins.kind == 'goto':
+                self.assembly_code.append(f"    jmp {ins.target}")
+            elif ins.kind in ('printf', 'print'):
+                self.assembly_code.append(f"    call print_function  # {instruction}")
             elif '=' in instruction and not instruction.startswith('#'):
-                parts = instruction.split('=', 1)
-                var = parts[0].strip()
-                expr = parts[1].strip()
-                
-                if expr.isdigit() or expr.lstrip('-').isdigit():
-                    reg = self._allocate_register(var, register_map, current_register)
-                    self.assembly_code.append(f"    mov {reg}, {expr}")
-                elif '+' in expr:
-                    self._generate_binary_op(expr, var, register_map, current_register, '+', 'add')
-                elif '-' in expr:
-                    self._generate_binary_op(expr, var, register_map, current_register, '-', 'sub')
-                elif '*' in expr:
-                    self._generate_binary_op(expr, var, register_map, current_register, '*', 'imul')
-                elif '/' in expr:
-                    self._generate_binary_op(expr, var, register_map, current_register, '/', 'idiv')
+                if ins.kind == 'binop' and ins.op in ASM_OPS:
+                    self._generate_binary_op(ins.dest, ins.args[0], ins.args[1], register_map,
+                                             current_register, ASM_OPS[ins.op])
+                elif ins.kind == 'unop':
+                    reg = self._allocate_register(ins.dest, register_map, current_register)
+                    source = self._operand(ins.args[0], register_map, current_register)
+                    self.assembly_code.append(f"    {ASM_OPS[ins.op]} {reg}, {source}")
                 else:
+                    parts = instruction.split('=', 1)
+                    var = parts[0].strip()
+                    expr = parts[1].strip()
                     reg = self._allocate_register(var, register_map, current_register)
                     self.assembly_code.append(f"    mov {reg}, {expr}")
-            elif 'printf' in instruction or 'print' in instruction:
-                self.assembly_code.append(f"    call print_function  # {instruction}")
-            elif instruction.startswith('return'):
-                self.assembly_code.append(f"    mov eax, 0")
+            elif ins.kind == 'return':
+                if ins.args:
+                    self.assembly_code.append(f"    mov rax, {self._operand(ins.args[0], register_map, current_register)}")
+                else:
+                    self.assembly_code.append(f"    mov eax, 0")
                 self.assembly_code.append(f"    ret")
             else:
                 self.assembly_code.append(f"    # {instruction}")
         
+        if marked:
+            self.assembly_code.append(f"    {line_marker(0)}")
+        if bounds_checked:
+            self.assembly_code.append("")
+            self.assembly_code.append("bounds_error:")
+            self.assembly_code.append("    call abort")
+
         self.assembly_code.append("")
         self.assembly_code.append(".data")
         
+        if self.peephole:
+            self.assembly_code = self.peephole.optimize(self.assembly_code)
+        self.assembly_code, self.assembly_lines = strip_lines(self.assembly_code)
         return self.assembly_code
     
+    def _pin_hot(self, ir_code):
+        # The hottest names that occur in the code get the first registers to
+        # themselves; everything else shares the rest.
+        present = set()
+        for line in ir_code:
+            if line.strip():
+                ins = decode(line.strip())
+                present.update(ins.uses())
+                present.update([ins.dest, ins.target] if ins.kind in ('load', 'store') else [ins.dest])
+        pinned = [name for name in self.hot if name in present][:PINNED_REGISTERS]
+        self.registers = REGISTERS[len(pinned):]
+        return dict(zip(pinned, REGISTERS))
+
     def _allocate_register(self, var, register_map, current_reg):
         if var not in register_map:
-            register_map[var] = f"r{current_reg % 8}"
+            register_map[var] = self.registers[current_reg % len(self.registers)]
         return register_map[var]
     
     def _get_register(self, var, register_map, current_reg):
         if var not in register_map:
-            register_map[var] = f"r{len(register_map) % 8}"
+            register_map[var] = self.registers[len(register_map) % len(self.registers)]
         return register_map[var]
     
-    def _generate_binary_op(self, expr, var, reg_map, current_reg, op, asm_op):
-        parts = expr.split(f' {op} ')
-        if len(parts) == 2:
-            left = parts[0].strip()
-            right = parts[1].strip()
-            
-            reg = self._allocate_register(var, reg_map, current_reg)
-            
-            if left.isdigit():
-                self.assembly_code.append(f"    mov {reg}, {left}")
-            else:
-                left_reg = self._get_register(left, reg_map, current_reg)
-                self.assembly_code.append(f"    mov {reg}, {left_reg}")
-            
-            if right.isdigit():
-                self.assembly_code.append(f"    {asm_op} {reg}, {right}")
-            else:
-                right_reg = self._get_register(right, reg_map, current_reg)
-                self.assembly_code.append(f"    {asm_op} {reg}, {right_reg}")
+    def _operand(self, operand, reg_map, current_reg):
+        if is_constant(operand):
+            return operand
+        return self._get_register(operand, reg_map, current_reg)
+
+    def _element(self, array, index, reg_map, current_reg):
+        base = self._get_register(array, reg_map, current_reg)
+        if is_constant(index):
+            return f"[{base}+{8 * int(index)}]"
+        return f"[{base}+{self._get_register(index, reg_map, current_reg)}*8]"
+
+    def _generate_binary_op(self, var, left, right, reg_map, current_reg, asm_op):
+        reg = self._allocate_register(var, reg_map, current_reg)
+        self.assembly_code.append(f"    mov {reg}, {self._operand(left, reg_map, current_reg)}")
+        self.assembly_code.append(f"    {asm_op} {reg}, {self._operand(right, reg_map, current_reg)}")
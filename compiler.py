@@ -0,0 +1,125 @@
+import copy
+import mmap
+import os
+import re
+
+from code_generator import CodeGenerator
+from errors import SyntaxError
+from ir_generator import IRGenerator
+from lexer import Lexer
+from line_table import LineTable, annotate, strip_lines
+from optimizer import Optimizer
+from parser import Parser
+from pass_manager import DEFAULT_LEVEL
+from preprocessor import Preprocessor
+from semantic_analyzer import SemanticAnalyzer
+
+# Anything the text preprocessor would rewrite: comments, directives other than
+# "#include <...>", and CRLF line endings.
+NEEDS_PREPROCESSING_RE = re.compile(rb'/[/*]|#(?!include\s*<)|\r')
+NONBLANK_RE = re.compile(rb'\S')
+# Output modes that print one of a Compilation's listings
+LISTING_MODES = ["tokens", "ast", "ir", "ir-opt", "pseudocode", "asm"]
+
+
+class Compilation:
+    def __init__(self, code, level=DEFAULT_LEVEL, budget=None, filename=None, search_paths=None, defines=None,
+                 debug=False, unroll_factor=None, profile=None, evaluator=None, reference=False):
+        self.code = code
+        # ExecutionProfile of an earlier run, for profile-guided optimization
+        self.profile = profile
+        self.level = level
+        # Debug builds check every array index at run time.
+        self.debug = debug
+        self.unroll_factor = unroll_factor
+        # ProgramEvaluator that may replace the whole program by its output
+        self.evaluator = evaluator
+        self.evaluation = None
+        # The optimizer rewrites the AST in place; a reference build keeps a
+        # copy of the analyzed AST for differential runs to interpret.
+        self.reference = reference
+        self.ast_analyzed = None
+        self.budget = budget
+        self.filename = filename
+        self.preprocessor = Preprocessor(search_paths, defines)
+
+    def run(self):
+        if isinstance(self.code, str):
+            if not self.code.strip():
+                raise SyntaxError("Error: C program is empty. Please enter valid C code.")
+            self.source = self.preprocessor.process(self.code, self.filename)
+        else:
+            # A mapped file that needs no preprocessing is lexed without decoding it.
+            if not NONBLANK_RE.search(self.code):
+                raise SyntaxError("Error: C program is empty. Please enter valid C code.")
+            self.source = self.code
+        lexer = Lexer(self.source)
+        self.tokens = lexer.tokenize()
+        parser = Parser(self.tokens, lexer.line_map)
+        self.ast = parser.parse()
+        self.sem = SemanticAnalyzer(includes=parser.includes | self.preprocessor.includes)
+        self.sem.analyze(self.ast)
+        if self.reference:
+            self.ast_analyzed = copy.deepcopy(self.ast)
+
+        # IR of the unoptimized AST, for the "IR" view and differential runs.
+        # Every listing comes with a LineTable of the source line of each entry.
+        self.ir_before, self.ir_before_lines = strip_lines(IRGenerator(bounds_check=self.debug).generate(self.ast))
+
+        self.optimizer = Optimizer(symbols=self.sem.symbols, level=self.level, budget=self.budget,
+                                   unroll_factor=self.unroll_factor, profile=self.profile)
+        self.ast_optimized = self.optimizer.optimize_ast(self.ast)
+        ir_gen = IRGenerator(bounds_check=self.debug, profile=self.profile)
+        ir = ir_gen.generate(self.ast_optimized)
+        self.ir, self.ir_lines = strip_lines(self.optimizer.optimize_ir(ir, temps=ir_gen.temps))
+        self.loops = ir_gen.loops
+        if self.evaluator is not None:
+            self.evaluation = self.evaluator.evaluate(self.ir)
+            if self.evaluation.completed:
+                self.ir = self.evaluation.ir
+                self.ir_lines = LineTable.filled(len(self.ir))
+                self.loops = {}
+
+        self.code_gen = CodeGenerator(peephole=self.level > 0, hot=ir_gen.hot_names())
+        self.pseudocode = self.code_gen.generate_pseudocode(self.ir)
+        self.assembly = self.code_gen.generate_assembly(self.ir, self.ir_lines)
+        self.assembly_lines = self.code_gen.assembly_lines
+        return self
+
+
+def listing(result, mode, lines=False):
+    # The lines printed for a listing mode; with lines, IR and assembly
+    # carry "# line N" markers.
+    if mode == "tokens":
+        return [f"{tok_type} {tok_val}" for tok_type, tok_val in result.tokens]
+    if mode == "ast":
+        return [repr(result.ast)]
+    if mode == "ir":
+        return annotate(result.ir_before, result.ir_before_lines) if lines else result.ir_before
+    if mode == "ir-opt":
+        return annotate(result.ir, result.ir_lines) if lines else result.ir
+    if mode == "pseudocode":
+        return result.pseudocode
+    if mode == "asm":
+        return annotate(result.assembly, result.assembly_lines, "    ") if lines else result.assembly
+    raise ValueError(f"Unknown listing '{mode}'")
+
+
+def compile_source(code, level=DEFAULT_LEVEL, budget=None, filename=None, search_paths=None, defines=None,
+                   debug=False, unroll_factor=None, profile=None, evaluator=None, reference=False):
+    return Compilation(code, level, budget, filename, search_paths, defines, debug, unroll_factor, profile,
+                       evaluator, reference).run()
+
+
+def compile_path(path, level=DEFAULT_LEVEL, budget=None, search_paths=None, defines=None, debug=False,
+                 unroll_factor=None, profile=None, evaluator=None):
+    with open(path, 'rb') as source:
+        if os.fstat(source.fileno()).st_size:
+            buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            if not defines and not NEEDS_PREPROCESSING_RE.search(buffer):
+                return Compilation(buffer, level, budget, path, search_paths, defines, debug, unroll_factor,
+                                   profile, evaluator).run()
+            buffer.close()
+    with open(path) as source:
+        return compile_source(source.read(), level, budget, path, search_paths, defines, debug, unroll_factor,
+                              profile, evaluator)
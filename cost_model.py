@@ -0,0 +1,219 @@
+import re
+
+from ir_analysis import decode
+from pass_manager import LEVELS
+
+# (latency, reciprocal throughput) in cycles, roughly a current x86-64 core
+INSTRUCTION_COSTS = {
+    'mov': (1, 0.25), 'add': (1, 0.25), 'sub': (1, 0.25), 'and': (1, 0.25),
+    'shl': (1, 0.5), 'sar': (1, 0.5), 'cmp': (1, 0.25),
+    'imul': (3, 1), 'idiv': (42, 24),
+    'movsd': (4, 0.5), 'addsd': (4, 0.5), 'subsd': (4, 0.5), 'mulsd': (4, 0.5), 'divsd': (14, 4),
+    'cvtsi2sd': (5, 1), 'cvttsd2si': (6, 1),
+    'jmp': (1, 1), 'je': (1, 0.5), 'jae': (1, 0.5),
+    'push': (1, 1), 'call': (5, 2), 'ret': (5, 1),
+}
+DEFAULT_COST = (1, 1)
+# Trip count assumed for a loop nothing is known about
+DEFAULT_TRIPS = 10
+# Instructions whose first operand is written without being read
+WRITE_ONLY = {'mov', 'movsd', 'cvtsi2sd', 'cvttsd2si'}
+BRANCHES = {'jmp', 'je', 'jae', 'ret'}
+
+REGISTER_RE = re.compile(r'\b(r\d+|rax|rsp|eax)\b')
+INLINED_RE = re.compile(r'\.i\d+$')
+# Sites the unroller gives the loops it builds, with its factor
+UNROLLED_RE = re.compile(r'/(unrolled|remainder)(\d+)$')
+
+
+def site_line(site):
+    # "while@12#2", "for@7/unrolled4" -> 12, 7
+    return int(re.match(r'\w+@(\d+)', site).group(1)) if site else None
+
+
+class Block:
+    def __init__(self, label, function):
+        self.label = label
+        self.function = function
+        self.instructions = []
+        self.cycles = 0
+        self.weight = 1
+        self.loop = None
+
+
+class CostRow:
+    def __init__(self, name, line=None, trips=None, assumed=False):
+        self.name = name
+        self.line = line
+        self.trips = trips
+        self.assumed = assumed
+        self.instructions = 0
+        self.cycles = 0
+
+
+class CostModel:
+    # Static estimate of what generated assembly costs to run: each basic
+    # block takes the longer of its register dependency chain and its
+    # summed issue throughput, and blocks inside loops are multiplied by the
+    # trip counts of every loop around them.
+    def __init__(self, loops=None, functions=()):
+        # Loop header label -> (source site, trips per entry or None)
+        self.loops = loops or {}
+        self.functions = set(functions) | {'main'}
+
+    def estimate(self, assembly):
+        blocks = self._blocks(assembly)
+        for block in blocks:
+            block.cycles = self.block_cycles(block.instructions)
+        rows = self._weigh_loops(blocks)
+        self._weigh_calls(blocks, rows)
+        for block in blocks:
+            row = rows[block.loop if block.loop is not None else block.function]
+            row.instructions += len(block.instructions)
+            row.cycles += block.cycles * block.weight
+        return CostReport(list(rows.values()))
+
+    def _blocks(self, assembly):
+        blocks = [Block(None, 'main')]
+        function = 'main'
+        for line in assembly:
+            text = line.split('#', 1)[0].strip()
+            if not text or text.startswith('.'):
+                continue
+            if text.endswith(':'):
+                label = text[:-1]
+                if label in self.functions:
+                    function = label
+                if blocks[-1].instructions or blocks[-1].label is not None:
+                    blocks.append(Block(label, function))
+                else:
+                    blocks[-1].label, blocks[-1].function = label, function
+                continue
+            blocks[-1].instructions.append(text)
+            if text.split()[0] in BRANCHES:
+                blocks.append(Block(None, function))
+        return [block for block in blocks if block.instructions or block.label]
+
+    def block_cycles(self, instructions):
+        ready = {}
+        chain = issue = 0
+        for text in instructions:
+            mnemonic, _, operands = text.partition(' ')
+            latency, throughput = INSTRUCTION_COSTS.get(mnemonic, DEFAULT_COST)
+            issue += throughput
+            operands = [operand.strip() for operand in operands.split(',')] if operands else []
+            reads = operands[1:] if mnemonic in WRITE_ONLY else operands
+            # Registers inside an address are read even when it is the destination.
+            if operands and mnemonic in WRITE_ONLY and '[' in operands[0]:
+                reads = operands
+            start = max([ready.get(reg, 0) for operand in reads for reg in REGISTER_RE.findall(operand)],
+                        default=0)
+            finish = start + latency
+            if operands and '[' not in operands[0]:
+                for reg in REGISTER_RE.findall(operands[0]):
+                    ready[reg] = finish
+            chain = max(chain, finish)
+        return max(chain, issue)
+
+    def _weigh_loops(self, blocks):
+        # A jump back to an earlier loop header closes a loop over every block
+        # in between; the innermost loop around a block is where its cost is
+        # reported. Without a loop table any backward jump counts, with one
+        # the jumps back from out-of-line cold blocks are not loops.
+        index = {block.label: i for i, block in enumerate(blocks) if block.label}
+        spans = {}
+        for i, block in enumerate(blocks):
+            if not block.instructions:
+                continue
+            parts = block.instructions[-1].split()
+            if parts[0] in BRANCHES and len(parts) > 1 and index.get(parts[1], i + 1) <= i:
+                if self.loops and INLINED_RE.sub('', parts[1]) not in self.loops:
+                    continue
+                head = index[parts[1]]
+                spans[head] = max(spans.get(head, i), i)
+
+        rows = {}
+        for block in blocks:
+            if block.function not in rows:
+                rows[block.function] = CostRow(block.function)
+        for head, end in sorted(spans.items(), key=lambda span: span[1] - span[0], reverse=True):
+            label = blocks[head].label
+            site, trips = self.loops.get(INLINED_RE.sub('', label), (None, None))
+            assumed = trips is None
+            if assumed:
+                trips = self.assumed_trips(site)
+            # Inlined copies of one source loop share its row.
+            key = site or label
+            if key not in rows:
+                rows[key] = CostRow(key, site_line(site), trips, assumed)
+            for block in blocks[head:end + 1]:
+                block.weight *= trips
+                block.loop = key
+        return rows
+
+
+    def assumed_trips(self, site):
+        # An unrolled loop splits the default trip count with its remainder.
+        unrolled = UNROLLED_RE.search(site or '')
+        if unrolled is None:
+            return DEFAULT_TRIPS
+        factor = int(unrolled.group(2))
+        return DEFAULT_TRIPS // factor if unrolled.group(1) == 'unrolled' else DEFAULT_TRIPS % factor
+
+    def _weigh_calls(self, blocks, rows):
+        # A function runs as often as its call sites do; counts are pushed
+        # down from main a bounded number of times so recursion stays finite.
+        sites = {}
+        for block in blocks:
+            for text in block.instructions:
+                parts = text.split()
+                if parts[0] == 'call' and parts[1] in self.functions:
+                    sites.setdefault(parts[1], []).append(block)
+        calls = {'main': 1}
+        for _ in range(len(self.functions)):
+            previous, calls = calls, {'main': 1}
+            for name, callers in sites.items():
+                if name != 'main':
+                    calls[name] = sum(block.weight * previous.get(block.function, 0) for block in callers)
+            if calls == previous:
+                break
+        for block in blocks:
+            block.weight *= calls.get(block.function, 0)
+        for name, count in calls.items():
+            if name != 'main' and name in rows:
+                rows[name].trips = count
+
+
+class CostReport:
+    def __init__(self, rows):
+        self.rows = [row for row in rows if row.instructions]
+        self.total = sum(row.cycles for row in self.rows)
+
+    def format(self):
+        lines = [f"{'Line':<6} {'Code':<22} {'Trips':<12} {'Instrs':<8} {'Cycles':>12}"]
+        for row in sorted(self.rows, key=lambda row: (row.line is None, row.line or 0)):
+            line = '-' if row.line is None else row.line
+            trips = '' if row.trips is None else f"{row.trips:g}" + (' (assumed)' if row.assumed else '')
+            lines.append(f"{line:<6} {row.name:<22} {trips:<12} {row.instructions:<8} {row.cycles:>12,.1f}")
+        return lines
+
+
+def estimate(result):
+    # Cost of a Compilation's assembly, with its IR generator's loop table.
+    functions = [decode(line).target for line in result.ir if line.startswith('func ')]
+    return CostModel(result.loops, functions).estimate(result.assembly)
+
+
+def level_comparison(compile_at):
+    # compile_at(level) -> Compilation; estimated total cycles per -O level
+    return [(level, estimate(compile_at(level)).total) for level in sorted(LEVELS)]
+
+
+def format_comparison(totals, current=None):
+    # The per-level totals from level_comparison, relative to -O0
+    baseline = totals[0][1] or 1
+    lines = [f"{'Level':<6} {'Cycles':>12} {'vs -O0':>8}"]
+    for level, total in totals:
+        marker = ' <' if level == current else ''
+        lines.append(f"{'-O' + str(level):<6} {total:>12,.1f} {total / baseline:>7.2f}x{marker}")
+    return lines
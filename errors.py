@@ -1,3 +1,6 @@
+class PreprocessorError(Exception):
+    pass
+
 class LexicalError(Exception):
     pass
 
@@ -9,3 +12,18 @@ class SemanticError(Exception):
 
 class RuntimeError(Exception):
     pass
+
+class ProfileError(Exception):
+    pass
+
+class OutputLimitError(RuntimeError):
+    pass
+
+class StepLimitError(RuntimeError):
+    pass
+
+class MemoryLimitError(RuntimeError):
+    pass
+
+class ArtifactError(Exception):
+    pass
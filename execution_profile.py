@@ -0,0 +1,93 @@
+import json
+
+from errors import ProfileError
+from interpreter import Interpreter
+
+PROFILE_VERSION = 1
+
+
+class ExecutionProfile:
+    # Counts from a profiling run, keyed by the parser's source-location
+    # sites so a later compile of the same source can look them up.
+    def __init__(self, functions=None, branches=None, loops=None):
+        # function name -> times entered
+        self.functions = functions if functions is not None else {}
+        # site -> [times the condition held, times it did not]
+        self.branches = branches if branches is not None else {}
+        # site -> [times the loop was reached, iterations in total]
+        self.loops = loops if loops is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as source:
+                data = json.load(source)
+        except (OSError, ValueError) as e:
+            raise ProfileError(f"Error: Cannot read profile {path}: {e}")
+        if not isinstance(data, dict) or data.get("version") != PROFILE_VERSION:
+            raise ProfileError(f"Error: {path} is not a version {PROFILE_VERSION} profile")
+        return cls(data.get("functions"), data.get("branches"), data.get("loops"))
+
+    def save(self, path):
+        data = {"version": PROFILE_VERSION, "functions": self.functions,
+                "branches": self.branches, "loops": self.loops}
+        with open(path, "w") as out:
+            json.dump(data, out, indent=1, sort_keys=True)
+
+    def branch(self, site):
+        return self.branches.get(site) if site else None
+
+    def loop(self, site):
+        return self.loops.get(site) if site else None
+
+    def average_trips(self, site):
+        counts = self.loop(site)
+        if not counts or not counts[0]:
+            return None
+        return counts[1] / counts[0]
+
+
+class ProfilingInterpreter(Interpreter):
+    # The reference interpreter, also counting calls, branch outcomes and
+    # loop iterations into an ExecutionProfile.
+    def __init__(self, profile=None, sink=None):
+        super().__init__(sink)
+        self.profile = profile if profile is not None else ExecutionProfile()
+
+    def _count(self, table, key, index):
+        counts = table.setdefault(key, [0, 0])
+        counts[index] += 1
+        return counts
+
+    def visit_Program(self, node):
+        self.profile.functions["main"] = self.profile.functions.get("main", 0) + 1
+        yield from super().visit_Program(node)
+
+    def visit_Call(self, node):
+        self.profile.functions[node.name] = self.profile.functions.get(node.name, 0) + 1
+        return (yield from super().visit_Call(node))
+
+    def visit_IfStatement(self, node):
+        cond = yield node.condition
+        if node.site:
+            self._count(self.profile.branches, node.site, 0 if cond else 1)
+        if cond:
+            yield node.then_block
+        elif node.else_block:
+            yield node.else_block
+
+    def visit_WhileStatement(self, node):
+        counts = self._count(self.profile.loops, node.site, 0) if node.site else [0, 0]
+        while (yield node.condition):
+            counts[1] += 1
+            yield node.body
+
+    def visit_ForStatement(self, node):
+        counts = self._count(self.profile.loops, node.site, 0) if node.site else [0, 0]
+        if node.init:
+            yield node.init
+        while (yield node.condition):
+            counts[1] += 1
+            yield node.body
+            if node.step:
+                yield node.step
@@ -1,18 +1,151 @@
 import tkinter as tk
 from tkinter import ttk
-from lexer import Lexer
-from parser import Parser
-from semantic_analyzer import SemanticAnalyzer
-from ir_generator import IRGenerator
-from optimizer import Optimizer
-from code_generator import CodeGenerator
-from interpreter import Interpreter
+from compiler import compile_source
+from cost_model import estimate, format_comparison, level_comparison
+from program_evaluator import ProgramEvaluator
+from pass_manager import DEFAULT_LEVEL, LEVELS
+from ir_executor import IRExecutor, differential_run
+from output_sink import CallbackSink
+from output_view import VirtualText
+from visitor import NodeVisitor
 from errors import *
 from ast_nodes import (
     Program, Block, Declaration, Assignment, PrintfStatement, PrintStatement,
-    ReturnStatement, IfStatement, WhileStatement, BinaryOp, Number, Identifier
+    ReturnStatement, IfStatement, WhileStatement, BinaryOp, Cast, Number, Identifier,
+    FunctionDef, Call, ExpressionStatement, Index, IndexAssignment, ForStatement
 )
 
+# Program output beyond this many bytes stops the run
+OUTPUT_LIMIT = 1024 * 1024
+
+class ASTFormatter(NodeVisitor):
+    # Writes the AST view straight into the output buffer. Driven from the
+    # visitor's explicit stack, so deep expressions neither recurse nor
+    # rebuild ever longer strings.
+    def __init__(self, out):
+        self.out = out
+
+    def line(self, indent, text):
+        self.out.write(f"{'  ' * indent}{text}\n")
+
+    def generic_visit(self, node, indent):
+        self.line(indent, str(node))
+
+    def visit_NoneType(self, node, indent):
+        pass
+
+    def visit_list(self, node, indent):
+        for item in node:
+            yield item, indent
+
+    def visit_Program(self, node, indent):
+        self.line(indent, "Program:")
+        for stmt in node.statements + node.functions:
+            yield stmt, indent + 1
+
+    def visit_FunctionDef(self, node, indent):
+        params = ", ".join(f"{param.datatype} {param.name}" for param in node.params)
+        self.line(indent, f"Function: {node.return_type} {node.name}({params})")
+        yield node.body, indent + 1
+
+    def visit_ExpressionStatement(self, node, indent):
+        yield node.expr, indent
+
+    def visit_Call(self, node, indent):
+        self.line(indent, f"Call: {node.name}")
+        for arg in node.args:
+            yield arg, indent + 1
+
+    def visit_Block(self, node, indent):
+        self.line(indent, "Block:")
+        for stmt in node.statements:
+            yield stmt, indent + 1
+
+    def visit_Declaration(self, node, indent):
+        if node.size is not None:
+            self.line(indent, f"Declaration: {node.datatype} {node.name}[{node.size}]")
+            return
+        self.line(indent, f"Declaration: {node.datatype} {node.name}")
+        if node.init_value:
+            yield node.init_value, indent + 1
+
+    def visit_Assignment(self, node, indent):
+        self.line(indent, f"Assignment: {node.name} =")
+        yield node.expr, indent + 1
+
+    def visit_IndexAssignment(self, node, indent):
+        self.line(indent, f"Assignment: {node.name}[] =")
+        self.line(indent + 1, "Index:")
+        yield node.index, indent + 2
+        self.line(indent + 1, "Value:")
+        yield node.expr, indent + 2
+
+    def visit_PrintfStatement(self, node, indent):
+        self.line(indent, f"Printf: {node.format_str}")
+        for arg in node.args:
+            yield arg, indent + 1
+
+    def visit_PrintStatement(self, node, indent):
+        self.line(indent, "Print:")
+        yield node.expr, indent + 1
+
+    def visit_ReturnStatement(self, node, indent):
+        self.line(indent, "Return:" if node.return_val else "Return")
+        if node.return_val:
+            yield node.return_val, indent + 1
+
+    def visit_IfStatement(self, node, indent):
+        self.line(indent, "If:")
+        self.line(indent + 1, "Condition:")
+        yield node.condition, indent + 2
+        self.line(indent + 1, "Then:")
+        yield node.then_block, indent + 2
+        if node.else_block:
+            self.line(indent + 1, "Else:")
+            yield node.else_block, indent + 2
+
+    def visit_WhileStatement(self, node, indent):
+        self.line(indent, "While:")
+        self.line(indent + 1, "Condition:")
+        yield node.condition, indent + 2
+        self.line(indent + 1, "Body:")
+        yield node.body, indent + 2
+
+    def visit_ForStatement(self, node, indent):
+        self.line(indent, "For:")
+        if node.init:
+            self.line(indent + 1, "Init:")
+            yield node.init, indent + 2
+        self.line(indent + 1, "Condition:")
+        yield node.condition, indent + 2
+        if node.step:
+            self.line(indent + 1, "Step:")
+            yield node.step, indent + 2
+        self.line(indent + 1, "Body:")
+        yield node.body, indent + 2
+
+    def visit_BinaryOp(self, node, indent):
+        self.line(indent, f"BinaryOp: {node.op}")
+        self.line(indent + 1, "Left:")
+        yield node.left, indent + 2
+        self.line(indent + 1, "Right:")
+        yield node.right, indent + 2
+
+    def visit_Cast(self, node, indent):
+        self.line(indent, f"Cast: ({node.ctype})")
+        yield node.expr, indent + 1
+
+    def visit_Index(self, node, indent):
+        self.line(indent, f"Index: {node.name}")
+        yield node.index, indent + 1
+
+    def visit_Number(self, node, indent):
+        self.line(indent, f"Number: {node.value}")
+
+    def visit_Identifier(self, node, indent):
+        self.line(indent, f"Identifier: {node.name}")
+
+
 class CompilerGUI:
     def __init__(self):
         self.root = tk.Tk()
@@ -73,8 +206,12 @@ class CompilerGUI:
         self.input_text.tag_config("comment", foreground="#8b949e")          # Gray for comments
         self.input_text.tag_config("preprocess", foreground="#ffa657")       # Orange for #include
 
+        self.input_text.tag_config("linked", background="#264f78")
+
         # Bind syntax highlighting to key release events
-        self.input_text.bind("<KeyRelease>", lambda e: self._highlight_input_syntax())        # Right panel - Controls and Output
+        self.input_text.bind("<KeyRelease>", lambda e: self._highlight_input_syntax())
+        # Clicking a source line highlights the IR or assembly generated for it
+        self.input_text.bind("<ButtonRelease-1>", lambda e: self._source_clicked())        # Right panel - Controls and Output
         right_panel = tk.Frame(main_frame, bg="#0d1117")
         right_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=(8, 0))
 
@@ -92,12 +229,38 @@ class CompilerGUI:
 
         self.mode_var = tk.StringVar(self.root)
         self.mode_var.set("RUN")
-        modes = ["RUN", "TOKENS", "AST", "SYMBOL TABLE", "IR", "IR (OPTIMIZED)", "PSEUDOCODE", "ASSEMBLY"]
+        modes = ["RUN", "TOKENS", "AST", "SYMBOL TABLE", "IR", "IR (OPTIMIZED)", "PSEUDOCODE", "ASSEMBLY", "DIFFERENTIAL", "COST"]
         
         self.mode_combo = ttk.Combobox(mode_frame, textvariable=self.mode_var, 
                                        values=modes, state="readonly", width=35, font=("Segoe UI", 10))
         self.mode_combo.pack(fill=tk.X)
 
+        level_label = tk.Label(mode_frame, text="Optimization Level:", font=("Segoe UI", 11, "bold"),
+                              bg="#161b22", fg="#58a6ff")
+        level_label.pack(anchor="w", pady=(10, 6))
+
+        self.level_var = tk.StringVar(self.root)
+        self.level_var.set(f"-O{DEFAULT_LEVEL}")
+        self.level_combo = ttk.Combobox(mode_frame, textvariable=self.level_var,
+                                        values=[f"-O{level}" for level in LEVELS], state="readonly",
+                                        width=35, font=("Segoe UI", 10))
+        self.level_combo.pack(fill=tk.X)
+
+        self.debug_var = tk.BooleanVar(self.root, value=False)
+        debug_check = tk.Checkbutton(mode_frame, text="Debug build (array bounds checks)", variable=self.debug_var,
+                                     bg="#161b22", fg="#c9d1d9", selectcolor="#0d1117",
+                                     activebackground="#161b22", activeforeground="#c9d1d9",
+                                     font=("Segoe UI", 10))
+        debug_check.pack(anchor="w", pady=(8, 0))
+
+        self.evaluate_var = tk.BooleanVar(self.root, value=False)
+        evaluate_check = tk.Checkbutton(mode_frame, text="Evaluate at compile time (emit only the output)",
+                                        variable=self.evaluate_var,
+                                        bg="#161b22", fg="#c9d1d9", selectcolor="#0d1117",
+                                        activebackground="#161b22", activeforeground="#c9d1d9",
+                                        font=("Segoe UI", 10))
+        evaluate_check.pack(anchor="w")
+
         # Button frame
         button_frame = tk.Frame(control_panel, bg="#161b22")
         button_frame.pack(fill=tk.X, padx=12, pady=(0, 12))
@@ -114,100 +277,41 @@ class CompilerGUI:
                                bg="#161b22", fg="#58a6ff", pady=8)
         output_label.pack(anchor="w", fill=tk.X)
 
-        # Output text with scrollbar
-        output_frame = tk.Frame(right_panel, bg="#0d1117")
-        output_frame.pack(fill=tk.BOTH, expand=True)
+        # Search bar
+        search_frame = tk.Frame(right_panel, bg="#161b22")
+        search_frame.pack(fill=tk.X, pady=(0, 4))
+        self.search_var = tk.StringVar(self.root)
+        search_entry = tk.Entry(search_frame, textvariable=self.search_var, bg="#0d1117", fg="#c9d1d9",
+                                insertbackground="#58a6ff", relief=tk.FLAT, font=("Courier New", 10))
+        search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 6))
+        search_entry.bind("<Return>", lambda e: self.output.find(self.search_var.get()))
+        self.root.bind("<Control-f>", lambda e: search_entry.focus_set())
+        for text, command in (("Find", lambda: self.output.find(self.search_var.get())),
+                              ("Copy all", lambda: self.output.copy_all())):
+            tk.Button(search_frame, text=text, command=command, bg="#21262d", fg="#c9d1d9", relief=tk.FLAT,
+                      activebackground="#30363d", activeforeground="#ffffff", bd=0, padx=10).pack(side=tk.LEFT)
 
-        output_scrollbar = tk.Scrollbar(output_frame)
-        output_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-
-        self.output_text = tk.Text(output_frame, height=30, width=60, bg="#0d1117",
-                                   fg="#79c0ff", font=("Courier New", 9),
-                                   relief=tk.FLAT, bd=0,
-                                   yscrollcommand=output_scrollbar.set)
-        self.output_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        output_scrollbar.config(command=self.output_text.yview)
+        # Output pane: only the visible lines are handed to Tk
+        # Listing on show as (buffer index of its first line, LineTable),
+        # for cross-highlighting with the source
+        self.listing = None
+        self.output = VirtualText(right_panel, on_click=self._output_clicked, height=30, width=60, bg="#0d1117",
+                                  fg="#79c0ff", font=("Courier New", 9),
+                                  relief=tk.FLAT, bd=0)
+        self.output.pack(fill=tk.BOTH, expand=True)
 
         # Configure color tags for output
-        self.output_text.tag_config("header", foreground="#58a6ff", font=("Courier New", 9, "bold"))
-        self.output_text.tag_config("keyword", foreground="#ff7b72")
-        self.output_text.tag_config("number", foreground="#d2a8ff")
-        self.output_text.tag_config("string", foreground="#a5d6ff")
-        self.output_text.tag_config("operator", foreground="#ffa657")
-        self.output_text.tag_config("identifier", foreground="#79c0ff")
-        self.output_text.tag_config("type", foreground="#ff7b72")
-        self.output_text.tag_config("success", foreground="#3fb950")
+        self.output.tag_config("header", foreground="#58a6ff", font=("Courier New", 9, "bold"))
+        self.output.tag_config("keyword", foreground="#ff7b72")
+        self.output.tag_config("number", foreground="#d2a8ff")
+        self.output.tag_config("string", foreground="#a5d6ff")
+        self.output.tag_config("operator", foreground="#ffa657")
+        self.output.tag_config("identifier", foreground="#79c0ff")
+        self.output.tag_config("type", foreground="#ff7b72")
+        self.output.tag_config("success", foreground="#3fb950")
 
         self.root.mainloop()
 
-    def _format_ast_columns(self, node, indent=0):
-        result = ""
-        prefix = "  " * indent
-        
-        if isinstance(node, list):
-            for item in node:
-                result += self._format_ast_columns(item, indent)
-        elif node is None:
-            pass
-        elif isinstance(node, Program):
-            result += f"{prefix}Program:\n"
-            for stmt in node.statements:
-                result += self._format_ast_columns(stmt, indent + 1)
-        elif isinstance(node, Block):
-            result += f"{prefix}Block:\n"
-            for stmt in node.statements:
-                result += self._format_ast_columns(stmt, indent + 1)
-        elif isinstance(node, Declaration):
-            result += f"{prefix}Declaration: {node.datatype} {node.name}\n"
-            if node.init_value:
-                result += self._format_ast_columns(node.init_value, indent + 1)
-        elif isinstance(node, Assignment):
-            result += f"{prefix}Assignment: {node.name} =\n"
-            result += self._format_ast_columns(node.expr, indent + 1)
-        elif isinstance(node, PrintfStatement):
-            result += f"{prefix}Printf: {node.format_str}\n"
-            for arg in node.args:
-                result += self._format_ast_columns(arg, indent + 1)
-        elif isinstance(node, PrintStatement):
-            result += f"{prefix}Print:\n"
-            result += self._format_ast_columns(node.expr, indent + 1)
-        elif isinstance(node, ReturnStatement):
-            result += f"{prefix}Return"
-            if node.return_val:
-                result += ":\n"
-                result += self._format_ast_columns(node.return_val, indent + 1)
-            else:
-                result += "\n"
-        elif isinstance(node, IfStatement):
-            result += f"{prefix}If:\n"
-            result += f"{prefix}  Condition:\n"
-            result += self._format_ast_columns(node.condition, indent + 2)
-            result += f"{prefix}  Then:\n"
-            result += self._format_ast_columns(node.then_block, indent + 2)
-            if node.else_block:
-                result += f"{prefix}  Else:\n"
-                result += self._format_ast_columns(node.else_block, indent + 2)
-        elif isinstance(node, WhileStatement):
-            result += f"{prefix}While:\n"
-            result += f"{prefix}  Condition:\n"
-            result += self._format_ast_columns(node.condition, indent + 2)
-            result += f"{prefix}  Body:\n"
-            result += self._format_ast_columns(node.body, indent + 2)
-        elif isinstance(node, BinaryOp):
-            result += f"{prefix}BinaryOp: {node.op}\n"
-            result += f"{prefix}  Left:\n"
-            result += self._format_ast_columns(node.left, indent + 2)
-            result += f"{prefix}  Right:\n"
-            result += self._format_ast_columns(node.right, indent + 2)
-        elif isinstance(node, Number):
-            result += f"{prefix}Number: {node.value}\n"
-        elif isinstance(node, Identifier):
-            result += f"{prefix}Identifier: {node.name}\n"
-        else:
-            result += f"{prefix}{str(node)}\n"
-        
-        return result
-
     def _highlight_input_syntax(self):
         self.input_text.tag_remove("keyword", "1.0", tk.END)
         self.input_text.tag_remove("string", "1.0", tk.END)
@@ -258,95 +362,169 @@ class CompilerGUI:
 
     def compile(self):
         code = self.input_text.get("1.0", tk.END)
-        self.output_text.delete("1.0", tk.END)
+        out = self.output
+        out.clear()
+        self.listing = None
+        self.input_text.tag_remove("linked", "1.0", tk.END)
         try:
-            if not code.strip():
-                raise SyntaxError("Error: C program is empty. Please enter valid C code.")
-            
-            lexer = Lexer(code)
-            tokens = lexer.tokenize()
-            parser = Parser(tokens, lexer.line_map)
-            ast = parser.parse()
-            sem = SemanticAnalyzer(includes=parser.includes)
-            sem.analyze(ast)
-            
-            # Generate IR from original AST (before optimization) for "IR" mode
-            ir_gen_before = IRGenerator()
-            ir_before_opt = ir_gen_before.generate(ast)
-            
-            # Now optimize the AST
-            optimizer = Optimizer()
-            ast_optimized = optimizer.optimize_ast(ast)
-            
-            # Generate IR from optimized AST
-            ir_gen = IRGenerator()
-            ir = ir_gen.generate(ast_optimized)
-            
-            # Apply IR-level optimization
-            ir = optimizer.optimize_ir(ir)
-            
-            code_gen = CodeGenerator()
-            pseudocode = code_gen.generate_pseudocode(ir)
-            assembly = code_gen.generate_assembly(ir)
-            
-            interp = Interpreter()
-            output = interp.run(ast_optimized)
-
+            level = int(self.level_var.get()[2:])
+            evaluator = ProgramEvaluator() if self.evaluate_var.get() else None
             mode = self.mode_var.get()
+            result = compile_source(code, level=level, debug=self.debug_var.get(), evaluator=evaluator,
+                                    reference=mode == "DIFFERENTIAL")
+
             if mode == "TOKENS":
-                self.output_text.insert(tk.END, "TOKENS:\n", "header")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                self.output_text.insert(tk.END, f"{'No.':<5} {'Type':<15} {'Value':<20}\n")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                for i, (tok_type, tok_val) in enumerate(tokens, 1):
+                out.write("TOKENS:\n", "header")
+                out.write("-" * 60 + "\n")
+                out.write(f"{'No.':<5} {'Type':<15} {'Value':<20}\n")
+                out.write("-" * 60 + "\n")
+                for i, (tok_type, tok_val) in enumerate(result.tokens, 1):
                     line = f"{i:<5} "
-                    self.output_text.insert(tk.END, line)
-                    self.output_text.insert(tk.END, f"{tok_type:<15} ", "keyword")
-                    self.output_text.insert(tk.END, f"{str(tok_val):<20}\n", "string")
+                    out.write(line)
+                    out.write(f"{tok_type:<15} ", "keyword")
+                    out.write(f"{str(tok_val):<20}\n", "string")
             elif mode == "AST":
-                self.output_text.insert(tk.END, "ABSTRACT SYNTAX TREE:\n", "header")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                self.output_text.insert(tk.END, self._format_ast_columns(ast))
+                out.write("ABSTRACT SYNTAX TREE:\n", "header")
+                out.write("-" * 60 + "\n")
+                ASTFormatter(out).visit(result.ast, 0)
             elif mode == "SYMBOL TABLE":
-                self.output_text.insert(tk.END, "SYMBOL TABLE:\n", "header")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                self.output_text.insert(tk.END, f"{'Variable':<20} {'Type':<15}\n")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                for var, dtype in sem.symbols.items():
-                    self.output_text.insert(tk.END, f"{var:<20} ", "identifier")
-                    self.output_text.insert(tk.END, f"{dtype:<15}\n", "type")
+                out.write("SYMBOL TABLE:\n", "header")
+                out.write("-" * 60 + "\n")
+                out.write(f"{'Variable':<20} {'Type':<15} {'Scope':<8} {'Slot':<6}\n")
+                out.write("-" * 60 + "\n")
+                tables = [("main", result.sem.table)] + list(result.sem.tables.items())
+                for function, table in tables:
+                    if len(tables) > 1:
+                        out.write(f"{function}():\n", "header")
+                    for symbol in table.entries:
+                        out.write(f"{symbol.name:<20} ", "identifier")
+                        datatype = symbol.datatype if symbol.size is None else f"{symbol.datatype}[{symbol.size}]"
+                        out.write(f"{datatype:<15} ", "type")
+                        out.write(f"{symbol.depth:<8} {symbol.slot:<6}\n", "number")
             elif mode == "IR":
-                self.output_text.insert(tk.END, "INTERMEDIATE CODE (TAC):\n", "header")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                for line in ir_before_opt:
-                    self.output_text.insert(tk.END, line + "\n", "operator")
+                out.write("INTERMEDIATE CODE (TAC):\n", "header")
+                out.write("-" * 60 + "\n")
+                self.listing = (len(out.buffer), result.ir_before_lines)
+                for line in result.ir_before:
+                    out.write(line + "\n", "operator")
             elif mode == "IR (OPTIMIZED)":
-                self.output_text.insert(tk.END, "OPTIMIZED CODE:\n", "header")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                for line in ir:
-                    self.output_text.insert(tk.END, line + "\n", "success")
+                out.write("OPTIMIZED CODE:\n", "header")
+                out.write("-" * 60 + "\n")
+                self.listing = (len(out.buffer), result.ir_lines)
+                for line in result.ir:
+                    out.write(line + "\n", "success")
+                out.write("-" * 60 + "\n")
+                out.write(f"-O{result.level}\n", "header")
+                for line in result.optimizer.passes.report():
+                    out.write(line + "\n", "header")
+                for rule, hits in result.optimizer.rewriter.hits.items():
+                    out.write(f"rewrite {rule}: {hits}\n", "header")
+                for line in result.optimizer.inline_log:
+                    out.write(f"inline {line}\n", "header")
+                for line in result.optimizer.closed_form_log:
+                    out.write(f"closed form {line}\n", "header")
+                for line in result.optimizer.unroll_log:
+                    out.write(f"unroll {line}\n", "header")
+                if result.evaluation is not None:
+                    for line in result.evaluation.report():
+                        out.write(line + "\n", "header")
             elif mode == "PSEUDOCODE":
-                self.output_text.insert(tk.END, "PSEUDOCODE:\n", "header")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                if isinstance(pseudocode, list):
-                    for line in pseudocode:
-                        self.output_text.insert(tk.END, line + "\n", "identifier")
+                out.write("PSEUDOCODE:\n", "header")
+                out.write("-" * 60 + "\n")
+                if isinstance(result.pseudocode, list):
+                    for line in result.pseudocode:
+                        out.write(line + "\n", "identifier")
                 else:
-                    self.output_text.insert(tk.END, pseudocode, "identifier")
+                    out.write(result.pseudocode, "identifier")
             elif mode == "ASSEMBLY":
-                self.output_text.insert(tk.END, "ASSEMBLY:\n", "header")
-                self.output_text.insert(tk.END, "-" * 60 + "\n")
-                for line in assembly:
-                    self.output_text.insert(tk.END, line + "\n", "operator")
+                out.write("ASSEMBLY:\n", "header")
+                out.write("-" * 60 + "\n")
+                self.listing = (len(out.buffer), result.assembly_lines)
+                for line in result.assembly:
+                    out.write(line + "\n", "operator")
+                if result.code_gen.peephole and any(result.code_gen.peephole.hits.values()):
+                    out.write("-" * 60 + "\n")
+                    for rule, hits in result.code_gen.peephole.hits.items():
+                        if hits:
+                            out.write(f"peephole {rule}: {hits}\n", "header")
             elif mode == "RUN":
-                if output:
-                    self.output_text.insert(tk.END, "OUTPUT:\n", "header")
-                    self.output_text.insert(tk.END, "-" * 60 + "\n")
-                    self.output_text.insert(tk.END, "\n".join(map(str, output)), "success")
+                self._run_program(result.ir, result.ir_lines)
+            elif mode == "DIFFERENTIAL":
+                out.write("DIFFERENTIAL RUN:\n", "header")
+                out.write("-" * 60 + "\n")
+                runs = differential_run(result.ast_analyzed, result.ir_before, result.ir, max_bytes=OUTPUT_LIMIT)
+                out.write(f"{'Engine':<20} {'Steps':<10} {'Exit':<6} {'Result':<20}\n")
+                out.write("-" * 60 + "\n")
+                for run in runs:
+                    steps = "-" if run.steps is None else run.steps
+                    status = run.error or f"{len(run.output)} chars of output"
+                    out.write(f"{run.name:<20} ", "identifier")
+                    out.write(f"{steps:<10} {str(run.exit_code):<6} ", "number")
+                    out.write(f"{status}\n")
+                out.write("-" * 60 + "\n")
+                reference = runs[0].outcome()
+                mismatched = [run.name for run in runs[1:] if run.outcome() != reference]
+                if mismatched:
+                    out.write(f"MISMATCH: {', '.join(mismatched)} disagree with the interpreter\n", "keyword")
                 else:
-                    self.output_text.insert(tk.END, "[Program executed successfully with no output]")
+                    out.write("All engines agree\n", "success")
+
+            elif mode == "COST":
+                out.write("ESTIMATED COST:\n", "header")
+                out.write("-" * 60 + "\n")
+                table = estimate(result).format()
+                out.write(table[0] + "\n", "header")
+                for line in table[1:]:
+                    out.write(line + "\n", "number")
+                out.write("-" * 60 + "\n")
+                totals = level_comparison(lambda other: compile_source(code, level=other, debug=self.debug_var.get(),
+                                                                       evaluator=evaluator))
+                comparison = format_comparison(totals, level)
+                out.write(comparison[0] + "\n", "header")
+                for line in comparison[1:]:
+                    out.write(line + "\n", "success" if line.endswith("<") else "identifier")
 
-        except (LexicalError, SyntaxError, SemanticError, RuntimeError) as e:
-            self.output_text.insert(tk.END, str(e))
+        except (PreprocessorError, LexicalError, SyntaxError, SemanticError, RuntimeError) as e:
+            out.write(str(e))
         except Exception as e:
-            self.output_text.insert(tk.END, f"Error: {str(e)}")
+            out.write(f"Error: {str(e)}")
+        out.refresh()
+
+    def _output_clicked(self, index):
+        if self.listing is None:
+            return
+        start, lines = self.listing
+        self._link(lines.line_at(index - start))
+
+    def _source_clicked(self):
+        if self.listing is not None:
+            self._link(int(self.input_text.index(tk.INSERT).split('.')[0]))
+
+    def _link(self, line):
+        # Highlight a source line and every listing line generated from it
+        self.input_text.tag_remove("linked", "1.0", tk.END)
+        if not line:
+            self.output.link([])
+            return
+        self.input_text.tag_add("linked", f"{line}.0", f"{line}.0 lineend")
+        self.input_text.see(f"{line}.0")
+        start, lines = self.listing
+        self.output.link([start + index for index in lines.indexes(line)])
+
+    def _run_program(self, ir, lines):
+        out = self.output
+        started = []
+
+        def write(text):
+            if not started:
+                out.write("OUTPUT:\n", "header")
+                out.write("-" * 60 + "\n")
+                started.append(True)
+            out.write(text, "success")
+            out.refresh()
+            self.root.update_idletasks()
+
+        sink = CallbackSink(write, max_bytes=OUTPUT_LIMIT, buffer_size=4096)
+        IRExecutor(sink).run(ir, lines)
+        if not sink.written:
+            out.write("[Program executed successfully with no output]")
@@ -1,108 +1,169 @@
 from ast_nodes import *
 from errors import RuntimeError
+from output_sink import BufferSink
+from printf_format import PrintfFormat
+from typed_ops import FLOAT_OPS, INT_OPS, TYPED_OPS, new_array
+from visitor import NodeVisitor
 
-class Interpreter:
-    def __init__(self):
-        self.env = {}
-        self.output = []
+# Deepest chain of active calls before a run is stopped as a stack overflow
+MAX_CALL_DEPTH = 10000
+
+def index_error(index, size):
+    return RuntimeError(f"Array index {index} out of bounds for size {size}")
+
+class ReturnSignal(Exception):
+    def __init__(self, value):
+        self.value = value
+
+class Interpreter(NodeVisitor):
+    def __init__(self, sink=None):
+        # Variables live in a preallocated frame indexed by the slot the
+        # semantic analyzer resolved for each declaration.
+        self.frame = []
+        self.functions = {}
+        self.depth = 0
+        self.sink = sink if sink is not None else BufferSink()
+        self.exit_code = 0
 
     def run(self, node):
-        self.visit(node)
-        return self.output
+        try:
+            self.visit(node)
+        except ReturnSignal as ret:
+            self.exit_code = ret.value
+        finally:
+            self.sink.flush()
+        return self.sink.getvalue()
 
-    def visit(self, node):
-        method = f"visit_{node.__class__.__name__}"
-        if hasattr(self, method):
-            return getattr(self, method)(node)
+    def generic_visit(self, node):
         raise RuntimeError(f"No runtime rule for {node.__class__.__name__}")
 
     def visit_Program(self, node):
+        self.frame = [0] * node.frame_size
+        self.functions = {function.name: function for function in node.functions}
         for stmt in node.statements:
-            self.visit(stmt)
+            yield stmt
 
     def visit_Block(self, node):
         for stmt in node.statements:
-            self.visit(stmt)
+            yield stmt
 
     def visit_Declaration(self, node):
-        if node.init_value:
-            self.env[node.name] = self.visit(node.init_value)
+        if node.size is not None:
+            self.frame[node.slot] = new_array(node.datatype, node.size)
+        elif node.init_value:
+            self.frame[node.slot] = yield node.init_value
         else:
-            self.env[node.name] = 0
+            self.frame[node.slot] = 0.0 if node.datatype == 'float' else 0
 
     def visit_Assignment(self, node):
-        value = self.visit(node.expr)
-        self.env[node.name] = value
+        self.frame[node.slot] = yield node.expr
+
+    def visit_IndexAssignment(self, node):
+        index = yield node.index
+        value = yield node.expr
+        if not 0 <= index < node.size:
+            raise index_error(index, node.size)
+        try:
+            self.frame[node.slot][index] = value
+        except OverflowError:
+            raise RuntimeError("Value does not fit in an int array element")
 
     def visit_PrintStatement(self, node):
-        value = self.visit(node.expr)
-        self.output.append(value)
+        value = yield node.expr
+        self.sink.write(f"{value}\n")
 
     def visit_PrintfStatement(self, node):
+        args = []
+        for arg in node.args:
+            args.append((yield arg))
         if node.format_str:
-            format_str = node.format_str.strip('"')
-            # Handle escape sequences
-            format_str = format_str.replace('\\n', '\n').replace('\\t', '\t').replace('\\\\', '\\')
-            args = [self.visit(arg) for arg in node.args]
+            if node.compiled is None:
+                node.compiled = PrintfFormat(node.format_str)
             try:
-                output = format_str
-                for arg in args:
-                    output = output.replace('%d', str(arg), 1)
-                    output = output.replace('%s', str(arg), 1)
-                    output = output.replace('%f', str(float(arg)), 1)
-                self.output.append(output)
-            except:
-                self.output.append(format_str)
+                self.sink.write(node.compiled.format(args))
+            except (TypeError, ValueError, OverflowError) as e:
+                raise RuntimeError(f"printf: {e}")
         else:
-            args = [self.visit(arg) for arg in node.args]
             for arg in args:
-                self.output.append(arg)
+                self.sink.write(f"{arg}\n")
 
     def visit_ReturnStatement(self, node):
-        pass
+        value = (yield node.return_val) if node.return_val else 0
+        raise ReturnSignal(value)
+
+    def visit_ExpressionStatement(self, node):
+        yield node.expr
+
+    def visit_Call(self, node):
+        args = []
+        for arg in node.args:
+            args.append((yield arg))
+        function = self.functions[node.name]
+        if self.depth >= MAX_CALL_DEPTH:
+            raise RuntimeError(f"Stack overflow: more than {MAX_CALL_DEPTH} nested calls")
+        # Each call gets a fresh frame; the caller's is restored on the way out.
+        caller = self.frame
+        self.frame = [0] * function.frame_size
+        for param, value in zip(function.params, args):
+            self.frame[param.slot] = value
+        self.depth += 1
+        try:
+            yield function.body
+            value = 0.0 if function.return_type == 'float' else 0
+        except ReturnSignal as ret:
+            # A bare "return;" yields 0, which a float function returns as 0.0
+            value = float(ret.value) if function.return_type == 'float' else ret.value
+        finally:
+            self.frame = caller
+            self.depth -= 1
+        return value
+
     def visit_IfStatement(self, node):
-        cond = self.visit(node.condition)
+        cond = yield node.condition
         if cond:
-            self.visit(node.then_block)
+            yield node.then_block
         elif node.else_block:
-            self.visit(node.else_block)
+            yield node.else_block
 
     def visit_WhileStatement(self, node):
-        while self.visit(node.condition):
-            self.visit(node.body)
+        while (yield node.condition):
+            yield node.body
+
+    def visit_ForStatement(self, node):
+        if node.init:
+            yield node.init
+        while (yield node.condition):
+            yield node.body
+            if node.step:
+                yield node.step
 
     def visit_BinaryOp(self, node):
-        left = self.visit(node.left)
-        right = self.visit(node.right)
-        if node.op == '+':
-            return left + right
-        elif node.op == '-':
-            return left - right
-        elif node.op == '*':
-            return left * right
-        elif node.op == '/':
-            return left // right  # integer division
-        elif node.op == '%':
-            return left % right
-        elif node.op == '==':
-            return int(left == right)
-        elif node.op == '!=':
-            return int(left != right)
-        elif node.op == '<':
-            return int(left < right)
-        elif node.op == '<=':
-            return int(left <= right)
-        elif node.op == '>':
-            return int(left > right)
-        elif node.op == '>=':
-            return int(left >= right)
-        else:
+        left = yield node.left
+        right = yield node.right
+        # The semantic analyzer has already picked the operand type, so the
+        # int and float tables never need to inspect the values.
+        ops = TYPED_OPS.get(node.optype)
+        if ops is None:
+            ops = FLOAT_OPS if isinstance(left, float) or isinstance(right, float) else INT_OPS
+        if node.op not in ops:
             raise RuntimeError(f"Unknown operator {node.op}")
+        try:
+            return ops[node.op](left, right)
+        except ZeroDivisionError:
+            raise RuntimeError("Division by zero")
+
+    def visit_Cast(self, node):
+        value = yield node.expr
+        return float(value) if node.ctype == 'float' else int(value)
+
+    def visit_Index(self, node):
+        index = yield node.index
+        if not 0 <= index < node.size:
+            raise index_error(index, node.size)
+        return self.frame[node.slot][index]
 
     def visit_Number(self, node):
         return node.value
 
     def visit_Identifier(self, node):
-        if node.name not in self.env:
-            raise RuntimeError(f"Variable '{node.name}' not defined")
-        return self.env[node.name]
+        return self.frame[node.slot]
@@ -0,0 +1,352 @@
+import ast
+import math
+import re
+
+from typed_ops import CONVERSIONS, FLOAT_IR_OPS, INT_OPS, FLOAT_PREFIX
+
+BINARY_OPS = set(INT_OPS) | set(FLOAT_IR_OPS)
+COMMUTATIVE_OPS = {'+', '*', '==', '!=', '&', 'f+', 'f*', 'f==', 'f!='}
+MIRRORED_OPS = {'<': '>', '>': '<', '<=': '>=', '>=': '<='}
+MIRRORED_OPS.update({FLOAT_PREFIX + op: FLOAT_PREFIX + other for op, other in list(MIRRORED_OPS.items())})
+UNARY_OPS = set(CONVERSIONS)
+
+
+CONSTANT_RE = re.compile(r'-?\d+(\.\d*)?([eE][-+]?\d+)?')
+LOAD_RE = re.compile(r'(\S+) = ([^\s\[]+)\[(\S+)\]')
+STORE_RE = re.compile(r'([^\s\[]+)\[(\S+)\] = (\S+)')
+
+
+def is_constant(operand):
+    return isinstance(operand, str) and CONSTANT_RE.fullmatch(operand) is not None
+
+
+def parse_constant(operand):
+    if not is_constant(operand):
+        return None
+    if operand.lstrip('-').isdigit():
+        return int(operand)
+    return float(operand)
+
+
+def format_constant(value):
+    # Non-finite floats have no literal form in the IR, so they are never folded.
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return str(value)
+
+
+class Instruction:
+    def __init__(self, kind, dest=None, op=None, args=None, target=None, text=None):
+        self.kind = kind
+        self.dest = dest
+        self.op = op
+        self.args = args or []
+        self.target = target
+        self.text = text
+
+    def uses(self):
+        if self.kind == 'func':
+            return []
+        return [arg for arg in self.args if not is_constant(arg)]
+
+    def is_jump(self):
+        return self.kind in ('goto', 'if_false', 'return')
+
+    def __str__(self):
+        if self.kind == 'label':
+            return f"{self.target}:"
+        if self.kind == 'goto':
+            return f"goto {self.target}"
+        if self.kind == 'if_false':
+            return f"if_false {self.args[0]} goto {self.target}"
+        if self.kind == 'copy':
+            return f"{self.dest} = {self.args[0]}"
+        if self.kind == 'binop':
+            return f"{self.dest} = {self.args[0]} {self.op} {self.args[1]}"
+        if self.kind == 'unop':
+            return f"{self.dest} = {self.op} {self.args[0]}"
+        if self.kind == 'printf':
+            return f"printf {self.text}, {self.args}"
+        if self.kind == 'print':
+            return f"print {self.args[0]}"
+        if self.kind == 'return':
+            return f"return {self.args[0]}" if self.args else "return"
+        if self.kind == 'call':
+            call = f"call {self.target} {self.args}"
+            return f"{self.dest} = {call}" if self.dest else call
+        if self.kind == 'func':
+            return ' '.join(['func', self.target] + self.args)
+        if self.kind == 'array':
+            return f"{self.dest} = array {self.op} {self.args[0]}"
+        if self.kind == 'load':
+            return f"{self.dest} = {self.target}[{self.args[0]}]"
+        if self.kind == 'store':
+            return f"{self.target}[{self.args[0]}] = {self.args[1]}"
+        if self.kind == 'bounds':
+            return f"bounds {self.args[0]} {self.args[1]}"
+        return self.text
+
+    def __repr__(self):
+        return f"Instruction({str(self)!r})"
+
+
+def decode(instruction):
+    instruction = instruction.strip()
+    if instruction.startswith('#') or not instruction:
+        return Instruction('comment', text=instruction)
+    if instruction.endswith(':') and ' ' not in instruction:
+        return Instruction('label', target=instruction[:-1])
+    if instruction.startswith('printf '):
+        # The format string never contains a quote, so the argument list
+        # starts right after the closing one.
+        end = instruction.index('"', instruction.index('"') + 1)
+        fmt = instruction[len('printf '):end + 1]
+        args = ast.literal_eval(instruction[end + 1:].lstrip(', '))
+        return Instruction('printf', args=[str(arg) for arg in args], text=fmt)
+    if '[' in instruction:
+        # Element accesses: "t = a[i]" and "a[i] = v"; the array itself is
+        # named by target, so only the index and value count as uses.
+        match = LOAD_RE.fullmatch(instruction)
+        if match:
+            return Instruction('load', dest=match.group(1), target=match.group(2), args=[match.group(3)])
+        match = STORE_RE.fullmatch(instruction)
+        if match:
+            return Instruction('store', target=match.group(1), args=[match.group(2), match.group(3)])
+    # Instructions are told apart by their whole shape, not the leading
+    # word: a variable may be named like any IR mnemonic.
+    parts = instruction.split()
+    if len(parts) == 2 and parts[0] == 'goto':
+        return Instruction('goto', target=parts[1])
+    if len(parts) == 4 and parts[0] == 'if_false' and parts[2] == 'goto':
+        return Instruction('if_false', args=[parts[1]], target=parts[3])
+    if len(parts) == 2 and parts[0] == 'print':
+        return Instruction('print', args=[parts[1]])
+    if parts[0] == 'return':
+        return Instruction('return', args=parts[1:2])
+    if parts[0] == 'bounds' and len(parts) == 3:
+        return Instruction('bounds', args=parts[1:])
+    if len(parts) == 5 and parts[1] == '=' and parts[2] == 'array':
+        return Instruction('array', dest=parts[0], op=parts[3], args=[parts[4]])
+    if parts[0] == 'func' and parts[1:2] != ['=']:
+        return Instruction('func', target=parts[1], args=parts[2:])
+    if parts[0] == 'call' and len(parts) >= 3 and parts[2].startswith('['):
+        args = ast.literal_eval(instruction.split(None, 2)[2])
+        return Instruction('call', target=parts[1], args=[str(arg) for arg in args])
+    if len(parts) >= 5 and parts[1] == '=' and parts[2] == 'call' and parts[4].startswith('['):
+        args = ast.literal_eval(instruction.split(None, 4)[4])
+        return Instruction('call', dest=parts[0], target=parts[3], args=[str(arg) for arg in args])
+    if len(parts) == 3 and parts[1] == '=':
+        return Instruction('copy', dest=parts[0], args=[parts[2]])
+    if len(parts) == 4 and parts[1] == '=' and parts[2] in UNARY_OPS:
+        return Instruction('unop', dest=parts[0], op=parts[2], args=[parts[3]])
+    if len(parts) == 5 and parts[1] == '=' and parts[3] in BINARY_OPS:
+        return Instruction('binop', dest=parts[0], op=parts[3], args=[parts[2], parts[4]])
+    return Instruction('other', text=instruction)
+
+
+class FunctionUnit:
+    def __init__(self, name, params=None, code=None):
+        self.name = name
+        self.params = list(params or [])
+        # Body without the "func" header line
+        self.code = code if code is not None else []
+
+    def header(self):
+        return str(Instruction('func', target=self.name, args=self.params))
+
+
+def split_units(ir_code):
+    # main's code comes first, then one "func" section per function.
+    units = [FunctionUnit('main')]
+    for line in ir_code:
+        if line.startswith('func '):
+            ins = decode(line)
+            if ins.kind == 'func':
+                units.append(FunctionUnit(ins.target, ins.args))
+                continue
+        units[-1].code.append(line)
+    return units
+
+
+def join_units(units):
+    code = []
+    for unit in units:
+        if unit.name != 'main':
+            code.append(unit.header())
+        code.extend(unit.code)
+    return code
+
+
+class CallGraph:
+    def __init__(self, units):
+        self.calls = {unit.name: [] for unit in units}
+        # Number of call sites naming each function, over the whole program
+        self.sites = {unit.name: 0 for unit in units}
+        for unit in units:
+            for line in unit.code:
+                if 'call ' not in line:
+                    continue
+                ins = decode(line)
+                if ins.kind == 'call':
+                    self.calls[unit.name].append(ins.target)
+                    self.sites[ins.target] = self.sites.get(ins.target, 0) + 1
+        self.recursive = {name for name in self.calls if name in self.reachable(*self.calls[name])}
+
+    def reachable(self, *roots):
+        seen = set()
+        stack = list(roots)
+        while stack:
+            name = stack.pop()
+            if name in seen or name not in self.calls:
+                continue
+            seen.add(name)
+            stack.extend(self.calls[name])
+        return seen
+
+    def bottom_up(self):
+        # Post-order over the call graph: callees come before their callers,
+        # except along a cycle.
+        order = []
+        seen = set()
+        for root in self.calls:
+            if root in seen:
+                continue
+            seen.add(root)
+            stack = [(root, iter(self.calls[root]))]
+            while stack:
+                name, callees = stack[-1]
+                for callee in callees:
+                    if callee not in seen and callee in self.calls:
+                        seen.add(callee)
+                        stack.append((callee, iter(self.calls[callee])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(name)
+        return order
+
+
+class BasicBlock:
+    def __init__(self, index):
+        self.index = index
+        self.instructions = []
+        self.succs = []
+        self.preds = []
+
+    def label(self):
+        if self.instructions and self.instructions[0].kind == 'label':
+            return self.instructions[0].target
+        return None
+
+    def defs(self):
+        return {ins.dest for ins in self.instructions if ins.dest}
+
+
+def build_cfg(instructions):
+    blocks = []
+    current = None
+    for ins in instructions:
+        if current is None or (ins.kind == 'label' and current.instructions):
+            current = BasicBlock(len(blocks))
+            blocks.append(current)
+        current.instructions.append(ins)
+        if ins.is_jump():
+            current = None
+
+    by_label = {block.label(): block for block in blocks if block.label()}
+    for i, block in enumerate(blocks):
+        last = block.instructions[-1]
+        if last.kind in ('goto', 'if_false') and last.target in by_label:
+            block.succs.append(by_label[last.target])
+        if last.kind not in ('goto', 'return') and i + 1 < len(blocks):
+            if blocks[i + 1] not in block.succs:
+                block.succs.append(blocks[i + 1])
+        for succ in block.succs:
+            succ.preds.append(block)
+    return blocks
+
+
+def compute_dominators(blocks):
+    # Iterative set-based dominance; programs are small enough that the
+    # quadratic worst case never matters.
+    if not blocks:
+        return {}
+    entry = blocks[0]
+    reachable = reachable_from(entry, include_start=True)
+    every = set(reachable)
+    dom = {block: set(every) for block in reachable}
+    dom[entry] = {entry}
+    changed = True
+    while changed:
+        changed = False
+        for block in blocks:
+            if block is entry or block not in reachable:
+                continue
+            preds = [dom[p] for p in block.preds if p in reachable]
+            new = set.intersection(*preds) if preds else set()
+            new.add(block)
+            if new != dom[block]:
+                dom[block] = new
+                changed = True
+
+    idom = {entry: None}
+    for block in reachable:
+        if block is entry:
+            continue
+        strict = dom[block] - {block}
+        # The immediate dominator is the strict dominator dominated by all others.
+        for candidate in strict:
+            if all(other in dom[candidate] for other in strict):
+                idom[block] = candidate
+                break
+    return idom
+
+
+def dominator_tree(blocks, idom):
+    children = {block: [] for block in idom}
+    for block in blocks:
+        parent = idom.get(block)
+        if parent is not None:
+            children[parent].append(block)
+    return children
+
+
+def reachable_from(start, include_start=False):
+    seen = set()
+    stack = list(start.succs)
+    while stack:
+        block = stack.pop()
+        if block in seen:
+            continue
+        seen.add(block)
+        stack.extend(block.succs)
+    if include_start:
+        seen.add(start)
+    return seen
+
+
+def compute_liveness(blocks):
+    use = {}
+    kill = {}
+    for block in blocks:
+        block_use, block_def = set(), set()
+        for ins in block.instructions:
+            block_use.update(name for name in ins.uses() if name not in block_def)
+            if ins.dest:
+                block_def.add(ins.dest)
+        use[block], kill[block] = block_use, block_def
+
+    live_in = {block: set() for block in blocks}
+    live_out = {block: set() for block in blocks}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(blocks):
+            out = set()
+            for succ in block.succs:
+                out |= live_in.get(succ, set())
+            new_in = use[block] | (out - kill[block])
+            if out != live_out[block] or new_in != live_in[block]:
+                live_out[block], live_in[block] = out, new_in
+                changed = True
+    return live_in, live_out
@@ -0,0 +1,309 @@
+import sys
+from time import perf_counter
+
+from errors import MemoryLimitError, RuntimeError, StepLimitError
+from interpreter import MAX_CALL_DEPTH, Interpreter, index_error
+from ir_analysis import decode, parse_constant, split_units
+from ir_opcodes import (ARRAY, BINOP, BOUNDS, CALL, COPY, GOTO, IF_FALSE, LOAD, LOOP, LOOP_IF_FALSE, PRINT, PRINTF,
+                        RETURN, STORE, UNOP)
+from line_table import LineTable, annotate, marker_line
+from output_sink import BufferSink
+from printf_format import PrintfFormat
+from tracing_jit import HOT_LOOP, NEVER, Loop, TracingJIT
+from typed_ops import CONVERSIONS, FLOAT_IR_OPS, INT_OPS, new_array
+
+
+class CompiledFunction:
+    def __init__(self, name):
+        self.name = name
+        self.code = []
+        # Initial register file, copied for every call
+        self.registers = []
+        self.slots = {}
+        # Registers holding a literal, by slot
+        self.constants = {}
+        self.params = []
+        # Source line of each entry of code, from the "# line N" markers
+        self.lines = LineTable()
+
+
+class IRExecutor:
+    def __init__(self, sink=None, max_steps=None, max_memory=None, jit=True):
+        self.sink = sink if sink is not None else BufferSink()
+        # Budgets for compile-time evaluation: instructions executed, and
+        # bytes of output plus live arrays.
+        self.max_steps = max_steps
+        self.max_memory = max_memory
+        # Whether hot loops are traced, and what the JIT did on the last run
+        self.jit = jit
+        self.jit_stats = None
+        self.functions = {}
+        # id() of each function's code -> its LineTable, for locating errors
+        self.code_lines = {}
+        self.code = []
+        self.registers = []
+        self.slots = {}
+        self.steps = 0
+        self.exit_code = 0
+
+    def load(self, ir_code):
+        self.functions = {}
+        for unit in split_units(ir_code):
+            self.functions[unit.name] = self._compile(unit)
+        # Calls are bound to their callee once every function is compiled.
+        for function in self.functions.values():
+            for pc, ins in enumerate(function.code):
+                if ins[0] == CALL:
+                    if ins[2] not in self.functions:
+                        raise RuntimeError(f"Undefined function {ins[2]}")
+                    function.code[pc] = (CALL, ins[1], self.functions[ins[2]], ins[3])
+        self.code_lines = {id(function.code): function.lines for function in self.functions.values()}
+        main = self.functions['main']
+        self.code, self.registers, self.slots = main.code, main.registers, main.slots
+        return self
+
+    def _compile(self, unit):
+        # Every variable, temporary and constant gets a register slot, so at
+        # run time each operand is a plain list index. Labels disappear: jumps
+        # carry the index of the instruction that follows their target.
+        function = CompiledFunction(unit.name)
+        self.slots = function.slots
+        self.registers = function.registers
+        self.constants = function.constants
+        function.params = [self._slot(param) for param in unit.params]
+        instructions = []
+        labels = {}
+        source_line = 0
+        for line in unit.code:
+            ins = decode(line)
+            if ins.kind == 'label':
+                labels[ins.target] = len(instructions)
+            elif ins.kind == 'comment':
+                parts = ins.text.split()
+                if parts[1:2] == ['declare'] and len(parts) == 4:
+                    self.registers[self._slot(parts[3])] = 0.0 if parts[2] == 'float' else 0
+                elif marker_line(ins.text) is not None:
+                    source_line = marker_line(ins.text)
+            elif ins.kind == 'other':
+                raise RuntimeError(f"Cannot execute IR instruction: {ins.text}")
+            else:
+                instructions.append(ins)
+                function.lines.append(source_line)
+
+        code = function.code
+        for ins in instructions:
+            if ins.kind in ('goto', 'if_false') and ins.target not in labels:
+                raise RuntimeError(f"Undefined label {ins.target}")
+            args = [self._slot(arg) for arg in ins.args]
+            if ins.kind == 'copy':
+                code.append((COPY, self._slot(ins.dest), args[0]))
+            elif ins.kind == 'binop':
+                func = FLOAT_IR_OPS.get(ins.op) or INT_OPS[ins.op]
+                code.append((BINOP, self._slot(ins.dest), args[0], args[1], func, ins.op))
+            elif ins.kind == 'unop':
+                code.append((UNOP, self._slot(ins.dest), args[0], CONVERSIONS[ins.op]))
+            elif ins.kind == 'goto':
+                code.append((GOTO, labels[ins.target]))
+            elif ins.kind == 'if_false':
+                code.append((IF_FALSE, args[0], labels[ins.target]))
+            elif ins.kind == 'printf':
+                code.append((PRINTF, PrintfFormat(ins.text), args))
+            elif ins.kind == 'print':
+                code.append((PRINT, args[0]))
+            elif ins.kind == 'return':
+                code.append((RETURN, args[0] if args else None))
+            elif ins.kind == 'call':
+                code.append((CALL, self._slot(ins.dest) if ins.dest else None, ins.target, args))
+            elif ins.kind == 'array':
+                code.append((ARRAY, self._slot(ins.dest), ins.op, int(ins.args[0])))
+            elif ins.kind == 'load':
+                code.append((LOAD, self._slot(ins.dest), self._slot(ins.target), args[0]))
+            elif ins.kind == 'store':
+                code.append((STORE, self._slot(ins.target), args[0], args[1]))
+            elif ins.kind == 'bounds':
+                code.append((BOUNDS, args[0], int(ins.args[1])))
+        # Running off the end returns like a bare "return".
+        code.append((RETURN, None))
+        function.lines.append(0)
+
+        # Jumps backwards close a loop; they count its iterations for the JIT.
+        loops = {}
+        threshold = HOT_LOOP if self.jit else NEVER
+        for pc, ins in enumerate(code):
+            if ins[0] == GOTO and ins[1] <= pc:
+                loop = loops.setdefault(ins[1], Loop(function, ins[1], threshold))
+                code[pc] = (LOOP, ins[1], loop)
+            elif ins[0] == IF_FALSE and ins[2] <= pc:
+                loop = loops.setdefault(ins[2], Loop(function, ins[2], threshold))
+                code[pc] = (LOOP_IF_FALSE, ins[1], ins[2], loop)
+        return function
+
+    def _slot(self, operand):
+        if operand not in self.slots:
+            self.slots[operand] = len(self.registers)
+            value = parse_constant(operand)
+            self.registers.append(0 if value is None else value)
+            if value is not None:
+                self.constants[self.slots[operand]] = value
+        return self.slots[operand]
+
+    def run(self, ir_code=None, lines=None):
+        # With the LineTable of ir_code, runtime errors name the source line.
+        if ir_code is not None:
+            self.load(ir_code if lines is None else annotate(ir_code, lines))
+        code = self.code
+        regs = list(self.registers)
+        write = self.sink.write
+        # Caller state saved by each active call: (code, registers, pc, dest, memory)
+        frames = []
+        pc = 0
+        steps = 0
+        # Steps are checked on jumps and calls only, which every long run
+        # passes through, so straight-line code pays nothing for the budget.
+        max_steps = sys.maxsize if self.max_steps is None else self.max_steps
+        max_memory = sys.maxsize if self.max_memory is None else self.max_memory
+        memory = 0
+        self.exit_code = 0
+        jit = TracingJIT(write, max_steps)
+        self.jit_stats = jit.stats
+        start = perf_counter()
+        try:
+            while True:
+                ins = code[pc]
+                pc += 1
+                steps += 1
+                kind = ins[0]
+                if kind == BINOP:
+                    regs[ins[1]] = ins[4](regs[ins[2]], regs[ins[3]])
+                elif kind == COPY:
+                    regs[ins[1]] = regs[ins[2]]
+                elif kind == IF_FALSE:
+                    if not regs[ins[1]]:
+                        pc = ins[2]
+                        if steps > max_steps:
+                            raise StepLimitError(f"Step limit of {max_steps} exceeded")
+                elif kind == LOOP:
+                    pc = ins[1]
+                    if steps > max_steps:
+                        raise StepLimitError(f"Step limit of {max_steps} exceeded")
+                    loop = ins[2]
+                    loop.count += 1
+                    if loop.count >= loop.threshold:
+                        pc, steps = jit.enter(loop, code, regs, pc, steps)
+                elif kind == LOOP_IF_FALSE:
+                    if not regs[ins[1]]:
+                        pc = ins[2]
+                        if steps > max_steps:
+                            raise StepLimitError(f"Step limit of {max_steps} exceeded")
+                        loop = ins[3]
+                        loop.count += 1
+                        if loop.count >= loop.threshold:
+                            pc, steps = jit.enter(loop, code, regs, pc, steps)
+                elif kind == LOAD:
+                    regs[ins[1]] = regs[ins[2]][regs[ins[3]]]
+                elif kind == STORE:
+                    try:
+                        regs[ins[1]][regs[ins[2]]] = regs[ins[3]]
+                    except OverflowError:
+                        raise RuntimeError("Value does not fit in an int array element")
+                elif kind == BOUNDS:
+                    if not 0 <= regs[ins[1]] < ins[2]:
+                        raise index_error(regs[ins[1]], ins[2])
+                elif kind == GOTO:
+                    pc = ins[1]
+                    if steps > max_steps:
+                        raise StepLimitError(f"Step limit of {max_steps} exceeded")
+                elif kind == UNOP:
+                    regs[ins[1]] = ins[3](regs[ins[2]])
+                elif kind == PRINTF:
+                    write(ins[1].format([regs[slot] for slot in ins[2]]))
+                elif kind == PRINT:
+                    write(f"{regs[ins[1]]}\n")
+                elif kind == ARRAY:
+                    regs[ins[1]] = buffer = new_array(ins[2], ins[3])
+                    memory += len(buffer) * buffer.itemsize
+                    if memory + self.sink.written > max_memory:
+                        raise MemoryLimitError(f"Memory limit of {max_memory} bytes exceeded")
+                elif kind == CALL:
+                    if len(frames) >= MAX_CALL_DEPTH:
+                        raise RuntimeError(f"Stack overflow: more than {MAX_CALL_DEPTH} nested calls")
+                    if steps > max_steps:
+                        raise StepLimitError(f"Step limit of {max_steps} exceeded")
+                    callee = ins[2]
+                    callee_regs = list(callee.registers)
+                    for slot, arg in zip(callee.params, ins[3]):
+                        callee_regs[slot] = regs[arg]
+                    frames.append((code, regs, pc, ins[1], memory))
+                    code, regs, pc = callee.code, callee_regs, 0
+                else:
+                    value = regs[ins[1]] if ins[1] is not None else 0
+                    if not frames:
+                        self.exit_code = value
+                        break
+                    # The callee's arrays die with its frame.
+                    code, regs, pc, dest, memory = frames.pop()
+                    if dest is not None:
+                        regs[dest] = value
+        except ZeroDivisionError:
+            raise self._located(RuntimeError("Division by zero"), code, pc)
+        except IndexError:
+            # Release builds have no "bounds" instructions; the buffer itself
+            # still rejects indexes past the end.
+            raise self._located(RuntimeError("Array index out of bounds"), code, pc)
+        except RuntimeError as e:
+            raise self._located(e, code, pc)
+        finally:
+            self.steps = jit.stats.steps = steps
+            jit.stats.run_time = perf_counter() - start
+            self.sink.flush()
+        return self.sink.getvalue()
+
+
+    def _located(self, error, code, pc):
+        # pc has already moved past the failing instruction.
+        lines = self.code_lines.get(id(code))
+        line = lines.line_at(pc - 1) if lines is not None else 0
+        if not line:
+            return error
+        return type(error)(f"Line {line}: {error}")
+
+
+class ExecutionResult:
+    def __init__(self, name, output='', exit_code=None, steps=None, error=None):
+        self.name = name
+        self.output = output
+        self.exit_code = exit_code
+        self.steps = steps
+        self.error = error
+
+    def outcome(self):
+        return (self.output, self.exit_code, self.error)
+
+
+def differential_run(ast, ir_before, ir_after, max_bytes=None):
+    # Runs the AST interpreter on the analyzed, unoptimized AST as the
+    # reference and the IR executor on the unoptimized and optimized IR; the
+    # optimizer is sound for this input when all three outcomes agree.
+    results = []
+    interpreter = Interpreter(BufferSink(max_bytes))
+    result = ExecutionResult('interpreter (AST)')
+    try:
+        interpreter.run(ast)
+        result.exit_code = interpreter.exit_code
+    except RuntimeError as e:
+        result.error = str(e)
+    result.output = interpreter.sink.getvalue()
+    results.append(result)
+
+    for name, ir_code in (('IR', ir_before), ('IR (optimized)', ir_after)):
+        executor = IRExecutor(BufferSink(max_bytes))
+        result = ExecutionResult(name)
+        try:
+            executor.run(ir_code)
+            result.exit_code = executor.exit_code
+        except RuntimeError as e:
+            result.error = str(e)
+        result.output = executor.sink.getvalue()
+        result.steps = executor.steps
+        results.append(result)
+    return results
@@ -1,103 +1,412 @@
-class IRGenerator:
-    def __init__(self):
+from ast_nodes import *
+from ir_analysis import decode
+from line_table import line_marker
+from typed_ops import ir_op
+from visitor import NodeVisitor
+
+# Int comparisons and their negations, for branching on the opposite outcome
+INVERTED_COMPARISONS = {'<': '>=', '>=': '<', '>': '<=', '<=': '>', '==': '!=', '!=': '=='}
+
+class IRGenerator(NodeVisitor):
+    def __init__(self, bounds_check=False, profile=None):
+        # Debug builds guard every element access with a "bounds" check.
+        self.bounds_check = bounds_check
+        # With an ExecutionProfile, cold branch arms move after the
+        # function's return, hot loops are rotated, and every name is
+        # weighted by how often the code mentioning it ran.
+        self.profile = profile
+        self.frequency = 1
+        self.weights = {}
+        self.cold = []
+        # Loop header label -> (site, expected trips per entry or None), for
+        # the cost model
+        self.loops = {}
         self.temp_count = 0
         self.label_count = 0
         self.code = []
+        self.temps = set()
+        self.user_names = set()
+        self.slot_names = []
+        # Value a bare "return;" produces; None inside main
+        self.return_default = None
+        # Source line of the statement being generated, and the one the
+        # last "# line N" marker named
+        self.line = 0
+        self.marked = 0
 
     def new_temp(self):
+        # Temporaries never reuse a user variable's name, so later passes can
+        # tell them apart through self.temps alone.
         self.temp_count += 1
-        return f"t{self.temp_count}"
+        while f"t{self.temp_count}" in self.user_names:
+            self.temp_count += 1
+        temp = f"t{self.temp_count}"
+        self.temps.add(temp)
+        return temp
 
     def new_label(self):
         self.label_count += 1
         return f"L{self.label_count}"
 
     def emit(self, instruction):
+        if self.line != self.marked:
+            self.code.append(line_marker(self.line))
+            self.marked = self.line
         self.code.append(instruction)
+        if self.profile is not None:
+            ins = decode(instruction)
+            names = ins.uses() + [ins.dest] + ([ins.target] if ins.kind in ('load', 'store') else [])
+            for name in names:
+                if name:
+                    self.weights[name] = self.weights.get(name, 0) + self.frequency
+
+    def hot_names(self):
+        return sorted((name for name in self.weights if self.weights[name]), key=lambda name: -self.weights[name])
+
+    def _enter(self, frequency):
+        # Code emitted from here on runs `frequency` times, if the profile knows.
+        outer = self.frequency
+        if frequency is not None:
+            self.frequency = frequency
+        return outer
+
+    def _mark(self, node):
+        if node is not None and node.line is not None:
+            self.line = node.line
+
+    def _flush_cold(self):
+        # The cold code carries its own markers.
+        self.marked = self.line
+        for instruction in self.cold:
+            self.emit(instruction)
+        self.cold = []
+        self.marked = None
 
     def generate(self, ast):
+        self.user_names = self._collect_names(ast)
+        if isinstance(ast, Program):
+            self.slot_names = ast.slot_names
+            for function in [ast] + ast.functions:
+                self.user_names |= set(function.slot_names)
         self.visit(ast)
         return self.code
 
-    def visit(self, node):
-        method = f"visit_{node.__class__.__name__}"
-        if hasattr(self, method):
-            return getattr(self, method)(node)
-        else:
-            raise Exception(f"IR: No visitor defined for {node.__class__.__name__}")
+    def _collect_names(self, node):
+        names = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (Program, Block)):
+                stack.extend(node.statements)
+                if isinstance(node, Program):
+                    stack.extend(node.functions)
+            elif isinstance(node, FunctionDef):
+                stack.extend(node.params)
+                stack.append(node.body)
+            elif isinstance(node, Declaration):
+                names.add(node.name)
+            elif isinstance(node, IfStatement):
+                stack.append(node.then_block)
+                if node.else_block:
+                    stack.append(node.else_block)
+            elif isinstance(node, WhileStatement):
+                stack.append(node.body)
+            elif isinstance(node, ForStatement):
+                stack.append(node.body)
+                if node.init:
+                    stack.append(node.init)
+        return names
+
+    def generic_visit(self, node):
+        raise Exception(f"IR: No visitor defined for {node.__class__.__name__}")
 
     def visit_Program(self, node):
+        if self.profile is not None:
+            self._enter(self.profile.functions.get('main', 1))
         for stmt in node.statements:
-            self.visit(stmt)
+            self._mark(stmt)
+            yield stmt
+        if self.cold:
+            self.emit("return 0")
+            self._flush_cold()
+        for function in node.functions:
+            yield function
+
+    def visit_FunctionDef(self, node):
+        # "func name params" opens each function after main; falling off the
+        # end returns the zero of the return type.
+        outer = self.slot_names, self.return_default
+        self.slot_names = node.slot_names
+        self.return_default = '0.0' if node.return_type == 'float' else '0'
+        if self.profile is not None:
+            self._enter(self.profile.functions.get(node.name, 0))
+        # The header takes no marker, and the body starts with one.
+        self.marked = self.line
+        self.emit(' '.join(['func', node.name] + [self.var_name(param) for param in node.params]))
+        self.marked = None
+        self._mark(node)
+        yield node.body
+        self.emit(f"return {self.return_default}")
+        self._flush_cold()
+        self.slot_names, self.return_default = outer
+
+    def var_name(self, node):
+        # Shadowed variables get a distinct IR name per frame slot.
+        if node.slot is not None and node.slot < len(self.slot_names):
+            return self.slot_names[node.slot]
+        return node.name
 
     def visit_Declaration(self, node):
-        if node.init_value:
-            expr_temp = self.visit(node.init_value)
-            self.emit(f"{node.name} = {expr_temp}")
+        if node.size is not None:
+            self.emit(f"{self.var_name(node)} = array {node.datatype} {node.size}")
+        elif node.init_value:
+            expr_temp = yield node.init_value
+            self.emit(f"{self.var_name(node)} = {expr_temp}")
         else:
-            self.emit(f"# declare {node.datatype} {node.name}")
+            self.emit(f"# declare {node.datatype} {self.var_name(node)}")
 
     def visit_Assignment(self, node):
-        expr_temp = self.visit(node.expr)
-        self.emit(f"{node.name} = {expr_temp}")
+        expr_temp = yield node.expr
+        self.emit(f"{self.var_name(node)} = {expr_temp}")
+
+    def visit_IndexAssignment(self, node):
+        index = yield node.index
+        expr_temp = yield node.expr
+        self._check_bounds(index, node.size)
+        self.emit(f"{self.var_name(node)}[{index}] = {expr_temp}")
+
+    def visit_Index(self, node):
+        index = yield node.index
+        self._check_bounds(index, node.size)
+        result = self.new_temp()
+        self.emit(f"{result} = {self.var_name(node)}[{index}]")
+        return result
+
+    def _check_bounds(self, index, size):
+        if self.bounds_check:
+            self.emit(f"bounds {index} {size}")
 
     def visit_PrintStatement(self, node):
-        expr_temp = self.visit(node.expr)
+        expr_temp = yield node.expr
         self.emit(f"print {expr_temp}")
 
     def visit_PrintfStatement(self, node):
         if node.format_str:
-            args_temps = [self.visit(arg) for arg in node.args]
+            args_temps = []
+            for arg in node.args:
+                args_temps.append((yield arg))
             self.emit(f"printf {node.format_str}, {args_temps}")
 
     def visit_ReturnStatement(self, node):
         if node.return_val:
-            ret_temp = self.visit(node.return_val)
+            ret_temp = yield node.return_val
             self.emit(f"return {ret_temp}")
+        elif self.return_default is not None:
+            self.emit(f"return {self.return_default}")
         else:
             self.emit("return")
 
+    def visit_ExpressionStatement(self, node):
+        args_temps = yield from self._call_args(node.expr)
+        self.emit(f"call {node.expr.name} {args_temps}")
+
+    def visit_Call(self, node):
+        args_temps = yield from self._call_args(node)
+        result = self.new_temp()
+        self.emit(f"{result} = call {node.name} {args_temps}")
+        return result
+
+    def _call_args(self, node):
+        args_temps = []
+        for arg in node.args:
+            args_temps.append((yield arg))
+        return args_temps
+
     def visit_IfStatement(self, node):
-        cond_temp = self.visit(node.condition)
+        counts = self.profile.branch(node.site) if self.profile is not None else None
+        if counts and node.else_block and counts[0] > counts[1]:
+            return (yield from self._cold_arm(node.condition, node.then_block, node.else_block, counts, False))
+        if counts and counts[1] > counts[0] and self._invertible(node.condition):
+            return (yield from self._cold_arm(node.condition, node.else_block, node.then_block, counts[::-1], True))
+
+        cond_temp = yield node.condition
         label_else = self.new_label()
         label_end = self.new_label()
         
         self.emit(f"if_false {cond_temp} goto {label_else}")
-        self.visit(node.then_block)
+        outer = self._enter(counts[0] if counts else None)
+        yield node.then_block
+        self._mark(node)
         self.emit(f"goto {label_end}")
         
         self.emit(f"{label_else}:")
         if node.else_block:
-            self.visit(node.else_block)
+            self._enter(counts[1] if counts else None)
+            yield node.else_block
+        self.frequency = outer
         
         self.emit(f"{label_end}:")
 
+    def _cold_arm(self, condition, hot, cold, counts, inverted):
+        # The hot arm falls through from the branch and straight on to the
+        # join; the cold one is emitted after the function's return and
+        # jumps back.
+        line = self.line
+        cond_temp = yield from (self._inverted(condition) if inverted else self._visit(condition))
+        label_cold = self.new_label()
+        label_end = self.new_label()
+
+        self.emit(f"if_false {cond_temp} goto {label_cold}")
+        outer = self._enter(counts[0])
+        if hot:
+            yield hot
+        self.frequency = outer
+        self.emit(f"{label_end}:")
+
+        code, self.code = self.code, []
+        marked, self.marked = self.marked, None
+        self._enter(counts[1])
+        self.emit(f"{label_cold}:")
+        yield cold
+        self.line = line
+        self.emit(f"goto {label_end}")
+        self.frequency = outer
+        self.cold.extend(self.code)
+        self.code = code
+        self.marked = marked
+
+    def _visit(self, node):
+        return (yield node)
+
+    def _invertible(self, condition):
+        return (isinstance(condition, BinaryOp) and condition.op in INVERTED_COMPARISONS
+                and condition.optype == 'int')
+
+    def _inverted(self, condition):
+        left = yield condition.left
+        right = yield condition.right
+        result = self.new_temp()
+        self.emit(f"{result} = {left} {INVERTED_COMPARISONS[condition.op]} {right}")
+        return result
+
+    def _loop_counts(self, node):
+        return self.profile.loop(node.site) if self.profile is not None else None
+
+    def _rotates(self, node, counts):
+        # Loops the profile saw iterate at least twice per entry test their
+        # condition at the bottom, so each iteration takes one jump, not two.
+        return counts and counts[1] >= 2 * counts[0] > 0 and self._invertible(node.condition)
+
+    def _expected_trips(self, node):
+        if getattr(node, 'trips', None) is not None:
+            return node.trips
+        if self.profile is not None:
+            trips = self.profile.average_trips(node.site)
+            if trips is not None:
+                return trips
+        if not isinstance(node, ForStatement):
+            return None
+        # for (i = a; i < b; i = i + c) with constant a, b and c
+        init, cond, step = node.init, node.condition, node.step
+        start = init.init_value if isinstance(init, Declaration) else getattr(init, 'expr', None)
+        name = getattr(init, 'name', None)
+        if not (isinstance(start, Number) and isinstance(cond, BinaryOp) and cond.op in ('<', '<=')
+                and isinstance(cond.left, Identifier) and cond.left.name == name
+                and isinstance(cond.right, Number) and isinstance(step, Assignment) and step.name == name
+                and isinstance(step.expr, BinaryOp) and step.expr.op == '+'
+                and isinstance(step.expr.left, Identifier) and step.expr.left.name == name
+                and isinstance(step.expr.right, Number) and type(step.expr.right.value) is int
+                and step.expr.right.value > 0):
+            return None
+        span = cond.right.value - start.value + (1 if cond.op == '<=' else 0)
+        return max(0, -(-span // step.expr.right.value))
+
+    def _rotated_loop(self, node, counts, step=None):
+        label_body = self.new_label()
+        label_end = self.new_label()
+        self.loops[label_body] = (node.site, self._expected_trips(node))
+
+        outer = self._enter(counts[0])
+        cond_temp = yield node.condition
+        self.emit(f"if_false {cond_temp} goto {label_end}")
+        self.emit(f"{label_body}:")
+        self._enter(counts[1])
+        yield node.body
+        if step:
+            self._mark(step)
+            yield step
+        self._mark(node)
+        cond_temp = yield from self._inverted(node.condition)
+        self.emit(f"if_false {cond_temp} goto {label_body}")
+        self.frequency = outer
+        self.emit(f"{label_end}:")
+
     def visit_WhileStatement(self, node):
+        counts = self._loop_counts(node)
+        if self._rotates(node, counts):
+            return (yield from self._rotated_loop(node, counts))
         label_start = self.new_label()
         label_end = self.new_label()
+        self.loops[label_start] = (node.site, self._expected_trips(node))
         
         self.emit(f"{label_start}:")
-        cond_temp = self.visit(node.condition)
+        outer = self._enter(counts[1] if counts else None)
+        cond_temp = yield node.condition
         self.emit(f"if_false {cond_temp} goto {label_end}")
         
-        self.visit(node.body)
+        yield node.body
+        self._mark(node)
         self.emit(f"goto {label_start}")
+        self.frequency = outer
+        self.emit(f"{label_end}:")
+
+    def visit_ForStatement(self, node):
+        if node.init:
+            self._mark(node.init)
+            yield node.init
+            self._mark(node)
+        counts = self._loop_counts(node)
+        if self._rotates(node, counts):
+            return (yield from self._rotated_loop(node, counts, node.step))
+        label_start = self.new_label()
+        label_end = self.new_label()
+        self.loops[label_start] = (node.site, self._expected_trips(node))
+
+        self.emit(f"{label_start}:")
+        outer = self._enter(counts[1] if counts else None)
+        cond_temp = yield node.condition
+        self.emit(f"if_false {cond_temp} goto {label_end}")
+
+        yield node.body
+        if node.step:
+            self._mark(node.step)
+            yield node.step
+        self._mark(node)
+        self.emit(f"goto {label_start}")
+        self.frequency = outer
         self.emit(f"{label_end}:")
 
     def visit_Block(self, node):
         for stmt in node.statements:
-            self.visit(stmt)
+            self._mark(stmt)
+            yield stmt
 
     def visit_BinaryOp(self, node):
-        left = self.visit(node.left)
-        right = self.visit(node.right)
+        left = yield node.left
+        right = yield node.right
         result = self.new_temp()
 
-        self.emit(f"{result} = {left} {node.op} {right}")
+        self.emit(f"{result} = {left} {ir_op(node.op, node.optype)} {right}")
+        return result
+
+    def visit_Cast(self, node):
+        value = yield node.expr
+        result = self.new_temp()
+        self.emit(f"{result} = {'itof' if node.ctype == 'float' else 'ftoi'} {value}")
         return result
 
     def visit_Number(self, node):
         return str(node.value)
 
     def visit_Identifier(self, node):
-        return node.name
+        return self.var_name(node)
@@ -0,0 +1,4 @@
+# Kinds of the IR executor's pre-decoded instructions. LOOP and
+# LOOP_IF_FALSE are GOTO and IF_FALSE jumping backwards, to a loop header.
+(COPY, BINOP, UNOP, GOTO, IF_FALSE, PRINTF, PRINT, RETURN, CALL, ARRAY, LOAD, STORE, BOUNDS, LOOP,
+ LOOP_IF_FALSE) = range(15)
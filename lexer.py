@@ -1,7 +1,9 @@
 import re
+from array import array
+
 from errors import LexicalError
 
-KEYWORDS = {'int', 'float', 'if', 'else', 'while', 'printf', 'return', 'include', 'stdio'}
+KEYWORDS = {'int', 'float', 'if', 'else', 'while', 'for', 'printf', 'return', 'include', 'stdio'}
 
 TOKEN_SPECIFICATION = [
     ('INCLUDE',  r'#include'),
@@ -21,69 +23,63 @@ TOKEN_SPECIFICATION = [
     ('RPAREN',   r'\)'),
     ('LBRACE',   r'\{'),
     ('RBRACE',   r'\}'),
+    ('LBRACKET', r'\['),
+    ('RBRACKET', r'\]'),
     ('LT',       r'<'),
     ('GT',       r'>'),
     ('SKIP',     r'[ \t\n]+'),
     ('MISMATCH', r'.'),
 ]
 
+TOKEN_PATTERN = '|'.join(f'(?P<{name}>{regex})' for name, regex in TOKEN_SPECIFICATION)
+TOKEN_RE = re.compile(TOKEN_PATTERN)
+# The same grammar over bytes, so a memory-mapped source file is lexed in place.
+BYTES_TOKEN_RE = re.compile(TOKEN_PATTERN.encode('ascii'))
+
+
 class Lexer:
     def __init__(self, code):
+        # code is a str or a bytes-like buffer such as an mmap of the source file
         self.code = code
-        self.line_map = {}
-        # Pre-calculate line numbers for each character position
-        self._build_line_numbers()
+        self.text = isinstance(code, str)
+        self.line_map = array('i')
+        self.values = {}
 
-    def _build_line_numbers(self):
-        self.pos_to_line = {}
-        line = 1
-        for pos, char in enumerate(self.code):
-            self.pos_to_line[pos] = line
-            if char == '\n':
-                line += 1
+    def value(self, lexeme):
+        # Each distinct lexeme of a buffer is decoded once and shared by its tokens.
+        value = self.values.get(lexeme)
+        if value is None:
+            value = self.values[lexeme] = lexeme.decode('utf-8', 'replace')
+        return value
 
-    def get_line_at_pos(self, pos):
-        if pos < 0:
-            return 1
-        if pos >= len(self.code):
-            return max(self.pos_to_line.values()) if self.pos_to_line else 1
-        return self.pos_to_line.get(pos, 1)
+    def iter_tokens(self):
+        code = self.code
+        newline = '\n' if self.text else b'\n'
+        match = (TOKEN_RE if self.text else BYTES_TOKEN_RE).match
+        self.line_map = array('i')
+        line = 1
+        mo = match(code)
 
-    def tokenize(self):
-        tok_regex = '|'.join(f'(?P<{name}>{regex})' for name, regex in TOKEN_SPECIFICATION)
-        get_token = re.compile(tok_regex).match
-        pos = 0
-        tokens = []
-        mo = get_token(self.code)
-        
         while mo:
             kind = mo.lastgroup
-            value = mo.group()
-            
             if kind == 'SKIP':
-                pass
+                line += mo.group().count(newline)
             elif kind == 'MISMATCH':
-                raise LexicalError(f"Line {self.get_line_at_pos(pos)}: Unexpected character '{value}'")
+                char = mo.group() if self.text else bytes(code[mo.start():mo.start() + 4]).decode('utf-8', 'replace')[0]
+                raise LexicalError(f"Line {line}: Unexpected character '{char}'")
             else:
-                token_line = self.get_line_at_pos(pos)
-                self.line_map[len(tokens)] = token_line
-                
-                if kind == 'INCLUDE':
-                    tokens.append(('INCLUDE', value))
-                elif kind == 'STRING':
-                    tokens.append(('STRING', value))
-                elif kind == 'NUMBER':
-                    tokens.append(('NUMBER', value))
-                elif kind == 'DOT':
-                    tokens.append(('DOT', value))
-                elif kind == 'ID':
-                    tokens.append(('KEYWORD' if value in KEYWORDS else 'IDENTIFIER', value))
-                elif kind in {'ASSIGN','END','COMMA','OP','LPAREN','RPAREN','LBRACE','RBRACE','GT','LT','EQ','NE','GE','LE'}:
-                    tokens.append((kind, value))
-            
-            pos = mo.end()
-            mo = get_token(self.code, pos)
-        
-        self.line_map[len(tokens)] = self.get_line_at_pos(len(self.code) - 1)
-        tokens.append(('EOF', None))
-        return tokens
+                value = mo.group() if self.text else self.value(mo.group())
+                if kind == 'ID':
+                    kind = 'KEYWORD' if value in KEYWORDS else 'IDENTIFIER'
+                self.line_map.append(line)
+                yield kind, value
+                if kind == 'STRING':
+                    line += value.count('\n')
+            mo = match(code, mo.end())
+
+        # EOF is reported on the line of the last character.
+        self.line_map.append(line - (code[-1:] == newline))
+        yield 'EOF', None
+
+    def tokenize(self):
+        return list(self.iter_tokens())
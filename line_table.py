@@ -0,0 +1,123 @@
+from array import array
+from bisect import bisect_right
+
+# IR and assembly carry their source line as "# line N" comments in front
+# of the first instruction of each line; compile() strips them into a
+# LineTable that sits next to the listing.
+LINE_MARKER = '# line '
+
+
+def line_marker(line):
+    return f"{LINE_MARKER}{line}"
+
+
+def marker_line(text):
+    # The line a "# line N" comment names, else None
+    text = text.strip()
+    if text.startswith(LINE_MARKER):
+        return int(text[len(LINE_MARKER):])
+    return None
+
+
+class LineTable:
+    # Source line of each entry of a listing. Consecutive entries on one
+    # line form a run, stored as (run length, line minus the previous
+    # run's line), so a table costs a few bytes per source line rather than
+    # an object per instruction. Line 0 means "no source line".
+    def __init__(self):
+        self.runs = array('q')
+        self.count = 0
+        self.last_line = 0
+        # Start index and line of every run, built on the first lookup
+        self._starts = None
+        self._lines = None
+
+    def append(self, line):
+        if self.runs and line == self.last_line:
+            self.runs[-2] += 1
+        else:
+            self.runs.extend((1, line - self.last_line))
+            self.last_line = line
+        self.count += 1
+        self._starts = None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for start, end, line in self.ranges():
+            for _ in range(end - start):
+                yield line
+
+    def ranges(self):
+        # (first index, end index, line) of every run
+        start, line = 0, 0
+        runs = self.runs
+        for i in range(0, len(runs), 2):
+            line += runs[i + 1]
+            yield start, start + runs[i], line
+            start += runs[i]
+
+    def line_at(self, index):
+        if not 0 <= index < self.count:
+            return 0
+        if self._starts is None:
+            self._starts = array('q')
+            self._lines = array('q')
+            for start, _, line in self.ranges():
+                self._starts.append(start)
+                self._lines.append(line)
+        return self._lines[bisect_right(self._starts, index) - 1]
+
+    def indexes(self, line):
+        # Every entry on the given source line
+        return [index for start, end, run_line in self.ranges() if run_line == line
+                for index in range(start, end)]
+
+    @classmethod
+    def from_runs(cls, runs):
+        table = cls()
+        table.runs.extend(runs)
+        for i in range(0, len(table.runs), 2):
+            table.count += table.runs[i]
+            table.last_line += table.runs[i + 1]
+        return table
+
+    @classmethod
+    def filled(cls, count, line=0):
+        table = cls()
+        if count:
+            table.runs.extend((count, line))
+            table.count = count
+            table.last_line = line
+        return table
+
+
+def strip_lines(code):
+    # Listing without its line markers, and the LineTable of what remains.
+    # Function headers belong to no line.
+    stripped = []
+    table = LineTable()
+    line = 0
+    for text in code:
+        marked = marker_line(text)
+        if marked is not None:
+            line = marked
+            continue
+        if text.startswith('func '):
+            line = 0
+        stripped.append(text)
+        table.append(line)
+    return stripped, table
+
+
+def annotate(code, table, indent=''):
+    # Inverse of strip_lines: a marker wherever the line changes
+    annotated = []
+    current = 0
+    for text, line in zip(code, table):
+        if line != current and not text.startswith('func '):
+            annotated.append(indent + line_marker(line))
+        current = line
+        annotated.append(text)
+    return annotated
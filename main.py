@@ -1,4 +1,117 @@
-from gui import CompilerGUI
+import argparse
+import sys
+
+from pass_manager import DEFAULT_LEVEL, LEVELS
+from program_evaluator import DEFAULT_MEMORY, DEFAULT_STEPS, ProgramEvaluator
+
+EMIT_MODES = ["run", "tokens", "ast", "ir", "ir-opt", "pseudocode", "asm", "passes", "cost"]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Mini C Compiler. Opens the GUI when no source file is given.")
+    parser.add_argument("source", nargs="?", help="C source file to compile headlessly")
+    parser.add_argument("-O", dest="level", type=int, choices=sorted(LEVELS), default=DEFAULT_LEVEL,
+                        help=f"optimization level (default {DEFAULT_LEVEL})")
+    parser.add_argument("--emit", choices=EMIT_MODES, default="run", help="what to print (default: run the program)")
+    parser.add_argument("-I", dest="include_paths", action="append", default=[], metavar="DIR",
+                        help="add a directory to the #include search path")
+    parser.add_argument("-D", dest="defines", action="append", default=[], metavar="NAME[=VALUE]",
+                        help="predefine an object-like macro")
+    parser.add_argument("-g", dest="debug", action="store_true", help="debug build: check array indexes at run time")
+    parser.add_argument("--lines", action="store_true",
+                        help="mark the source line of the code that follows in ir, ir-opt and asm output")
+    parser.add_argument("--unroll", dest="unroll_factor", type=int, default=None, metavar="FACTOR",
+                        help="partial loop unroll factor (default depends on -O; 1 disables)")
+    parser.add_argument("--profile-generate", metavar="FILE",
+                        help="run an instrumented -O0 build and write branch and loop counts to FILE")
+    parser.add_argument("--profile-use", metavar="FILE", help="optimize using counts written by --profile-generate")
+    parser.add_argument("--evaluate", action="store_true",
+                        help="run the program while compiling and, if it finishes within budget, emit only its output")
+    parser.add_argument("--eval-steps", type=int, default=DEFAULT_STEPS, metavar="N",
+                        help=f"instruction budget for --evaluate (default {DEFAULT_STEPS})")
+    parser.add_argument("--eval-memory", type=int, default=DEFAULT_MEMORY, metavar="BYTES",
+                        help=f"output plus array memory budget for --evaluate (default {DEFAULT_MEMORY})")
+    parser.add_argument("--save-artifacts", metavar="FILE",
+                        help="also write the optimized AST, symbol tables and IR to FILE in the binary artifact format")
+    parser.add_argument("--no-jit", dest="jit", action="store_false",
+                        help="interpret every loop instead of tracing hot ones")
+    parser.add_argument("--jit-stats", action="store_true",
+                        help="after running, print traces compiled, guard exits and speedup to stderr")
+    parser.add_argument("--budget", type=float, default=None, help="optimizer time budget in seconds")
+    parser.add_argument("--watch", metavar="DIR",
+                        help="rebuild the outputs of every .c file under DIR whenever its content or headers change")
+    parser.add_argument("--out-dir", metavar="DIR", help="where --watch writes its outputs (default: DIR/build)")
+    parser.add_argument("--outputs", metavar="LIST",
+                        help="comma-separated outputs for --watch: tokens, ast, ir, ir-opt, pseudocode, asm, artifact "
+                             "(default: asm)")
+    parser.add_argument("--once", action="store_true", help="with --watch, build what is out of date and exit")
+    return parser.parse_args(argv)
+
+
+def compile_file(args):
+    from artifacts import save_compilation
+    from compiler import LISTING_MODES, compile_path, listing
+    from cost_model import estimate, format_comparison, level_comparison
+    from errors import LexicalError, PreprocessorError, ProfileError, RuntimeError, SemanticError, SyntaxError
+    from execution_profile import ExecutionProfile, ProfilingInterpreter
+    from ir_executor import IRExecutor
+    from output_sink import StreamSink
+
+    try:
+        defines = dict(define.partition("=")[::2] for define in args.defines)
+        if args.profile_generate:
+            # The profile is taken from the unoptimized tree, whose branches
+            # and loops still match the source.
+            result = compile_path(args.source, level=0, search_paths=args.include_paths, defines=defines)
+            interpreter = ProfilingInterpreter(sink=StreamSink(sys.stdout))
+            interpreter.run(result.ast)
+            interpreter.profile.save(args.profile_generate)
+            return interpreter.exit_code
+        profile = ExecutionProfile.load(args.profile_use) if args.profile_use else None
+        evaluator = ProgramEvaluator(args.eval_steps, args.eval_memory) if args.evaluate else None
+        result = compile_path(args.source, level=args.level, budget=args.budget, search_paths=args.include_paths,
+                              defines=defines, debug=args.debug, unroll_factor=args.unroll_factor, profile=profile,
+                              evaluator=evaluator)
+        if args.save_artifacts:
+            save_compilation(args.save_artifacts, result)
+        if result.evaluation is not None and not result.evaluation.completed and args.emit != "passes":
+            print("\n".join(result.evaluation.report()), file=sys.stderr)
+        if args.emit == "cost":
+            totals = level_comparison(lambda level: compile_path(
+                args.source, level=level, search_paths=args.include_paths, defines=defines, debug=args.debug,
+                unroll_factor=args.unroll_factor, profile=profile))
+        if args.emit == "run":
+            executor = IRExecutor(StreamSink(sys.stdout), jit=args.jit)
+            try:
+                executor.run(result.ir, result.ir_lines)
+            finally:
+                if args.jit_stats and executor.jit_stats is not None:
+                    print("\n".join(executor.jit_stats.report()), file=sys.stderr)
+            return executor.exit_code
+    except (PreprocessorError, LexicalError, SyntaxError, SemanticError, RuntimeError, ProfileError) as e:
+        print(str(e), file=sys.stderr)
+        return 1
+
+    if args.emit in LISTING_MODES:
+        lines = listing(result, args.emit, args.lines)
+    elif args.emit == "cost":
+        lines = estimate(result).format() + [""] + format_comparison(totals, args.level)
+    else:
+        lines = (result.optimizer.passes.report() + result.optimizer.inline_log + result.optimizer.closed_form_log
+                 + result.optimizer.unroll_log)
+        if result.evaluation is not None:
+            lines += result.evaluation.report()
+    print("\n".join(lines))
+    return 0
+
 
 if __name__ == "__main__":
-    CompilerGUI()
+    args = parse_args(sys.argv[1:])
+    if args.watch:
+        from watch import watch_main
+        sys.exit(watch_main(args))
+    if args.source is None:
+        from gui import CompilerGUI
+        CompilerGUI()
+    else:
+        sys.exit(compile_file(args))
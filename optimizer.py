@@ -1,241 +1,821 @@
+import copy
+
 from ast_nodes import *
+from rewrite_rules import RewriteEngine
+from symbol_table import var_key
+from pass_manager import CLOSED_FORM_DEGREES, DEFAULT_LEVEL, INLINE_LIMITS, LEVELS, UNROLL_LIMITS, PassManager
+from line_table import line_marker, marker_line
+from scalar_evolution import ScalarEvolution
+from typed_ops import convert, evaluate
+from visitor import NodeVisitor
+from ir_analysis import (
+    COMMUTATIVE_OPS, MIRRORED_OPS, CallGraph, Instruction, build_cfg, compute_dominators,
+    compute_liveness, decode, dominator_tree, format_constant, is_constant, join_units,
+    parse_constant, reachable_from, split_units
+)
 
-class Optimizer:
-    def __init__(self):
+class Optimizer(NodeVisitor):
+    def __init__(self, max_iterations=None, symbols=None, level=DEFAULT_LEVEL, budget=None, unroll_factor=None,
+                 profile=None):
         self.optimized_code = []
+        self.stats = {}
+        self.temps = set()
+        self.inline_log = []
+        self.inline_count = 0
+        self.unroll_log = []
+        self.closed_form_log = []
+        # Overrides the level's partial unroll factor; 1 disables partial unrolling
+        self.unroll_factor = unroll_factor
+        # ExecutionProfile from an earlier run, consulted for unroll factors
+        self.profile = profile
+        self.level = level
+        self.max_iterations = max_iterations
+        self.rewriter = RewriteEngine(symbols)
+        self.passes = PassManager(budget)
+        self.passes.register('constant_folding', self._constant_folding)
+        # Value numbering keys expressions by operand, so constants must
+        # already be folded for equal expressions to be recognised.
+        self.passes.register('value_numbering', self._value_numbering, requires=['constant_folding'])
+        self.passes.register('copy_propagation', self._copy_propagation)
+        self.passes.register('dead_code_elimination', self._dead_code_elimination)
     
-    def optimize_ir(self, ir_code):
+    def optimize_ir(self, ir_code, temps=None):
         self.optimized_code = []
-        
-        ir_code = self._constant_folding(ir_code)
-        ir_code = self._constant_propagation(ir_code)
-        ir_code = self._dead_code_elimination(ir_code)
-        
-        return ir_code
-    
-    def _constant_propagation(self, ir_code):
-        # Build a map of variable -> constant value
-        const_map = {}
-        for instruction in ir_code:
-            if '=' in instruction and not instruction.startswith('if') and not instruction.startswith('goto'):
-                parts = instruction.split('=', 1)
-                if len(parts) == 2:
-                    var_name = parts[0].strip()
-                    value = parts[1].strip()
-                    try:
-                        const_map[var_name] = int(value)
-                    except:
-                        try:
-                            const_map[var_name] = float(value)
-                        except:
-                            pass
-        
-        # Replace variable references in printf with constant values
-        optimized = []
-        for instruction in ir_code:
-            if 'printf' in instruction:
-                # Replace variables in printf arguments with their constant values
-                new_instruction = instruction
-                for var, val in const_map.items():
-                    # Replace ['var'] with [val]
-                    new_instruction = new_instruction.replace(f"['{var}']", f"[{val}]")
-                    new_instruction = new_instruction.replace(f"'{var}'", f"{val}")
-                optimized.append(new_instruction)
-            else:
-                optimized.append(instruction)
-        
-        return optimized
+        self.stats = {}
+        # Names the IR generator created itself; only these may be coalesced
+        # away; user variables only disappear when liveness proves them dead.
+        self.temps = set(temps or ())
+        self.inline_log = []
+
+        units = split_units(ir_code)
+        if self.level in INLINE_LIMITS:
+            units = self._inline(units, *INLINE_LIMITS[self.level])
+
+        # The scalar passes see one function body at a time.
+        prologue, loop, iterations = LEVELS[self.level]
+        if self.max_iterations is not None:
+            iterations = min(iterations, self.max_iterations)
+        self.passes.reset()
+        for unit in units:
+            unit.code = self.passes.run(unit.code, prologue, loop, iterations)
+        return join_units(units)
+
+    def _inline(self, units, small, hot, growth):
+        # Bottom-up over the call graph, so a callee has already absorbed its
+        # own callees by the time it is copied into its callers.
+        by_name = {unit.name: unit for unit in units}
+        graph = CallGraph(units)
+        for name in graph.bottom_up():
+            unit = by_name[name]
+            limit = self._inline_cost(unit.code) + growth
+            instructions = [decode(line) for line in unit.code]
+            blocks = build_cfg(instructions)
+            code = []
+            # Source line of the caller's code, restored after each expansion
+            line = None
+            for block in blocks:
+                in_loop = block in reachable_from(block)
+                for ins in block.instructions:
+                    if ins.kind == 'comment' and marker_line(ins.text) is not None:
+                        line = marker_line(ins.text)
+                    callee = by_name.get(ins.target) if ins.kind == 'call' else None
+                    if callee is None:
+                        code.append(str(ins))
+                        continue
+                    cost = self._inline_cost(callee.code)
+                    inline, reason = self._inline_decision(callee.name, cost, graph, in_loop, small, hot)
+                    if inline and self._inline_cost(code) + cost > limit:
+                        inline, reason = False, "caller growth limit"
+                    if inline:
+                        code.extend(self._expand_call(ins, callee))
+                        if line is not None:
+                            code.append(line_marker(line))
+                        self.inline_log.append(f"{name}: inlined {callee.name} ({reason}, cost {cost})")
+                    else:
+                        code.append(str(ins))
+                        self.inline_log.append(f"{name}: kept call to {callee.name} ({reason}, cost {cost})")
+            unit.code = code
+
+        live = CallGraph(units).reachable('main')
+        for unit in units:
+            if unit.name not in live:
+                self.inline_log.append(f"removed {unit.name} (no calls left)")
+        return [unit for unit in units if unit.name in live]
+
+    def _inline_decision(self, callee, cost, graph, in_loop, small, hot):
+        if callee in graph.recursive:
+            return False, "recursive"
+        if graph.sites[callee] == 1:
+            return True, "single call site"
+        if cost <= small:
+            return True, "small"
+        if in_loop and cost <= hot:
+            return True, "hot call site"
+        return False, "too large"
+
+    def _inline_cost(self, code):
+        return sum(1 for line in code if not line.startswith('#') and not line.endswith(':'))
+
+    def _expand_call(self, call, callee):
+        # Every name and label of the callee gets a per-site suffix; returns
+        # become a copy into the call's destination and a jump past the body.
+        self.inline_count += 1
+        suffix = f".i{self.inline_count}"
+
+        def rename(name):
+            if is_constant(name):
+                return name
+            self.temps.add(name + suffix)
+            return name + suffix
+
+        end = f"Lret{suffix}"
+        code = [f"{rename(param)} = {arg}" for param, arg in zip(callee.params, call.args)]
+        for line in callee.code:
+            ins = decode(line)
+            if ins.kind == 'comment':
+                parts = ins.text.split()
+                if parts[1:2] == ['declare'] and len(parts) == 4:
+                    code.append(f"{rename(parts[3])} = {'0.0' if parts[2] == 'float' else '0'}")
+                elif marker_line(ins.text) is not None:
+                    code.append(ins.text)
+                continue
+            if ins.kind == 'return':
+                if call.dest:
+                    code.append(f"{call.dest} = {rename(ins.args[0]) if ins.args else '0'}")
+                code.append(f"goto {end}")
+                continue
+            if ins.dest:
+                ins.dest = rename(ins.dest)
+            ins.args = [rename(arg) for arg in ins.args]
+            if ins.kind in ('label', 'goto', 'if_false'):
+                ins.target += suffix
+            elif ins.kind in ('load', 'store'):
+                ins.target = rename(ins.target)
+            code.append(str(ins))
+        code.append(f"{end}:")
+        return code
+
+    def _count(self, pass_name, removed):
+        self.stats[pass_name] = self.stats.get(pass_name, 0) + removed
     
     def _constant_folding(self, ir_code):
+        # Forward dataflow over the CFG: a name is known only when every
+        # incoming path agrees on its constant value.
+        instructions = [decode(instruction) for instruction in ir_code]
+        blocks = build_cfg(instructions)
+        block_in = {}
+        block_out = {}
+        changed = True
+        while changed:
+            changed = False
+            for block in blocks:
+                known = self._meet_constants(block, block_out, blocks[0])
+                block_in[block] = dict(known)
+                for ins in block.instructions:
+                    self._fold_instruction(ins, known)
+                if block_out.get(block) != known:
+                    block_out[block] = known
+                    changed = True
+
+        removed = 0
         optimized = []
-        temp_values = {}
-        
-        for instruction in ir_code:
-            if '=' in instruction and not instruction.startswith('if') and not instruction.startswith('goto'):
-                parts = instruction.split('=', 1)
-                if len(parts) == 2:
-                    var_name = parts[0].strip()
-                    expr = parts[1].strip()
-                    
-                    try:
-                        result = self._evaluate_constant_expr(expr, temp_values)
-                        if result is not None:
-                            optimized.append(f"{var_name} = {result}")
-                            temp_values[var_name] = result
-                        else:
-                            optimized.append(instruction)
-                    except:
-                        optimized.append(instruction)
+        for block in blocks:
+            known = block_in[block]
+            for ins in block.instructions:
+                ins = self._fold_instruction(ins, known, rewrite=True)
+                if ins is None:
+                    removed += 1
                 else:
-                    optimized.append(instruction)
-            else:
-                optimized.append(instruction)
-        
+                    optimized.append(str(ins))
+        self._count('constant_folding', removed)
         return optimized
+
+    def _meet_constants(self, block, block_out, entry):
+        if block is entry:
+            return {}
+        incoming = [block_out[pred] for pred in block.preds if pred in block_out]
+        if not incoming:
+            return {}
+        known = dict(incoming[0])
+        for other in incoming[1:]:
+            for name in list(known):
+                if other.get(name) != known[name]:
+                    del known[name]
+        return known
+
+    def _fold_instruction(self, ins, known, rewrite=False):
+        args = [known.get(arg, arg) for arg in ins.args]
+        if rewrite:
+            ins.args = args
+        if ins.kind == 'copy':
+            value = args[0] if is_constant(args[0]) else None
+        elif ins.kind == 'binop':
+            left, right = parse_constant(args[0]), parse_constant(args[1])
+            value = None
+            if left is not None and right is not None:
+                result = self._evaluate_binary_op(left, ins.op, right)
+                value = format_constant(result) if result is not None else None
+            if rewrite and value is not None:
+                ins = Instruction('copy', dest=ins.dest, args=[value])
+        elif ins.kind == 'unop':
+            operand = parse_constant(args[0])
+            result = convert(ins.op, operand) if operand is not None else None
+            value = format_constant(result) if result is not None else None
+            if rewrite and value is not None:
+                ins = Instruction('copy', dest=ins.dest, args=[value])
+        elif ins.kind == 'if_false' and rewrite and is_constant(args[0]):
+            if parse_constant(args[0]):
+                return None
+            return Instruction('goto', target=ins.target)
+        elif ins.kind == 'bounds' and rewrite and is_constant(args[0]):
+            # A constant index that is in range needs no run-time check.
+            if 0 <= parse_constant(args[0]) < int(args[1]):
+                return None
+            return ins
+        else:
+            value = None
+
+        if ins.dest:
+            if value is None:
+                known.pop(ins.dest, None)
+            else:
+                known[ins.dest] = value
+        return ins
+
+    def _copy_propagation(self, ir_code):
+        # Available copies: "x = y" can be forwarded into later uses of x as
+        # long as every path to the use passes the copy and neither side has
+        # been reassigned since.
+        instructions = [decode(instruction) for instruction in ir_code]
+        blocks = build_cfg(instructions)
+        block_out = {}
+        changed = True
+        while changed:
+            changed = False
+            for block in blocks:
+                copies = self._meet_copies(block, block_out, blocks[0])
+                for ins in block.instructions:
+                    self._apply_copy(ins, copies)
+                if block_out.get(block) != copies:
+                    block_out[block] = copies
+                    changed = True
+
+        for block in blocks:
+            copies = self._meet_copies(block, block_out, blocks[0])
+            for ins in block.instructions:
+                ins.args = [copies.get(arg, arg) for arg in ins.args]
+                self._apply_copy(ins, copies)
+
+        # Forwarding "x = t" leaves later uses reading the temporary; until
+        # either is reassigned they may read x instead, which frees t to be
+        # folded below.
+        for block in blocks:
+            holders = {}
+            for ins in block.instructions:
+                ins.args = [holders.get(arg, arg) for arg in ins.args]
+                if ins.dest:
+                    for temp, holder in list(holders.items()):
+                        if ins.dest in (temp, holder):
+                            del holders[temp]
+                    if ins.kind == 'copy' and ins.args[0] in self.temps:
+                        holders[ins.args[0]] = ins.dest
+
+        # Fold "t = expr; x = t" into "x = expr" when t is a compiler
+        # temporary that is used nowhere else.
+        use_count = {}
+        for ins in instructions:
+            for name in ins.uses():
+                use_count[name] = use_count.get(name, 0) + 1
+        removed = 0
+        for block in blocks:
+            coalesced = []
+            for ins in block.instructions:
+                prev = coalesced[-1] if coalesced else None
+                if (ins.kind == 'copy' and prev is not None and prev.dest == ins.args[0]
+                        and prev.dest in self.temps and use_count.get(prev.dest) == 1):
+                    prev.dest = ins.dest
+                    removed += 1
+                    continue
+                coalesced.append(ins)
+            block.instructions = coalesced
+        self._count('copy_propagation', removed)
+        return [str(ins) for block in blocks for ins in block.instructions]
+
+    def _meet_copies(self, block, block_out, entry):
+        if block is entry:
+            return {}
+        incoming = [block_out[pred] for pred in block.preds if pred in block_out]
+        if not incoming:
+            return {}
+        copies = dict(incoming[0])
+        for other in incoming[1:]:
+            for name in list(copies):
+                if other.get(name) != copies[name]:
+                    del copies[name]
+        return copies
+
+    def _apply_copy(self, ins, copies):
+        if not ins.dest:
+            return
+        for name, source in list(copies.items()):
+            if name == ins.dest or source == ins.dest:
+                del copies[name]
+        if ins.kind == 'copy' and ins.args[0] != ins.dest:
+            copies[ins.dest] = ins.args[0]
     
-    def _evaluate_constant_expr(self, expr, temp_values):
-        expr = expr.strip()
-        
-        try:
-            return int(expr)
-        except:
-            pass
-        
-        for op in ['+', '-', '*', '/', '%', '==', '!=', '<', '>', '<=', '>=']:
-            if f' {op} ' in expr:
-                parts = expr.split(f' {op} ')
-                if len(parts) == 2:
-                    left = parts[0].strip()
-                    right = parts[1].strip()
-                    
-                    try:
-                        left_val = int(left) if left.isdigit() else temp_values.get(left, None)
-                        right_val = int(right) if right.isdigit() else temp_values.get(right, None)
-                        
-                        if left_val is not None and right_val is not None:
-                            if op == '+':
-                                return left_val + right_val
-                            elif op == '-':
-                                return left_val - right_val
-                            elif op == '*':
-                                return left_val * right_val
-                            elif op == '/' and right_val != 0:
-                                return left_val // right_val
-                            elif op == '%' and right_val != 0:
-                                return left_val % right_val
-                            elif op == '==':
-                                return int(left_val == right_val)
-                            elif op == '!=':
-                                return int(left_val != right_val)
-                            elif op == '<':
-                                return int(left_val < right_val)
-                            elif op == '>':
-                                return int(left_val > right_val)
-                            elif op == '<=':
-                                return int(left_val <= right_val)
-                            elif op == '>=':
-                                return int(left_val >= right_val)
-                    except:
-                        pass
-        
-        return None
-    
+    def _value_numbering(self, ir_code):
+        # Dominator-based value numbering: each block starts from the table of
+        # its immediate dominator, minus anything that may be redefined on a
+        # path between the two.
+        instructions = [decode(instruction) for instruction in ir_code]
+        blocks = build_cfg(instructions)
+        idom = compute_dominators(blocks)
+        children = dominator_tree(blocks, idom)
+        reach = {block: reachable_from(block) for block in blocks}
+
+        def_count = {}
+        uses = {}
+        for block in blocks:
+            for pos, ins in enumerate(block.instructions):
+                if ins.dest:
+                    def_count[ins.dest] = def_count.get(ins.dest, 0) + 1
+                for name in ins.uses():
+                    uses.setdefault(name, []).append((block, pos))
+
+        self._vn_counter = 0
+        self._vn_consts = {}
+        self._vn_removed = 0
+        rewritten = {}
+
+        def local_only(name, block, pos):
+            # A single definition whose uses all follow it in the same block
+            # can be dropped and its uses renamed to the earlier holder.
+            return def_count.get(name) == 1 and all(
+                b is block and p > pos for b, p in uses.get(name, [])
+            )
+
+        def last_use(name, block):
+            return max((p for b, p in uses.get(name, []) if b is block), default=-1)
+
+        def number_block(block, var_vn, exprs):
+            out = []
+            alias = {}
+            for pos, ins in enumerate(block.instructions):
+                ins.args = [alias.get(arg, arg) for arg in ins.args]
+                if ins.dest:
+                    for name, holder in list(alias.items()):
+                        if holder == ins.dest:
+                            del alias[name]
+                            if last_use(name, block) > pos:
+                                out.append(Instruction('copy', dest=name, args=[holder]))
+                                self._vn_removed -= 1
+
+                if ins.kind == 'copy':
+                    value = self._vn_operand(ins.args[0], var_vn)
+                    if var_vn.get(ins.dest) == value:
+                        self._vn_removed += 1
+                        continue
+                    var_vn[ins.dest] = value
+                elif ins.kind in ('binop', 'unop'):
+                    operands = [self._vn_operand(arg, var_vn) for arg in ins.args]
+                    key = self._vn_key(ins.op, *operands) if ins.kind == 'binop' else (ins.op, operands[0])
+                    hit = exprs.get(key)
+                    if hit and var_vn.get(hit[0]) == hit[1]:
+                        holder, value = hit
+                        if holder == ins.dest:
+                            self._vn_removed += 1
+                            continue
+                        var_vn[ins.dest] = value
+                        if local_only(ins.dest, block, pos):
+                            alias[ins.dest] = holder
+                            self._vn_removed += 1
+                            continue
+                        ins = Instruction('copy', dest=ins.dest, args=[holder])
+                    else:
+                        value = self._vn_fresh()
+                        var_vn[ins.dest] = value
+                        exprs[key] = (ins.dest, value)
+                elif ins.dest:
+                    var_vn[ins.dest] = self._vn_fresh()
+                out.append(ins)
+            rewritten[block] = out
+
+        # Walk the dominator tree with an explicit stack so long if-chains
+        # cannot exhaust the recursion limit.
+        stack = [(blocks[0], {}, {})] if blocks else []
+        while stack:
+            block, var_vn, exprs = stack.pop()
+            number_block(block, var_vn, exprs)
+            for child in children.get(block, []):
+                child_vn = dict(var_vn)
+                for other in blocks:
+                    if other in reach[block] and child in reach[other]:
+                        for name in other.defs():
+                            child_vn[name] = self._vn_fresh()
+                stack.append((child, child_vn, dict(exprs)))
+        for block in blocks:
+            if block not in rewritten:
+                number_block(block, {}, {})
+
+        self._count('value_numbering', self._vn_removed)
+        return [str(ins) for block in blocks for ins in rewritten[block]]
+
+    def _vn_fresh(self):
+        self._vn_counter += 1
+        return self._vn_counter
+
+    def _vn_operand(self, operand, var_vn):
+        if is_constant(operand):
+            if operand not in self._vn_consts:
+                self._vn_consts[operand] = self._vn_fresh()
+            return self._vn_consts[operand]
+        if operand not in var_vn:
+            var_vn[operand] = self._vn_fresh()
+        return var_vn[operand]
+
+    def _vn_key(self, op, left, right):
+        if op in COMMUTATIVE_OPS and left > right:
+            left, right = right, left
+        elif op in MIRRORED_OPS and left > right:
+            op, left, right = MIRRORED_OPS[op], right, left
+        return (op, left, right)
+
     def _dead_code_elimination(self, ir_code):
-        used_vars = set()
-        labels = set()
-        
-        for instruction in ir_code:
-            instruction = instruction.strip()
-            
-            if instruction.endswith(':'):
-                labels.add(instruction[:-1])
-            
-            if '=' in instruction and not instruction.startswith('if') and not instruction.startswith('goto'):
-                parts = instruction.split('=', 1)
-                if len(parts) == 2:
-                    expr = parts[1].strip()
-                    for word in expr.split():
-                        if word.isidentifier() and not word in {'if', 'false', 'goto', 'printf', 'print', 'return'}:
-                            used_vars.add(word)
-            
-            if instruction.startswith('if_false'):
-                parts = instruction.split()
-                if len(parts) >= 2:
-                    used_vars.add(parts[1])
-            
-            if 'printf' in instruction or 'print ' in instruction:
-                for word in instruction.split():
-                    if word.isidentifier() and word not in {'printf', 'print'}:
-                        used_vars.add(word)
-        
+        instructions = [decode(instruction) for instruction in ir_code]
+        blocks = build_cfg(instructions)
+        removed = 0
+
+        # Blocks no path from the entry reaches are dropped wholesale.
+        if blocks:
+            reachable = reachable_from(blocks[0], include_start=True)
+            removed += sum(len(block.instructions) for block in blocks if block not in reachable)
+            blocks = [block for block in blocks if block in reachable]
+
+        # Dead stores: a copy or arithmetic result that is not live afterwards.
+        _, live_out = compute_liveness(blocks)
+        for block in blocks:
+            live = set(live_out[block])
+            kept = []
+            for ins in reversed(block.instructions):
+                if ins.kind in ('copy', 'binop', 'unop') and ins.dest not in live:
+                    removed += 1
+                    continue
+                if ins.dest:
+                    live.discard(ins.dest)
+                live.update(ins.uses())
+                kept.append(ins)
+            block.instructions = kept[::-1]
+
+        # Jumps to the very next instruction and labels nothing jumps to.
+        flat = [ins for block in blocks for ins in block.instructions]
+        targets = {ins.target for ins in flat if ins.kind in ('goto', 'if_false')}
         optimized = []
-        assigned_vars = {}
-        
-        for instruction in ir_code:
-            instruction = instruction.strip()
-            
-            if instruction.endswith(':') or instruction.startswith('if') or instruction.startswith('goto'):
-                optimized.append(instruction)
-            elif instruction.startswith('printf') or instruction.startswith('print') or instruction.startswith('return'):
-                optimized.append(instruction)
-            elif '=' in instruction:
-                parts = instruction.split('=', 1)
-                if len(parts) == 2:
-                    var_name = parts[0].strip()
-                    if var_name in used_vars or not var_name.startswith('t'):
-                        optimized.append(instruction)
-                        assigned_vars[var_name] = True
-            else:
-                optimized.append(instruction)
-        
+        for i, ins in enumerate(flat):
+            if ins.kind == 'goto':
+                j = i + 1
+                while j < len(flat) and flat[j].kind in ('label', 'comment') and flat[j].target != ins.target:
+                    j += 1
+                if j < len(flat) and flat[j].kind == 'label':
+                    removed += 1
+                    continue
+            if ins.kind == 'label' and ins.target not in targets:
+                removed += 1
+                continue
+            optimized.append(str(ins))
+        self._count('dead_code_elimination', removed)
         return optimized
     
-    def optimize_ast(self, node):
-        if isinstance(node, Program):
-            node.statements = [self.optimize_ast(stmt) for stmt in node.statements]
-            return node
-        elif isinstance(node, Block):
-            node.statements = [self.optimize_ast(stmt) for stmt in node.statements]
-            return node
-        elif isinstance(node, Declaration):
-            if node.init_value:
-                node.init_value = self.optimize_ast(node.init_value)
-            return node
-        elif isinstance(node, Assignment):
-            node.expr = self.optimize_ast(node.expr)
-            return node
-        elif isinstance(node, BinaryOp):
-            node.left = self.optimize_ast(node.left)
-            node.right = self.optimize_ast(node.right)
-            if isinstance(node.left, Number) and isinstance(node.right, Number):
-                result = self._evaluate_binary_op(node.left.value, node.op, node.right.value)
-                if result is not None:
-                    return Number(result)
-            return node
-        elif isinstance(node, IfStatement):
-            node.condition = self.optimize_ast(node.condition)
-            node.then_block = self.optimize_ast(node.then_block)
-            if node.else_block:
-                node.else_block = self.optimize_ast(node.else_block)
-            return node
-        elif isinstance(node, WhileStatement):
-            node.condition = self.optimize_ast(node.condition)
-            node.body = self.optimize_ast(node.body)
-            return node
-        elif isinstance(node, PrintfStatement):
-            node.args = [self.optimize_ast(arg) for arg in node.args]
-            return node
-        elif isinstance(node, ReturnStatement):
-            if node.return_val:
-                node.return_val = self.optimize_ast(node.return_val)
+    def optimize_ast(self, node, env=None):
+        # env maps variable names to the constant they are known to hold at
+        # this point of straight-line execution.
+        self.unroll_log = []
+        self.closed_form_log = []
+        if self.level == 0:
             return node
+        if env is None:
+            env = {}
+        return self.visit(node, env)
+
+    def generic_visit(self, node, env):
+        return node
+
+    def visit_Program(self, node, env):
+        self.rewriter.compute_nonnegative(self._collect_assignments(node))
+        node.statements = yield from self._optimize_statements(node.statements, env)
+        functions = []
+        for function in node.functions:
+            functions.append((yield function, {}))
+        node.functions = functions
+        return node
+
+    def visit_FunctionDef(self, node, env):
+        # Parameters hold unknown values, so none is assumed non-negative.
+        assignments = self._collect_assignments(node.body)
+        for param in node.params:
+            assignments.setdefault(var_key(param), []).append(None)
+        self.rewriter.compute_nonnegative(assignments)
+        node.body.statements = yield from self._optimize_statements(node.body.statements, env)
+        return node
+
+    def visit_Block(self, node, env):
+        node.statements = yield from self._optimize_statements(node.statements, env)
+        return node
+
+    def visit_Declaration(self, node, env):
+        if node.init_value:
+            node.init_value = yield node.init_value, env
+        self._bind_constant(env, var_key(node), node.init_value)
+        return node
+
+    def visit_Assignment(self, node, env):
+        node.expr = yield node.expr, env
+        self._bind_constant(env, var_key(node), node.expr)
+        return node
+
+    def visit_IndexAssignment(self, node, env):
+        node.index = yield node.index, env
+        node.expr = yield node.expr, env
+        return node
+
+    def visit_Index(self, node, env):
+        node.index = yield node.index, env
+        return node
+
+    def visit_BinaryOp(self, node, env):
+        node.left = yield node.left, env
+        node.right = yield node.right, env
+        if isinstance(node.left, Number) and isinstance(node.right, Number):
+            result = self._evaluate_binary_op(node.left.value, node.op, node.right.value)
+            if result is not None:
+                return Number(result)
+        return self.rewriter.simplify(node)
+
+    def visit_Cast(self, node, env):
+        node.expr = yield node.expr, env
+        if isinstance(node.expr, Number):
+            return Number(convert('itof' if node.ctype == 'float' else 'ftoi', node.expr.value))
+        return node
+
+    def visit_Identifier(self, node, env):
+        if var_key(node) in env:
+            return Number(env[var_key(node)])
+        return node
+
+    def visit_IfStatement(self, node, env):
+        node.condition = yield node.condition, env
+        if isinstance(node.condition, Number):
+            branch = node.then_block if node.condition.value else node.else_block
+            return (yield branch, env) if branch else None
+        then_env = dict(env)
+        else_env = dict(env)
+        node.then_block = yield node.then_block, then_env
+        if node.else_block:
+            node.else_block = yield node.else_block, else_env
+        env.clear()
+        env.update({name: value for name, value in then_env.items() if else_env.get(name) == value})
+        return node
+
+    def visit_WhileStatement(self, node, env):
+        closed = self._closed_form(node.condition, [node.body])
+        if closed is not None:
+            return (yield self._spanned(closed, node), env)
+        for name in self._assigned_names(node.body):
+            env.pop(name, None)
+        node.condition = yield node.condition, env
+        if isinstance(node.condition, Number) and not node.condition.value:
+            return None
+        node.body = yield node.body, dict(env)
+        return node
+
+    def visit_ForStatement(self, node, env):
+        if node.init:
+            node.init = yield node.init, env
+        closed = self._closed_form(node.condition, [node.body, node.step])
+        if closed is not None:
+            closed = Block([stmt for stmt in [node.init] if stmt] + [self._spanned(closed, node)])
+            return (yield self._spanned(closed, node), env)
+        unrolled = self._unroll(node, env)
+        if unrolled is not None:
+            return (yield self._spanned(unrolled, node), env)
+        for name in self._assigned_names(node):
+            env.pop(name, None)
+        node.condition = yield node.condition, env
+        if isinstance(node.condition, Number) and not node.condition.value:
+            return node.init
+        body_env = dict(env)
+        node.body = yield node.body, body_env
+        if node.step:
+            node.step = yield node.step, body_env
+        return node
+
+    def _closed_form(self, condition, statements):
+        # Counting loops whose variables are polynomials in the iteration
+        # count become one guarded assignment of each final value. Loops
+        # with printf or any other side effect are left alone.
+        if self.level not in CLOSED_FORM_DEGREES:
+            return None
+        closed = ScalarEvolution(CLOSED_FORM_DEGREES[self.level]).closed_form(condition, statements)
+        if closed is None:
+            return None
+        if closed.statement is None:
+            self.closed_form_log.append(f"loop over {closed.name}: kept ({closed.reason})")
+            return None
+        self.closed_form_log.append(f"loop over {closed.name}: replaced by a degree {closed.degree} closed form")
+        return closed.statement
+
+    def _unroll(self, node, env):
+        # Counted loops "for (...; i < n; i = i + c)" whose body leaves i and
+        # n alone are unrolled fully when the trip count is known and small,
+        # otherwise partially: the body is repeated while a whole group of
+        # iterations still fits, and a remainder loop finishes the rest.
+        if self.level not in UNROLL_LIMITS:
+            return None
+        loop = self._counted_loop(node)
+        if loop is None:
+            return None
+        var, bound, stride = loop
+        budget, factor = UNROLL_LIMITS[self.level]
+        if self.unroll_factor is not None:
+            factor = self.unroll_factor
+        size = self._size(node.body) + self._size(node.step)
+        start = env.get(var_key(var))
+        limit = bound.value if isinstance(bound, Number) else env.get(var_key(bound))
+
+        trips = None
+        if isinstance(start, int) and isinstance(limit, int):
+            span = limit - start + (1 if node.condition.op == '<=' else 0)
+            trips = max(0, -(-span // stride))
+            if trips * size <= budget:
+                self.unroll_log.append(f"loop over {var.name}: fully unrolled ({trips} iterations)")
+                return Block([stmt for stmt in [node.init] if stmt] + self._repeat(node, trips))
+        if trips is None and self.unroll_factor is None and self.profile is not None:
+            factor = self._profiled_factor(node, var, factor, size, budget)
+            if factor is None:
+                return None
+        if factor < 2 or size * factor > budget or (trips is not None and trips < 2 * factor):
+            self.unroll_log.append(f"loop over {var.name}: not unrolled (body of {size} nodes)")
+            return None
+
+        offset = Number((factor - 1) * stride)
+        if isinstance(limit, int):
+            guard_bound = Number(limit - offset.value)
         else:
-            return node
+            guard_bound = BinaryOp(copy.deepcopy(bound), '-', offset, 'int', 'int')
+        guard = BinaryOp(copy.deepcopy(var), node.condition.op, guard_bound, 'int', 'int')
+        # Derived sites keep the source line without matching profile entries.
+        site = node.site or 'for@0'
+        if trips is None and self.profile is not None:
+            trips = self.profile.average_trips(node.site)
+        main = WhileStatement(guard, Block(self._repeat(node, factor)), f"{site}/unrolled{factor}",
+                              None if trips is None else trips // factor)
+        remainder = WhileStatement(node.condition, Block(self._repeat(node, 1)), f"{site}/remainder{factor}",
+                                   None if trips is None else trips % factor)
+        self.unroll_log.append(f"loop over {var.name}: unrolled by {factor} with a remainder loop")
+        return Block([stmt for stmt in [node.init] if stmt] + [self._spanned(main, node), self._spanned(remainder, node)])
+
+    def _spanned(self, replacement, node):
+        # Statements that stand in for a loop keep its source lines.
+        replacement.line, replacement.end_line = node.line, node.end_line
+        return replacement
+
+    def _profiled_factor(self, node, var, factor, size, budget):
+        # The observed trip count picks the factor: the largest power of two
+        # that still leaves two groups per entry, up to twice the level's
+        # factor and within the size budget.
+        counts = self.profile.loop(node.site)
+        if counts is None:
+            return factor
+        if not counts[1]:
+            self.unroll_log.append(f"loop over {var.name}: not unrolled (cold in profile)")
+            return None
+        trips = counts[1] / counts[0]
+        chosen = 1
+        while chosen * 2 <= min(2 * factor, trips / 2) and size * chosen * 2 <= budget:
+            chosen *= 2
+        if chosen < 2:
+            self.unroll_log.append(f"loop over {var.name}: not unrolled ({trips:.1f} trips per entry in profile)")
+            return None
+        self.unroll_log.append(f"loop over {var.name}: profile shows {trips:.1f} trips per entry")
+        return chosen
+
+    def _counted_loop(self, node):
+        cond, step = node.condition, node.step
+        if not (isinstance(cond, BinaryOp) and cond.op in ('<', '<=') and cond.optype == 'int'
+                and isinstance(cond.left, Identifier)):
+            return None
+        var, bound = cond.left, cond.right
+        key = var_key(var)
+        if not (isinstance(step, Assignment) and var_key(step) == key
+                and isinstance(step.expr, BinaryOp) and step.expr.op == '+'
+                and isinstance(step.expr.left, Identifier) and var_key(step.expr.left) == key
+                and isinstance(step.expr.right, Number) and type(step.expr.right.value) is int
+                and step.expr.right.value > 0):
+            return None
+        assigned = self._assigned_names(node.body)
+        if key in assigned:
+            return None
+        if isinstance(bound, Identifier):
+            if var_key(bound) in assigned or var_key(bound) == key:
+                return None
+        elif not (isinstance(bound, Number) and type(bound.value) is int):
+            return None
+        return var, bound, step.expr.right.value
+
+    def _repeat(self, node, count):
+        statements = []
+        for _ in range(count):
+            statements.append(copy.deepcopy(node.body))
+            statements.append(copy.deepcopy(node.step))
+        return statements
+
+    def _size(self, node):
+        count = 0
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(node)
+            elif type(node).__module__ == 'ast_nodes':
+                count += 1
+                stack.extend(vars(node).values())
+        return count
+
+    def visit_PrintfStatement(self, node, env):
+        args = []
+        for arg in node.args:
+            args.append((yield arg, env))
+        node.args = args
+        return node
+
+    def visit_ExpressionStatement(self, node, env):
+        node.expr = yield node.expr, env
+        return node
+
+    def visit_Call(self, node, env):
+        args = []
+        for arg in node.args:
+            args.append((yield arg, env))
+        node.args = args
+        return node
+
+    def visit_ReturnStatement(self, node, env):
+        if node.return_val:
+            node.return_val = yield node.return_val, env
+        return node
+
+    def _optimize_statements(self, statements, env):
+        optimized = []
+        for stmt in statements:
+            stmt = yield stmt, env
+            if stmt is None:
+                continue
+            optimized.append(stmt)
+            if self._always_returns(stmt):
+                break
+        return optimized
+
+    def _bind_constant(self, env, key, expr):
+        if isinstance(expr, Number):
+            env[key] = expr.value
+        else:
+            env.pop(key, None)
+
+    def _always_returns(self, stmt):
+        if isinstance(stmt, ReturnStatement):
+            return True
+        if isinstance(stmt, Block):
+            return any(self._always_returns(s) for s in stmt.statements)
+        if isinstance(stmt, IfStatement):
+            return (stmt.else_block is not None and self._always_returns(stmt.then_block)
+                    and self._always_returns(stmt.else_block))
+        return False
+
+    def _assigned_names(self, node):
+        return set(self._collect_assignments(node))
+
+    def _collect_assignments(self, node):
+        assignments = {}
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (Program, Block)):
+                stack.extend(node.statements)
+            elif isinstance(node, Declaration):
+                assignments.setdefault(var_key(node), []).append(node.init_value)
+            elif isinstance(node, Assignment):
+                assignments.setdefault(var_key(node), []).append(node.expr)
+            elif isinstance(node, IfStatement):
+                stack.append(node.then_block)
+                if node.else_block:
+                    stack.append(node.else_block)
+            elif isinstance(node, WhileStatement):
+                stack.append(node.body)
+            elif isinstance(node, ForStatement):
+                stack.append(node.body)
+                for clause in (node.init, node.step):
+                    if clause:
+                        stack.append(clause)
+        return assignments
     
     def _evaluate_binary_op(self, left, op, right):
-        try:
-            if op == '+':
-                return left + right
-            elif op == '-':
-                return left - right
-            elif op == '*':
-                return left * right
-            elif op == '/' and right != 0:
-                return left // right
-            elif op == '%' and right != 0:
-                return left % right
-            elif op == '==':
-                return int(left == right)
-            elif op == '!=':
-                return int(left != right)
-            elif op == '<':
-                return int(left < right)
-            elif op == '>':
-                return int(left > right)
-            elif op == '<=':
-                return int(left <= right)
-            elif op == '>=':
-                return int(left >= right)
-        except:
-            pass
-        return None
\ No newline at end of file
+        return evaluate(op, left, right)
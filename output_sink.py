@@ -0,0 +1,77 @@
+from errors import OutputLimitError
+
+
+class OutputSink:
+    def __init__(self, max_bytes=None, buffer_size=64 * 1024):
+        self.max_bytes = max_bytes
+        self.buffer_size = buffer_size
+        self.written = 0
+        self.truncated = False
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, text):
+        size = len(text) if text.isascii() else len(text.encode('utf-8'))
+        if self.max_bytes is not None and self.written + size > self.max_bytes:
+            room = self.max_bytes - self.written
+            if room > 0:
+                self._buffer.append(text.encode('utf-8')[:room].decode('utf-8', 'ignore'))
+                self.written += room
+            self.truncated = True
+            self.flush()
+            raise OutputLimitError(f"Output limit of {self.max_bytes} bytes exceeded")
+        self.written += size
+        self._buffer.append(text)
+        self._buffered += size
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._emit(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        self.flush()
+
+    def getvalue(self):
+        return ''
+
+    def _emit(self, text):
+        raise NotImplementedError
+
+
+class BufferSink(OutputSink):
+    def __init__(self, max_bytes=None):
+        super().__init__(max_bytes)
+        self.chunks = []
+
+    def _emit(self, text):
+        self.chunks.append(text)
+
+    def getvalue(self):
+        self.flush()
+        return ''.join(self.chunks)
+
+
+class StreamSink(OutputSink):
+    def __init__(self, stream, max_bytes=None, buffer_size=64 * 1024):
+        super().__init__(max_bytes, buffer_size)
+        self.stream = stream
+
+    def _emit(self, text):
+        self.stream.write(text)
+
+    def flush(self):
+        super().flush()
+        self.stream.flush()
+
+
+class CallbackSink(OutputSink):
+    def __init__(self, callback, max_bytes=None, buffer_size=64 * 1024):
+        super().__init__(max_bytes, buffer_size)
+        self.callback = callback
+
+    def _emit(self, text):
+        self.callback(text)
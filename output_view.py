@@ -0,0 +1,172 @@
+import tkinter as tk
+import tkinter.font as tkfont
+
+
+class OutputBuffer:
+    # Rendered output as whole lines plus the tagged spans on each line.
+    # Appending is linear in the text written; nothing reaches Tk until a
+    # line is scrolled into view.
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.lines = []
+        self.spans = []
+        self._parts = []
+        self._line_spans = []
+        self._width = 0
+
+    def write(self, text, tag=None):
+        for i, piece in enumerate(text.split('\n')):
+            if i:
+                self._end_line()
+            if piece:
+                if tag:
+                    self._line_spans.append((self._width, self._width + len(piece), tag))
+                self._parts.append(piece)
+                self._width += len(piece)
+
+    def _end_line(self):
+        self.lines.append(''.join(self._parts))
+        self.spans.append(tuple(self._line_spans))
+        self._parts = []
+        self._line_spans = []
+        self._width = 0
+
+    def __len__(self):
+        return len(self.lines) + (1 if self._parts else 0)
+
+    def line(self, index):
+        if index < len(self.lines):
+            return self.lines[index], self.spans[index]
+        return ''.join(self._parts), tuple(self._line_spans)
+
+    def getvalue(self):
+        return ''.join(line + '\n' for line in self.lines) + ''.join(self._parts)
+
+    def find(self, pattern, start=0):
+        # Case-insensitive, wrapping around to the top; returns (line, column).
+        pattern = pattern.lower()
+        total = len(self)
+        for offset in range(total):
+            index = (start + offset) % total
+            column = self.line(index)[0].lower().find(pattern)
+            if column >= 0:
+                return index, column
+        return None
+
+
+class VirtualText(tk.Frame):
+    # A read-mostly text pane over an OutputBuffer that only materialises the
+    # lines in its visible window. Scrolling, search and copy-all work on the
+    # buffer, so their cost does not depend on how much output there is.
+    def __init__(self, master, on_click=None, **text_options):
+        super().__init__(master, bg=text_options.get("bg"))
+        self.buffer = OutputBuffer()
+        self.top = 0
+        self.match = None
+        # Called with the buffer index of a clicked line
+        self.on_click = on_click
+        # Buffer indexes drawn with the "linked" tag
+        self.linked = set()
+
+        self.scrollbar = tk.Scrollbar(self, command=self._scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        xscrollbar = tk.Scrollbar(self, orient=tk.HORIZONTAL)
+        xscrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.text = tk.Text(self, wrap=tk.NONE, xscrollcommand=xscrollbar.set, **text_options)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        xscrollbar.config(command=self.text.xview)
+        self.font = tkfont.Font(font=self.text.cget("font"))
+        self.text.tag_config("match", background="#6e40c9")
+        self.text.tag_config("linked", background="#264f78")
+
+        self.text.bind("<Configure>", lambda e: self.refresh())
+        self.text.bind("<MouseWheel>", lambda e: self.scroll_lines(-3 if e.delta > 0 else 3))
+        self.text.bind("<Button-4>", lambda e: self.scroll_lines(-3))
+        self.text.bind("<Button-5>", lambda e: self.scroll_lines(3))
+        self.text.bind("<Prior>", lambda e: self.scroll_lines(-self.rows()))
+        self.text.bind("<Next>", lambda e: self.scroll_lines(self.rows()))
+        self.text.bind("<Control-Home>", lambda e: self.scroll_lines(-len(self.buffer)))
+        self.text.bind("<Control-End>", lambda e: self.scroll_lines(len(self.buffer)))
+        self.text.bind("<ButtonRelease-1>", self._clicked)
+
+    def tag_config(self, tag, **options):
+        self.text.tag_config(tag, **options)
+
+    def write(self, text, tag=None):
+        self.buffer.write(text, tag)
+
+    def clear(self):
+        self.buffer.clear()
+        self.top = 0
+        self.match = None
+        self.linked = set()
+        self.refresh()
+
+    def rows(self):
+        return max(1, self.text.winfo_height() // self.font.metrics("linespace"))
+
+    def refresh(self):
+        total, rows = len(self.buffer), self.rows()
+        self.top = max(0, min(self.top, total - rows))
+        end = min(total, self.top + rows + 1)
+        lines = [self.buffer.line(index) for index in range(self.top, end)]
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", '\n'.join(line for line, _ in lines))
+        for row, (_, spans) in enumerate(lines, 1):
+            for start, stop, tag in spans:
+                self.text.tag_add(tag, f"{row}.{start}", f"{row}.{stop}")
+            if self.top + row - 1 in self.linked:
+                self.text.tag_add("linked", f"{row}.0", f"{row}.end")
+        if self.match and self.top <= self.match[0] < end:
+            row = self.match[0] - self.top + 1
+            self.text.tag_add("match", f"{row}.{self.match[1]}", f"{row}.{self.match[1] + self.match[2]}")
+            self.text.see(f"{row}.{self.match[1]}")
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_lines(self, count):
+        self.top += count
+        self.refresh()
+        return "break"
+
+    def _scroll(self, action, amount, unit=None):
+        if action == tk.MOVETO:
+            self.top = int(float(amount) * len(self.buffer))
+        elif unit == tk.PAGES:
+            self.top += int(amount) * self.rows()
+        else:
+            self.top += int(amount)
+        self.refresh()
+
+    def find(self, pattern):
+        if not pattern:
+            return False
+        start = self.match[0] + 1 if self.match else self.top
+        found = self.buffer.find(pattern, start) if len(self.buffer) else None
+        if found is None:
+            self.match = None
+        else:
+            self.match = (found[0], found[1], len(pattern))
+            self.top = found[0] - self.rows() // 2
+        self.refresh()
+        return found is not None
+
+    def link(self, indexes):
+        # Highlight these lines, scrolling the first into view if none is
+        self.linked = set(indexes)
+        if self.linked and not any(self.top <= index < self.top + self.rows() for index in self.linked):
+            self.top = min(self.linked) - self.rows() // 2
+        self.refresh()
+
+    def _clicked(self, event):
+        if self.on_click is not None:
+            row = int(self.text.index(f"@{event.x},{event.y}").split('.')[0])
+            self.on_click(self.top + row - 1)
+
+    def copy_all(self):
+        self.clipboard_clear()
+        self.clipboard_append(self.buffer.getvalue())
@@ -6,13 +6,31 @@ class Parser:
         self.tokens = tokens
         self.pos = 0
         self.includes = set()
-        self.line_map = line_map or {}
+        self.line_map = line_map if line_map is not None else ()
+        self.sites = {}
 
-    def peek(self):
-        return self.tokens[self.pos] if self.pos < len(self.tokens) else ('EOF', None)
+    def peek(self, offset=0):
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else ('EOF', None)
+
+    def line_at(self, pos):
+        return self.line_map[pos] if 0 <= pos < len(self.line_map) else 0
 
     def get_line(self):
-        return self.line_map.get(self.pos, 0)
+        return self.line_at(self.pos)
+
+    def spanned(self, start, node):
+        # Record the lines of the tokens from start to the last one consumed
+        node.line = self.line_at(start)
+        node.end_line = self.line_at(self.pos - 1)
+        return node
+
+    def site(self, kind):
+        # Profiles key branches and loops by where they appear: "while@12",
+        # then "while@12#2" for a second loop on the same line.
+        key = f"{kind}@{self.get_line()}"
+        count = self.sites[key] = self.sites.get(key, 0) + 1
+        return key if count == 1 else f"{key}#{count}"
 
     def match(self, t):
         tok = self.peek()
@@ -21,7 +39,7 @@ class Parser:
             return tok
         
         if self.pos > 0:
-            line = self.line_map.get(self.pos - 1, self.line_map.get(self.pos, 0))
+            line = self.line_at(self.pos - 1) or self.get_line()
         else:
             line = self.get_line()
         
@@ -35,6 +53,8 @@ class Parser:
             msg = f"Line {line}: Missing opening brace '{{'"
         elif t == 'RBRACE':
             msg = f"Line {line}: Missing closing brace '}}'"
+        elif t == 'RBRACKET':
+            msg = f"Line {line}: Missing closing bracket ']'"
         elif t == 'IDENTIFIER':
             msg = f"Line {line}: Expected identifier but found {tok[0]}"
         else:
@@ -52,20 +72,37 @@ class Parser:
         stmts = []
         while self.peek()[0] == 'INCLUDE':
             self.skip_include()
-        if self.peek()[0] == 'KEYWORD' and self.peek()[1] == 'int':
-            self.pos_save = self.pos
-            self.match('KEYWORD')
-            if self.peek()[0] == 'IDENTIFIER' and self.peek()[1] == 'main':
-                stmts = self.parse_main_function()
-            else:
-                self.pos = self.pos_save
-                while self.peek()[0] != 'EOF':
-                    stmts.append(self.statement())
-        else:
-            while self.peek()[0] != 'EOF':
-                stmts.append(self.statement())
+        if self.at_function():
+            return self.parse_functions()
+        while self.peek()[0] != 'EOF':
+            stmts.append(self.statement())
         return Program(stmts)
 
+    def at_function(self):
+        tok_type, tok_val = self.peek()
+        return (tok_type == 'KEYWORD' and tok_val in {'int', 'float'}
+                and self.peek(1)[0] == 'IDENTIFIER' and self.peek(2)[0] == 'LPAREN')
+
+    def parse_functions(self):
+        main = None
+        functions = []
+        while self.peek()[0] != 'EOF':
+            line = self.get_line()
+            if not self.at_function():
+                raise SyntaxError(f"Line {line}: Expected a function definition")
+            function = self.function_definition()
+            if function.name == 'main':
+                if main is not None:
+                    raise SyntaxError(f"Line {line}: Redefinition of 'main'")
+                if function.params:
+                    raise SyntaxError(f"Line {line}: 'main' takes no parameters")
+                main = function
+            else:
+                functions.append(function)
+        if main is None:
+            raise SyntaxError("Error: Program has no 'main' function")
+        return Program(main.body.statements, functions)
+
     def skip_include(self):
         self.match('INCLUDE')
         if self.peek()[0] == 'LT':
@@ -80,16 +117,27 @@ class Parser:
             include_name = self.match('STRING')[1].strip('"')
             self.includes.add(include_name)
 
-    def parse_main_function(self):
-        self.match('IDENTIFIER')
+    def function_definition(self):
+        start = self.pos
+        return_type = self.match('KEYWORD')[1]
+        name = self.match('IDENTIFIER')[1]
         self.match('LPAREN')
+        params = []
+        if self.peek() == ('IDENTIFIER', 'void') and self.peek(1)[0] == 'RPAREN':
+            self.match('IDENTIFIER')
+        elif self.peek()[0] != 'RPAREN':
+            params.append(self.parameter())
+            while self.accept('COMMA'):
+                params.append(self.parameter())
         self.match('RPAREN')
-        self.match('LBRACE')
-        stmts = []
-        while self.peek()[0] != 'RBRACE':
-            stmts.append(self.statement())
-        self.match('RBRACE')
-        return stmts
+        body = self.block()
+        return self.spanned(start, FunctionDef(return_type, name, params, body))
+
+    def parameter(self):
+        start = self.pos
+        dtype = self.match('KEYWORD')[1]
+        name = self.match('IDENTIFIER')[1]
+        return self.spanned(start, Declaration(dtype, name))
 
     def statement(self):
         tok_type, tok_val = self.peek()
@@ -102,11 +150,15 @@ class Parser:
                 return self.if_statement()
             elif tok_val == 'while':
                 return self.while_statement()
+            elif tok_val == 'for':
+                return self.for_statement()
             elif tok_val == 'return':
                 return self.return_statement()
             elif tok_val in {'int', 'float'}:
                 return self.declaration()
         elif tok_type == 'IDENTIFIER':
+            if self.peek(1)[0] == 'LPAREN':
+                return self.call_statement()
             return self.assignment()
         elif tok_type == 'LBRACE':
             return self.block()
@@ -114,30 +166,68 @@ class Parser:
         raise SyntaxError(f"Line {line}: Unexpected token {tok_type} ({tok_val})")
 
     def declaration(self):
+        start = self.pos
         dtype = self.match('KEYWORD')[1]
         name = self.match('IDENTIFIER')[1]
         init_value = None
+        if self.accept('LBRACKET'):
+            line = self.get_line()
+            size = self.match('NUMBER')[1]
+            if not size.isdigit() or int(size) == 0:
+                raise SyntaxError(f"Line {line}: Array size must be a positive integer constant")
+            self.match('RBRACKET')
+            self.match('END')
+            return self.spanned(start, Declaration(dtype, name, size=int(size)))
         if self.accept('ASSIGN'):
             init_value = self.expr()
         self.match('END')
-        return Declaration(dtype, name, init_value)
+        return self.spanned(start, Declaration(dtype, name, init_value))
 
-    def assignment(self):
+    def assignment(self, end=True):
+        start = self.pos
         name = self.match('IDENTIFIER')[1]
+        index = None
+        if self.accept('LBRACKET'):
+            index = self.expr()
+            self.match('RBRACKET')
         self.match('ASSIGN')
         expr = self.expr()
+        if end:
+            self.match('END')
+        if index is not None:
+            return self.spanned(start, IndexAssignment(name, index, expr))
+        return self.spanned(start, Assignment(name, expr))
+
+    def call_statement(self):
+        start = self.pos
+        name = self.match('IDENTIFIER')[1]
+        call = self.call(name)
         self.match('END')
-        return Assignment(name, expr)
+        return self.spanned(start, ExpressionStatement(call))
+
+    def call(self, name):
+        # The name has been consumed already
+        start = self.pos - 1
+        self.match('LPAREN')
+        args = []
+        if self.peek()[0] != 'RPAREN':
+            args.append(self.expr())
+            while self.accept('COMMA'):
+                args.append(self.expr())
+        self.match('RPAREN')
+        return self.spanned(start, Call(name, args))
 
     def print_statement(self):
+        start = self.pos
         self.match('KEYWORD')
         self.match('LPAREN')
         expr = self.expr()
         self.match('RPAREN')
         self.match('END')
-        return PrintStatement(expr)
+        return self.spanned(start, PrintStatement(expr))
 
     def printf_statement(self):
+        start = self.pos
         self.match('KEYWORD')
         self.match('LPAREN')
         format_str = None
@@ -158,17 +248,20 @@ class Parser:
                     args.append(self.expr())
         self.match('RPAREN')
         self.match('END')
-        return PrintfStatement(format_str, args)
+        return self.spanned(start, PrintfStatement(format_str, args))
 
     def return_statement(self):
+        start = self.pos
         self.match('KEYWORD')
         return_val = None
         if self.peek()[0] != 'END':
             return_val = self.expr()
         self.match('END')
-        return ReturnStatement(return_val)
+        return self.spanned(start, ReturnStatement(return_val))
 
     def if_statement(self):
+        start = self.pos
+        site = self.site('if')
         self.match('KEYWORD')
         self.match('LPAREN')
         cond = self.expr()
@@ -177,43 +270,77 @@ class Parser:
         else_block = None
         if self.accept('KEYWORD', 'else'):
             else_block = self.block()
-        return IfStatement(cond, then_block, else_block)
+        return self.spanned(start, IfStatement(cond, then_block, else_block, site))
 
     def while_statement(self):
+        start = self.pos
+        site = self.site('while')
         self.match('KEYWORD')
         self.match('LPAREN')
         cond = self.expr()
         self.match('RPAREN')
         body = self.block()
-        return WhileStatement(cond, body)
+        return self.spanned(start, WhileStatement(cond, body, site))
+
+    def for_statement(self):
+        start = self.pos
+        site = self.site('for')
+        self.match('KEYWORD')
+        self.match('LPAREN')
+        init = None
+        if self.peek()[0] == 'KEYWORD' and self.peek()[1] in {'int', 'float'}:
+            init = self.declaration()
+        elif self.peek()[0] == 'IDENTIFIER':
+            init = self.assignment()
+        else:
+            self.match('END')
+        cond = Number(1)
+        if self.peek()[0] != 'END':
+            cond = self.expr()
+        self.match('END')
+        step = None
+        if self.peek()[0] != 'RPAREN':
+            step = self.assignment(end=False)
+        self.match('RPAREN')
+        body = self.block()
+        return self.spanned(start, ForStatement(init, cond, step, body, site))
 
     def block(self):
+        start = self.pos
         self.match('LBRACE')
         stmts = []
         while self.peek()[0] != 'RBRACE':
             stmts.append(self.statement())
         self.match('RBRACE')
-        return Block(stmts)
+        return self.spanned(start, Block(stmts))
 
     def expr(self):
+        start = self.pos
         node = self.term()
         while self.peek()[0] in ('OP', 'GT', 'LT', 'EQ', 'NE', 'GE', 'LE'):
             op = self.match(self.peek()[0])[1]
-            node = BinaryOp(node, op, self.term())
+            node = self.spanned(start, BinaryOp(node, op, self.term()))
         return node
 
     def term(self):
+        start = self.pos
         tok_type, tok_val = self.peek()
         if tok_type == 'NUMBER':
             self.match('NUMBER')
             # Handle both int and float numbers
             if '.' in tok_val:
-                return Number(float(tok_val))
+                return self.spanned(start, Number(float(tok_val)))
             else:
-                return Number(int(tok_val))
+                return self.spanned(start, Number(int(tok_val)))
         elif tok_type == 'IDENTIFIER':
             self.match('IDENTIFIER')
-            return Identifier(tok_val)
+            if self.peek()[0] == 'LPAREN':
+                return self.call(tok_val)
+            if self.accept('LBRACKET'):
+                index = self.expr()
+                self.match('RBRACKET')
+                return self.spanned(start, Index(tok_val, index))
+            return self.spanned(start, Identifier(tok_val))
         elif tok_type == 'LPAREN':
             self.match('LPAREN')
             node = self.expr()
@@ -0,0 +1,144 @@
+import time
+
+# Each level is (prologue, fixed-point loop, max iterations); the prologue
+# runs once, the loop repeats until the IR stops changing.
+LEVELS = {
+    0: ([], [], 0),
+    1: ([], ['constant_folding', 'dead_code_elimination'], 1),
+    2: (['constant_folding', 'value_numbering'],
+        ['constant_folding', 'copy_propagation', 'dead_code_elimination'], 10),
+    3: (['constant_folding', 'value_numbering'],
+        ['constant_folding', 'value_numbering', 'copy_propagation', 'dead_code_elimination'], 50),
+}
+DEFAULT_LEVEL = 2
+
+# Inliner thresholds per level, in IR instructions: (small callee, callee at
+# a call site inside a loop, total growth allowed per caller).
+INLINE_LIMITS = {
+    2: (8, 24, 256),
+    3: (16, 64, 1024),
+}
+
+# Loop unrolling per level: (AST nodes the unrolled copies may add, partial
+# unroll factor). A counted loop whose whole trip fits the budget is unrolled
+# fully, otherwise its body is repeated factor times.
+UNROLL_LIMITS = {
+    2: (64, 4),
+    3: (256, 8),
+}
+
+# Closed-form loop replacement per level: the highest polynomial degree a
+# replaced loop's final values may have.
+CLOSED_FORM_DEGREES = {
+    2: 4,
+    3: 6,
+}
+
+
+class Pass:
+    def __init__(self, name, run, requires=()):
+        self.name = name
+        self.run = run
+        # Passes that must have run earlier in the pipeline
+        self.requires = list(requires)
+
+
+class PassStats:
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.seconds = 0.0
+        self.before = 0
+        self.after = 0
+
+    @property
+    def delta(self):
+        return self.after - self.before
+
+
+class PassManager:
+    def __init__(self, budget=None):
+        # Compile-time budget in seconds for the whole pipeline; once spent,
+        # no further pass is started.
+        self.budget = budget
+        self.passes = {}
+        self.reset()
+
+    def reset(self):
+        # Statistics and the budget clock cover every run() until the next reset.
+        self.stats = {}
+        self.iterations = 0
+        self.converged = True
+        self.out_of_budget = False
+        self._start = time.perf_counter()
+
+    def register(self, name, run, requires=()):
+        for required in requires:
+            if required not in self.passes:
+                raise ValueError(f"Pass '{name}' requires unknown pass '{required}'")
+        self.passes[name] = Pass(name, run, requires)
+
+    def schedule(self, names, done=()):
+        # Prerequisites that have not run yet are inserted in front of the
+        # pass that needs them.
+        done = set(done)
+        order = []
+        for name in names:
+            self._schedule(name, done, order, set())
+        return order
+
+    def _schedule(self, name, done, order, visiting):
+        if name not in self.passes:
+            raise ValueError(f"Unknown pass '{name}'")
+        if name in visiting:
+            raise ValueError(f"Circular prerequisites for pass '{name}'")
+        visiting.add(name)
+        for required in self.passes[name].requires:
+            if required not in done:
+                self._schedule(required, done, order, visiting)
+        visiting.discard(name)
+        order.append(name)
+        done.add(name)
+
+    def run(self, ir_code, prologue, loop=(), max_iterations=1):
+        prologue = self.schedule(prologue)
+        loop = self.schedule(loop, done=prologue)
+        ir_code = self._run_sequence(ir_code, prologue)
+        converged = not loop
+        iterations = 0
+        for _ in range(max_iterations):
+            if self.out_of_budget:
+                break
+            previous = ir_code
+            ir_code = self._run_sequence(ir_code, loop)
+            iterations += 1
+            if ir_code == previous:
+                converged = True
+                break
+        # Across several runs, report the slowest to settle.
+        self.iterations = max(self.iterations, iterations)
+        self.converged = self.converged and converged
+        return ir_code
+
+    def _run_sequence(self, ir_code, names):
+        for name in names:
+            if self.budget is not None and time.perf_counter() - self._start > self.budget:
+                self.out_of_budget = True
+                break
+            stats = self.stats.setdefault(name, PassStats(name))
+            before = len(ir_code)
+            start = time.perf_counter()
+            ir_code = self.passes[name].run(ir_code)
+            stats.seconds += time.perf_counter() - start
+            stats.runs += 1
+            stats.before += before
+            stats.after += len(ir_code)
+        return ir_code
+
+    def report(self):
+        lines = [f"{'Pass':<24} {'Runs':>5} {'Time (ms)':>10} {'Instructions':>14}"]
+        for stats in self.stats.values():
+            lines.append(f"{stats.name:<24} {stats.runs:>5} {stats.seconds * 1000:>10.2f} {stats.delta:>+14}")
+        state = "converged" if self.converged else "budget exhausted" if self.out_of_budget else "iteration limit reached"
+        lines.append(f"{self.iterations} iteration(s), {state}")
+        return lines
@@ -0,0 +1,172 @@
+from line_table import marker_line
+
+JUMPS = {'jmp', 'je', 'jne', 'jl', 'jle', 'jg', 'jge', 'jae'}
+FOLDABLE = {'add': lambda a, b: a + b, 'sub': lambda a, b: a - b, 'imul': lambda a, b: a * b}
+ENTRY_LABELS = {'main'}
+
+
+def parse_line(line):
+    code = line.split('#', 1)[0].strip()
+    if not code:
+        return None, []
+    if code.endswith(':'):
+        return 'label', [code[:-1]]
+    if code.startswith('.'):
+        return 'directive', [code]
+    parts = code.split(None, 1)
+    operands = [op.strip() for op in parts[1].split(',', 1)] if len(parts) > 1 else []
+    return parts[0], operands
+
+
+def is_immediate(operand):
+    return operand.lstrip('-').isdigit()
+
+
+class PeepholeOptimizer:
+    def __init__(self, max_passes=50):
+        self.max_passes = max_passes
+        self.hits = {}
+        self.rules = []
+        self.register('self_move', self._self_move)
+        self.register('redundant_load', self._redundant_load)
+        self.register('reload_after_store', self._reload_after_store)
+        self.register('fold_immediate', self._fold_immediate)
+        self.register('jump_to_next', self._jump_to_next)
+        self.register('thread_jump', self._thread_jump)
+        self.register('unreachable', self._unreachable)
+        self.register('dead_label', self._dead_label)
+
+    def register(self, name, rule):
+        # A rule receives the line list and a position and returns either None
+        # or (end, replacement) to substitute lines[pos:end].
+        self.rules.append((name, rule))
+        self.hits.setdefault(name, 0)
+
+    def optimize(self, lines):
+        lines = list(lines)
+        self.hits = {name: 0 for name, _ in self.rules}
+        for _ in range(self.max_passes):
+            self._index(lines)
+            changed = False
+            i = 0
+            while i < len(lines):
+                for name, rule in self.rules:
+                    result = rule(lines, i)
+                    if result is not None:
+                        end, replacement = result
+                        lines[i:end] = replacement
+                        self.hits[name] += 1
+                        changed = True
+                        break
+                else:
+                    i += 1
+            if not changed:
+                break
+        return lines
+
+    def _index(self, lines):
+        self.label_next = {}
+        self.referenced = set()
+        for i, line in enumerate(lines):
+            kind, operands = parse_line(line)
+            if kind == 'label':
+                j = self._next(lines, i)
+                while j is not None and parse_line(lines[j])[0] == 'label':
+                    j = self._next(lines, j)
+                self.label_next[operands[0]] = parse_line(lines[j]) if j is not None else (None, [])
+            elif (kind in JUMPS or kind == 'call') and operands:
+                self.referenced.add(operands[0])
+
+    def _next(self, lines, i):
+        for j in range(i + 1, len(lines)):
+            if parse_line(lines[j])[0] is not None:
+                return j
+        return None
+
+    def _self_move(self, lines, i):
+        kind, operands = parse_line(lines[i])
+        if kind == 'mov' and len(operands) == 2 and operands[0] == operands[1]:
+            return i + 1, []
+        return None
+
+    def _redundant_load(self, lines, i):
+        kind, operands = parse_line(lines[i])
+        j = self._next(lines, i)
+        if kind != 'mov' or j is None or len(operands) != 2:
+            return None
+        next_kind, next_operands = parse_line(lines[j])
+        if next_kind == 'mov' and len(next_operands) == 2 and next_operands[0] == operands[0]:
+            if operands[0] not in next_operands[1].split():
+                return i + 1, []
+        return None
+
+    def _reload_after_store(self, lines, i):
+        kind, operands = parse_line(lines[i])
+        j = self._next(lines, i)
+        if kind != 'mov' or j is None or len(operands) != 2:
+            return None
+        next_kind, next_operands = parse_line(lines[j])
+        if next_kind == 'mov' and next_operands == [operands[1], operands[0]]:
+            return j + 1, lines[i:j]
+        return None
+
+    def _fold_immediate(self, lines, i):
+        kind, operands = parse_line(lines[i])
+        j = self._next(lines, i)
+        if kind != 'mov' or j is None or len(operands) != 2 or not is_immediate(operands[1]):
+            return None
+        next_kind, next_operands = parse_line(lines[j])
+        if (next_kind in FOLDABLE and len(next_operands) == 2
+                and next_operands[0] == operands[0] and is_immediate(next_operands[1])):
+            value = FOLDABLE[next_kind](int(operands[1]), int(next_operands[1]))
+            return j + 1, lines[i + 1:j] + [f"    mov {operands[0]}, {value}"]
+        return None
+
+    def _jump_to_next(self, lines, i):
+        kind, operands = parse_line(lines[i])
+        if kind not in JUMPS or not operands:
+            return None
+        j = self._next(lines, i)
+        while j is not None and parse_line(lines[j])[0] == 'label':
+            if parse_line(lines[j])[1][0] == operands[0]:
+                return i + 1, []
+            j = self._next(lines, j)
+        return None
+
+    def _thread_jump(self, lines, i):
+        kind, operands = parse_line(lines[i])
+        if kind not in JUMPS or not operands:
+            return None
+        target = operands[0]
+        seen = {target}
+        while self.label_next.get(target, (None,))[0] == 'jmp':
+            target = self.label_next[target][1][0]
+            if target in seen:
+                return None
+            seen.add(target)
+        if target == operands[0]:
+            return None
+        return i + 1, [f"    {kind} {target}"]
+
+    def _unreachable(self, lines, i):
+        kind, _ = parse_line(lines[i])
+        if kind not in ('jmp', 'ret'):
+            return None
+        # Line markers stay: they belong to whatever code follows.
+        end = i + 1
+        kept = [lines[i]]
+        while end < len(lines) and parse_line(lines[end])[0] not in ('label', 'directive'):
+            if not lines[end].strip():
+                break
+            if marker_line(lines[end]) is not None:
+                kept.append(lines[end])
+            end += 1
+        if end - i == len(kept):
+            return None
+        return end, kept
+
+    def _dead_label(self, lines, i):
+        kind, operands = parse_line(lines[i])
+        if kind == 'label' and operands[0] not in ENTRY_LABELS and operands[0] not in self.referenced:
+            return i + 1, []
+        return None
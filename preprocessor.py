@@ -0,0 +1,183 @@
+import os
+import re
+
+from errors import PreprocessorError
+
+DIRECTIVE_RE = re.compile(r'\s*#\s*(\w+)\s*(.*?)\s*$')
+INCLUDE_RE = re.compile(r'"([^"]+)"|<([^>]+)>')
+DEFINE_RE = re.compile(r'([A-Za-z_]\w*)(\()?\s*(.*)$')
+COMMENT_RE = re.compile(r'"[^"\n]*"|//[^\n]*|/\*.*?\*/', re.S)
+WORD_RE = re.compile(r'"[^"\n]*"|[A-Za-z_]\w*')
+
+
+def strip_comments(code):
+    # Block comments keep their newlines so line numbers do not move.
+    def replace(match):
+        text = match.group()
+        if text.startswith('"'):
+            return text
+        return ' ' + '\n' * text.count('\n')
+    return COMMENT_RE.sub(replace, code)
+
+
+class ParsedSource:
+    def __init__(self, path, code):
+        self.path = path
+        # One entry per source line: ('text', line) or (directive, argument)
+        self.lines = []
+        for line in strip_comments(code).split('\n'):
+            match = DIRECTIVE_RE.match(line)
+            self.lines.append((match.group(1), match.group(2)) if match else ('text', line))
+        self.guard = self._find_guard()
+        self.pragma_once = ('pragma', 'once') in self.lines
+
+    def _find_guard(self):
+        # "#ifndef X / #define X ... #endif" around the whole file
+        code = [(kind, arg) for kind, arg in self.lines if kind != 'text' or arg.strip()]
+        if len(code) < 3 or code[0][0] != 'ifndef' or code[-1][0] != 'endif':
+            return None
+        name = code[0][1]
+        if code[1][0] != 'define' or code[1][1].split()[:1] != [name]:
+            return None
+        depth = 0
+        for kind, _ in code[:-1]:
+            if kind in ('if', 'ifdef', 'ifndef'):
+                depth += 1
+            elif kind == 'endif':
+                depth -= 1
+                if depth == 0:
+                    return None
+        return name
+
+
+class HeaderCache:
+    # Parsed headers keyed by path and invalidated when the file changes, so a
+    # header shared by many sources is read and split only once per process.
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        with open(path) as source:
+            parsed = ParsedSource(path, source.read())
+        self.entries[path] = (key, parsed)
+        return parsed
+
+    def clear(self):
+        self.entries.clear()
+
+
+HEADER_CACHE = HeaderCache()
+
+
+class Preprocessor:
+    def __init__(self, search_paths=None, defines=None, cache=None, max_depth=64):
+        self.search_paths = list(search_paths or [])
+        self.macros = dict(defines or {})
+        self.cache = HEADER_CACHE if cache is None else cache
+        self.max_depth = max_depth
+        # System headers that were not found on the search path; the semantic
+        # analyzer uses them to gate library calls such as printf.
+        self.includes = set()
+        self.headers = []
+        self._once = set()
+
+    def process(self, code, filename=None):
+        base = os.path.dirname(os.path.abspath(filename)) if filename else os.getcwd()
+        return '\n'.join(self._expand(ParsedSource(filename, code), base, 0))
+
+    def _expand(self, source, base, depth):
+        output = []
+        # Each entry is (active, branch_taken) for an open conditional
+        conditions = []
+        for number, (kind, arg) in enumerate(source.lines, 1):
+            active = all(state for state, _ in conditions)
+            location = f"{os.path.basename(source.path)} line {number}" if source.path else f"Line {number}"
+            if kind == 'text':
+                output.append(self._expand_macros(arg) if active else '')
+                continue
+            output.append('')
+            if kind in ('ifdef', 'ifndef'):
+                taken = (arg in self.macros) == (kind == 'ifdef')
+                conditions.append((taken, taken))
+            elif kind == 'else':
+                if not conditions:
+                    raise PreprocessorError(f"{location}: #else without #if")
+                _, taken = conditions[-1]
+                conditions[-1] = (not taken, True)
+            elif kind == 'endif':
+                if not conditions:
+                    raise PreprocessorError(f"{location}: #endif without #if")
+                conditions.pop()
+            elif not active:
+                continue
+            elif kind == 'define':
+                match = DEFINE_RE.match(arg)
+                if not match:
+                    raise PreprocessorError(f"{location}: Invalid #define")
+                if match.group(2):
+                    raise PreprocessorError(f"{location}: Function-like macros are not supported")
+                self.macros[match.group(1)] = match.group(3)
+            elif kind == 'undef':
+                self.macros.pop(arg, None)
+            elif kind == 'include':
+                output[-1] = self._include(arg, base, depth, location)
+            elif kind == 'pragma':
+                continue
+            else:
+                raise PreprocessorError(f"{location}: Unsupported directive #{kind}")
+        if conditions:
+            raise PreprocessorError(f"{source.path or 'Source'}: Unterminated conditional directive")
+        return output
+
+    def _include(self, arg, base, depth, location):
+        match = INCLUDE_RE.fullmatch(arg)
+        if not match:
+            raise PreprocessorError(f"{location}: Invalid #include {arg}")
+        quoted, system = match.groups()
+        path = self._resolve(quoted or system, base if quoted else None)
+        if path is None:
+            if quoted:
+                raise PreprocessorError(f"{location}: Cannot find include file \"{quoted}\"")
+            self.includes.add(system.strip())
+            return ''
+        if depth >= self.max_depth:
+            raise PreprocessorError(f"{location}: #include nested too deeply")
+        header = self.cache.get(path)
+        if path in self._once or (header.guard and header.guard in self.macros):
+            return ''
+        if header.pragma_once:
+            self._once.add(path)
+        self.headers.append(path)
+        # The header is spliced onto the #include line, so line numbers in
+        # the including file stay as written.
+        lines = self._expand(header, os.path.dirname(path), depth + 1)
+        return ' '.join(line for line in lines if line.strip())
+
+    def _resolve(self, name, base):
+        directories = ([base] if base else []) + self.search_paths
+        for directory in directories:
+            path = os.path.abspath(os.path.join(directory, name))
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _expand_macros(self, line, hidden=frozenset()):
+        if not self.macros:
+            return line
+
+        def replace(match):
+            word = match.group()
+            if word in self.macros and word not in hidden:
+                # A macro is not re-expanded inside its own replacement.
+                return self._expand_macros(self.macros[word], hidden | {word})
+            return word
+        return WORD_RE.sub(replace, line)
@@ -0,0 +1,51 @@
+import re
+
+CONVERSION_RE = re.compile(r'%([-+ 0#]*)(\d+)?(?:\.(\d+))?([diuxXocfFeEgGs%])')
+ESCAPE_RE = re.compile(r'\\(.)')
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0', '\\': '\\', '"': '"', "'": "'"}
+CONVERTERS = {
+    'd': int, 'i': int, 'u': int, 'x': int, 'X': int, 'o': int, 'c': int,
+    'f': float, 'F': float, 'e': float, 'E': float, 'g': float, 'G': float,
+    's': str,
+}
+
+
+def unescape(text):
+    return ESCAPE_RE.sub(lambda m: ESCAPES.get(m.group(1), m.group(0)), text)
+
+
+class PrintfFormat:
+    def __init__(self, format_str):
+        self.format_str = format_str
+        text = format_str[1:-1] if format_str.startswith('"') else format_str
+        text = unescape(text)
+
+        # The whole format becomes one Python %-template plus one converter
+        # per argument, so each call is a single C-level formatting step.
+        template = []
+        self.converters = []
+        pos = 0
+        for match in CONVERSION_RE.finditer(text):
+            template.append(text[pos:match.start()].replace('%', '%%'))
+            flags, width, precision, conversion = match.groups()
+            if conversion == '%':
+                template.append('%%')
+            else:
+                spec = '%' + flags + (width or '')
+                if precision is not None:
+                    spec += '.' + precision
+                template.append(spec + ('d' if conversion in 'iu' else conversion))
+                self.converters.append(CONVERTERS[conversion])
+            pos = match.end()
+        template.append(text[pos:].replace('%', '%%'))
+        self.template = ''.join(template)
+        self.literal = None if self.converters else self.template % ()
+
+    @property
+    def arg_count(self):
+        return len(self.converters)
+
+    def format(self, args):
+        if self.literal is not None:
+            return self.literal
+        return self.template % tuple(convert(arg) for convert, arg in zip(self.converters, args))
@@ -0,0 +1,77 @@
+from errors import RuntimeError
+from ir_executor import IRExecutor
+from output_sink import BufferSink
+
+DEFAULT_STEPS = 1000000
+DEFAULT_MEMORY = 16 * 1024 * 1024
+# Longest run of output lines written by one printf of the replacement program
+CHUNK_SIZE = 4096
+QUOTE_CODE = ord('"')
+# Characters a printf format cannot hold as they are
+FORMAT_ESCAPES = {'\\': '\\\\', '%': '%%', '\n': '\\n', '\t': '\\t', '\r': '\\r', '\0': '\\0'}
+
+
+def output_chunks(output):
+    chunk = ''
+    for line in output.splitlines(keepends=True):
+        if chunk and len(chunk) + len(line) > CHUNK_SIZE:
+            yield chunk
+            chunk = ''
+        chunk += line
+    if chunk:
+        yield chunk
+
+
+def output_ir(output, exit_code):
+    # A main that writes output and returns exit_code. Formats never contain
+    # a quote, so quotes are printed as characters.
+    ir = []
+    for chunk in output_chunks(output):
+        for i, piece in enumerate(chunk.split('"')):
+            if i:
+                ir.append(f"printf \"%c\", ['{QUOTE_CODE}']")
+            if piece:
+                text = ''.join(FORMAT_ESCAPES.get(char, char) for char in piece)
+                ir.append(f'printf "{text}", []')
+    ir.append(f"return {exit_code}")
+    return ir
+
+
+class Evaluation:
+    def __init__(self, ir, steps, output_bytes, exit_code=None, error=None):
+        # Replacement IR, or None when the program has to be compiled normally
+        self.ir = ir
+        self.steps = steps
+        self.output_bytes = output_bytes
+        self.exit_code = exit_code
+        self.error = error
+
+    @property
+    def completed(self):
+        return self.ir is not None
+
+    def report(self):
+        if self.completed:
+            return [f"evaluated at compile time: {self.steps} steps, {self.output_bytes} bytes of output, "
+                    f"exit code {self.exit_code}"]
+        return [f"compile-time evaluation stopped after {self.steps} steps and {self.output_bytes} bytes "
+                f"of output ({self.error}); compiled normally"]
+
+
+class ProgramEvaluator:
+    # Programs read no input, so one that finishes has the same output on
+    # every run. The evaluator runs the optimized IR within a step and
+    # memory budget; a run that completes turns the program into its output.
+    def __init__(self, max_steps=DEFAULT_STEPS, max_memory=DEFAULT_MEMORY):
+        self.max_steps = max_steps
+        self.max_memory = max_memory
+
+    def evaluate(self, ir):
+        executor = IRExecutor(BufferSink(self.max_memory), self.max_steps, self.max_memory)
+        try:
+            output = executor.run(ir)
+        except RuntimeError as e:
+            # Errors, like running over budget, are left for run time.
+            return Evaluation(None, executor.steps, executor.sink.written, error=str(e))
+        return Evaluation(output_ir(output, executor.exit_code), executor.steps, executor.sink.written,
+                          executor.exit_code)
@@ -0,0 +1,212 @@
+from ast_nodes import BinaryOp, Call, Cast, Identifier, Index, Number
+from symbol_table import var_key
+from typed_ops import COMPARISON_OPS, result_type
+
+
+def is_power_of_two(value):
+    return isinstance(value, int) and value > 1 and value & (value - 1) == 0
+
+
+def log2(value):
+    return value.bit_length() - 1
+
+
+def guard_int(engine, b):
+    return engine.expr_type(b['x']) == 'int'
+
+
+def guard_pure_int(engine, b):
+    # Rules whose result drops x must not drop a call, or an element access
+    # that may fail its bounds check, along with it.
+    return guard_int(engine, b) and is_pure(b['x'])
+
+
+def guard_nonnegative_int(engine, b):
+    return guard_int(engine, b) and engine.is_nonnegative(b['x'])
+
+
+def guard_int_pow2(engine, b):
+    return guard_int(engine, b) and is_power_of_two(b['c'])
+
+
+def guard_nonnegative_pow2(engine, b):
+    return guard_nonnegative_int(engine, b) and is_power_of_two(b['c'])
+
+
+def guard_negative_constant(engine, b):
+    return b['c'] < 0
+
+
+def guard_int_constant(engine, b):
+    return guard_int(engine, b) and isinstance(b['c'], int) and isinstance(b['d'], int)
+
+
+# Patterns are (op, left, right) tuples. Leaves are 'x' (any expression),
+# 'c'/'d' (a numeric literal) or a literal int that must match exactly.
+# Results use the same leaves, plus callables computing a new constant.
+RULES = [
+    # name               pattern                          guard                    result
+    ('add_zero',         ('+', 'x', 0),                   None,                    'x'),
+    ('zero_add',         ('+', 0, 'x'),                   None,                    'x'),
+    ('sub_zero',         ('-', 'x', 0),                   None,                    'x'),
+    ('mul_one',          ('*', 'x', 1),                   None,                    'x'),
+    ('one_mul',          ('*', 1, 'x'),                   None,                    'x'),
+    ('div_one',          ('/', 'x', 1),                   None,                    'x'),
+    ('mul_zero',         ('*', 'x', 0),                   guard_pure_int,          0),
+    ('zero_mul',         ('*', 0, 'x'),                   guard_pure_int,          0),
+    ('mod_one',          ('%', 'x', 1),                   guard_pure_int,          0),
+    ('sub_self',         ('-', 'x', 'x'),                 guard_int,               0),
+    ('eq_self',          ('==', 'x', 'x'),                guard_int,               1),
+    ('ne_self',          ('!=', 'x', 'x'),                guard_int,               0),
+    ('const_add_left',   ('+', 'c', 'x'),                 None,                    ('+', 'x', 'c')),
+    ('const_mul_left',   ('*', 'c', 'x'),                 None,                    ('*', 'x', 'c')),
+    ('reassoc_add',      ('+', ('+', 'x', 'c'), 'd'),     guard_int_constant,      ('+', 'x', lambda b: b['c'] + b['d'])),
+    ('reassoc_sub_add',  ('+', ('-', 'x', 'c'), 'd'),     guard_int_constant,      ('+', 'x', lambda b: b['d'] - b['c'])),
+    ('reassoc_add_sub',  ('-', ('+', 'x', 'c'), 'd'),     guard_int_constant,      ('+', 'x', lambda b: b['c'] - b['d'])),
+    ('reassoc_sub',      ('-', ('-', 'x', 'c'), 'd'),     guard_int_constant,      ('-', 'x', lambda b: b['c'] + b['d'])),
+    ('reassoc_mul',      ('*', ('*', 'x', 'c'), 'd'),     guard_int_constant,      ('*', 'x', lambda b: b['c'] * b['d'])),
+    ('add_negative',     ('+', 'x', 'c'),                 guard_negative_constant, ('-', 'x', lambda b: -b['c'])),
+    ('mul_pow2',         ('*', 'x', 'c'),                 guard_int_pow2,          ('<<', 'x', lambda b: log2(b['c']))),
+    ('div_pow2',         ('/', 'x', 'c'),                 guard_nonnegative_pow2,  ('>>', 'x', lambda b: log2(b['c']))),
+    ('mod_pow2',         ('%', 'x', 'c'),                 guard_nonnegative_pow2,  ('&', 'x', lambda b: b['c'] - 1)),
+]
+
+
+class RewriteEngine:
+    def __init__(self, symbols=None, rules=None, max_rewrites=32):
+        self.symbols = symbols or {}
+        self.rules = RULES if rules is None else rules
+        self.max_rewrites = max_rewrites
+        self.nonnegative = set()
+        self.hits = {}
+
+    def simplify(self, node):
+        for _ in range(self.max_rewrites):
+            if not isinstance(node, BinaryOp):
+                return node
+            for name, pattern, guard, result in self.rules:
+                bindings = {}
+                if not self._match(pattern, node, bindings):
+                    continue
+                if guard is not None and not guard(self, bindings):
+                    continue
+                node = self._build(result, bindings)
+                self.hits[name] = self.hits.get(name, 0) + 1
+                break
+            else:
+                return node
+        return node
+
+    def _match(self, pattern, node, bindings):
+        if isinstance(pattern, tuple):
+            op, left, right = pattern
+            return (isinstance(node, BinaryOp) and node.op == op
+                    and self._match(left, node.left, bindings)
+                    and self._match(right, node.right, bindings))
+        if isinstance(pattern, int):
+            # Literal patterns only match int literals so that a float operand
+            # never changes the type of the result.
+            return isinstance(node, Number) and type(node.value) is int and node.value == pattern
+        if pattern in ('c', 'd'):
+            if not isinstance(node, Number):
+                return False
+            return self._bind(bindings, pattern, node.value)
+        return self._bind(bindings, pattern, node)
+
+    def _bind(self, bindings, name, value):
+        if name in bindings:
+            bound = bindings[name]
+            if isinstance(bound, (int, float)):
+                return type(bound) is type(value) and bound == value
+            return same_expr(bound, value)
+        bindings[name] = value
+        return True
+
+    def _build(self, template, bindings):
+        if isinstance(template, tuple):
+            op, left, right = template
+            left, right = self._build(left, bindings), self._build(right, bindings)
+            types = (self.expr_type(left), self.expr_type(right))
+            optype = types[0] if types[0] == types[1] else None
+            ctype = result_type(op, *types) if optype else None
+            return BinaryOp(left, op, right, ctype, optype)
+        if callable(template):
+            return Number(template(bindings))
+        if isinstance(template, int):
+            return Number(template)
+        value = bindings[template]
+        return Number(value) if isinstance(value, (int, float)) else value
+
+    def expr_type(self, node):
+        if getattr(node, 'ctype', None):
+            return node.ctype
+        if isinstance(node, Identifier):
+            return self.symbols.get(node.name)
+        if isinstance(node, BinaryOp):
+            if node.op in COMPARISON_OPS:
+                return 'int'
+            left, right = self.expr_type(node.left), self.expr_type(node.right)
+            if 'float' in (left, right):
+                return 'float'
+            if left == right == 'int':
+                return 'int'
+        return None
+
+    def is_nonnegative(self, node, names=None):
+        names = self.nonnegative if names is None else names
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Number):
+                if node.value < 0:
+                    return False
+            elif isinstance(node, Identifier):
+                if var_key(node) not in names:
+                    return False
+            elif isinstance(node, BinaryOp) and node.op in COMPARISON_OPS:
+                continue
+            elif isinstance(node, BinaryOp) and node.op in ('+', '*', '/', '%', '<<', '>>', '&'):
+                stack.append(node.left)
+                stack.append(node.right)
+            else:
+                return False
+        return True
+
+    def compute_nonnegative(self, assignments):
+        # Flow-insensitive: an int variable is non-negative when every value
+        # ever stored into it is, assuming the same of the other candidates.
+        names = {key for key, exprs in assignments.items()
+                 if None not in exprs and all(self.expr_type(expr) == 'int' for expr in exprs)}
+        changed = True
+        while changed:
+            changed = False
+            for name in list(names):
+                if not all(self.is_nonnegative(expr, names) for expr in assignments[name]):
+                    names.discard(name)
+                    changed = True
+        self.nonnegative = names
+        return names
+
+
+def same_expr(a, b):
+    if isinstance(a, Number) and isinstance(b, Number):
+        return type(a.value) is type(b.value) and a.value == b.value
+    if isinstance(a, Identifier) and isinstance(b, Identifier):
+        return a.name == b.name
+    if isinstance(a, BinaryOp) and isinstance(b, BinaryOp):
+        return a.op == b.op and same_expr(a.left, b.left) and same_expr(a.right, b.right)
+    return False
+
+
+def is_pure(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (Call, Index)):
+            return False
+        if isinstance(node, BinaryOp):
+            stack.append(node.left)
+            stack.append(node.right)
+        elif isinstance(node, Cast):
+            stack.append(node.expr)
+    return True
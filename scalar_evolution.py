@@ -0,0 +1,331 @@
+import copy
+from math import factorial
+
+from ast_nodes import Assignment, BinaryOp, Block, Declaration, Identifier, IfStatement, Number
+from symbol_table import var_key
+
+# Bound on the loop variable of "v < b", "v <= b", "v > b" or "v >= b",
+# mirrored when the variable is on the right
+MIRRORED = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+# Most terms a value may have. Products of values that are not yet solved
+# multiply their terms on every pass over the body.
+MAX_TERMS = 256
+
+
+class NotClosed(Exception):
+    pass
+
+
+class Polynomial:
+    # Integer polynomial in the values variables hold when the loop is
+    # entered; terms maps a sorted tuple of variable keys to a coefficient.
+    def __init__(self, terms=None):
+        self.terms = {monomial: c for monomial, c in (terms or {}).items() if c}
+
+    @classmethod
+    def constant(cls, value):
+        return cls({(): value})
+
+    @classmethod
+    def variable(cls, key):
+        return cls({(key,): 1})
+
+    def __add__(self, other):
+        terms = dict(self.terms)
+        for monomial, c in other.terms.items():
+            terms[monomial] = terms.get(monomial, 0) + c
+        return Polynomial(terms)
+
+    def __sub__(self, other):
+        return self + other.scale(-1)
+
+    def __mul__(self, other):
+        terms = {}
+        for left, a in self.terms.items():
+            for right, b in other.terms.items():
+                monomial = tuple(sorted(left + right, key=repr))
+                terms[monomial] = terms.get(monomial, 0) + a * b
+        return Polynomial(terms)
+
+    def scale(self, factor):
+        return Polynomial({monomial: c * factor for monomial, c in self.terms.items()})
+
+    def keys(self):
+        return {key for monomial in self.terms for key in monomial}
+
+    def constant_value(self):
+        # The value when no variable occurs, else None
+        if all(not monomial for monomial in self.terms):
+            return self.terms.get((), 0)
+        return None
+
+
+class Recurrence:
+    # A variable's value in iteration k as sum(coefficients[j] * C(k, j)).
+    # The binomial basis keeps every coefficient an integer and makes
+    # summing over iterations a shift.
+    def __init__(self, coefficients):
+        self.coefficients = list(coefficients)
+        while self.coefficients and not self.coefficients[-1].terms:
+            self.coefficients.pop()
+
+    @classmethod
+    def invariant(cls, polynomial):
+        return cls([polynomial])
+
+    @property
+    def degree(self):
+        return len(self.coefficients) - 1
+
+    def coefficient(self, j):
+        return self.coefficients[j] if j < len(self.coefficients) else Polynomial()
+
+    def __add__(self, other):
+        size = max(len(self.coefficients), len(other.coefficients))
+        return Recurrence([self.coefficient(j) + other.coefficient(j) for j in range(size)])
+
+    def __sub__(self, other):
+        size = max(len(self.coefficients), len(other.coefficients))
+        return Recurrence([self.coefficient(j) - other.coefficient(j) for j in range(size)])
+
+    def __mul__(self, other):
+        # C(k, a) * C(k, b) = sum over j of (a+b-j)! / (j! (a-j)! (b-j)!) * C(k, a+b-j)
+        product = [Polynomial() for _ in range(len(self.coefficients) + len(other.coefficients))]
+        for a, left in enumerate(self.coefficients):
+            for b, right in enumerate(other.coefficients):
+                term = left * right
+                for j in range(min(a, b) + 1):
+                    weight = factorial(a + b - j) // (factorial(j) * factorial(a - j) * factorial(b - j))
+                    product[a + b - j] = product[a + b - j] + term.scale(weight)
+        return Recurrence(product)
+
+    def summed(self):
+        # sum over m < k of this recurrence at m
+        return Recurrence([Polynomial()] + self.coefficients)
+
+    def keys(self):
+        return {key for coefficient in self.coefficients for key in coefficient.keys()}
+
+
+class ClosedForm:
+    def __init__(self, name, degree=None, statement=None, reason=None):
+        # The loop variable, and either the replacement statement or why
+        # there is none
+        self.name = name
+        self.degree = degree
+        self.statement = statement
+        self.reason = reason
+
+
+class ScalarEvolution:
+    # Recognises loops whose body only assigns int variables polynomial
+    # functions of each other, with an affine loop variable bounded by a
+    # loop-invariant value, and builds the statement that assigns every
+    # variable its value after the last iteration.
+    def __init__(self, max_degree):
+        self.max_degree = max_degree
+
+    def closed_form(self, condition, statements):
+        # None when the loop is not a counted loop at all
+        counter = self._counter(condition, statements)
+        if counter is None:
+            return None
+        try:
+            degree, statement = self._solve(condition, *counter, statements)
+        except NotClosed as e:
+            return ClosedForm(counter[0].name, reason=str(e))
+        return ClosedForm(counter[0].name, degree, statement)
+
+    def _solve(self, condition, var, op, bound, statements):
+        self.identifiers = {}
+        body = self._flatten(statements)
+        declared = {var_key(stmt) for stmt in body if isinstance(stmt, Declaration)}
+        # Assigned variables in body order, so the output is deterministic
+        order = list(dict.fromkeys(var_key(stmt) for stmt in body
+                                   if isinstance(stmt, Assignment) and var_key(stmt) not in declared))
+        carried = set(order)
+        key = var_key(var)
+        if key not in carried:
+            raise NotClosed(f"{var.name} does not change")
+
+        # Each pass runs the body once with the values of solved variables
+        # as recurrences and the others as unknown starting values; a
+        # variable whose end value is its start plus something known is
+        # solved by summing that increment over the iterations before k.
+        starts = {}
+        while True:
+            ends = self._run(body, starts, carried)
+            unsolved = self._unknowns(carried - set(starts))
+            solved = False
+            for name in order:
+                if name in starts:
+                    continue
+                increment = ends[name] - self._unknown(name)
+                if not increment.keys() & unsolved:
+                    starts[name] = Recurrence.invariant(Polynomial.variable(name)) + increment.summed()
+                    solved = True
+            if not solved:
+                break
+        ends = self._run(body, starts, carried)
+        if any(ends[name].keys() & self._unknowns(carried) for name in carried):
+            raise NotClosed("a variable is not a polynomial in the iteration count")
+
+        start = starts.get(key)
+        if start is None or start.degree != 1 or start.coefficient(1).constant_value() is None:
+            raise NotClosed(f"{var.name} does not change by a constant")
+        step = start.coefficient(1).constant_value()
+        limit = self._value(bound, {}, carried)
+        if limit.degree > 0 or limit.keys() & self._unknowns(carried):
+            raise NotClosed("the bound changes in the loop")
+        trips = self._trips(op, step, Polynomial.variable(key), limit.coefficient(0))
+        if trips is None:
+            raise NotClosed(f"{var.name} moves away from the bound")
+
+        # Variables assigned but never read before their assignment take
+        # their value from the last iteration.
+        finals = {}
+        for name in order:
+            if name in starts:
+                finals[name] = (starts[name], self._trips_ast(trips))
+            else:
+                last = BinaryOp(self._trips_ast(trips), '-', Number(1), 'int', 'int')
+                finals[name] = (ends[name], last)
+        degree = max(recurrence.degree for recurrence, _ in finals.values())
+        if degree > self.max_degree:
+            raise NotClosed(f"degree {degree} is above {self.max_degree}")
+
+        assignments = []
+        pending = dict(finals)
+        while pending:
+            # Assign a variable only once no other pending value reads its
+            # value from before the loop.
+            ready = [name for name in pending
+                     if not any(name in self._reads(pending[other], trips) for other in pending if other != name)]
+            if not ready:
+                raise NotClosed("the final values depend on each other")
+            name = ready[0]
+            recurrence, at = pending.pop(name)
+            identifier = self.identifiers[name]
+            assignment = Assignment(identifier.name, self._recurrence_ast(recurrence, at))
+            assignment.slot = identifier.slot
+            assignments.append(assignment)
+        return degree, IfStatement(copy.deepcopy(condition), Block(assignments))
+
+    def _counter(self, condition, statements):
+        # The compared variable, preferring one the loop assigns
+        if not (isinstance(condition, BinaryOp) and condition.optype == 'int' and condition.op in MIRRORED):
+            return None
+        candidates = []
+        if isinstance(condition.left, Identifier):
+            candidates.append((condition.left, condition.op, condition.right))
+        if isinstance(condition.right, Identifier):
+            candidates.append((condition.right, MIRRORED[condition.op], condition.left))
+        assigned = self._assigned(statements)
+        candidates.sort(key=lambda candidate: var_key(candidate[0]) not in assigned)
+        return candidates[0] if candidates else None
+
+    def _assigned(self, statements):
+        keys = set()
+        for stmt in statements:
+            if isinstance(stmt, Block):
+                keys |= self._assigned(stmt.statements)
+            elif isinstance(stmt, Assignment):
+                keys.add(var_key(stmt))
+        return keys
+
+    def _flatten(self, statements):
+        body = []
+        for stmt in statements:
+            if isinstance(stmt, Block):
+                body.extend(self._flatten(stmt.statements))
+            elif isinstance(stmt, Assignment) or (isinstance(stmt, Declaration) and stmt.size is None
+                                                  and stmt.init_value is not None):
+                body.append(stmt)
+            elif stmt is not None:
+                raise NotClosed(f"the body has a {type(stmt).__name__}")
+        return body
+
+    def _unknown(self, name):
+        return Recurrence.invariant(Polynomial.variable(('start', name)))
+
+    def _unknowns(self, names):
+        return {('start', name) for name in names}
+
+    def _run(self, body, starts, carried):
+        state = {name: starts.get(name) or self._unknown(name) for name in carried}
+        for stmt in body:
+            expr = stmt.init_value if isinstance(stmt, Declaration) else stmt.expr
+            state[var_key(stmt)] = self._value(expr, state, carried)
+            if var_key(stmt) not in self.identifiers:
+                identifier = self.identifiers[var_key(stmt)] = Identifier(stmt.name, 'int')
+                identifier.slot = stmt.slot
+        return state
+
+    def _value(self, expr, state, carried):
+        if isinstance(expr, Number) and type(expr.value) is int:
+            return Recurrence.invariant(Polynomial.constant(expr.value))
+        if isinstance(expr, Identifier) and expr.ctype == 'int':
+            key = var_key(expr)
+            self.identifiers.setdefault(key, expr)
+            if key in state:
+                return state[key]
+            if key in carried:
+                return self._unknown(key)
+            return Recurrence.invariant(Polynomial.variable(key))
+        if isinstance(expr, BinaryOp) and expr.optype == 'int' and expr.op in ('+', '-', '*'):
+            left = self._value(expr.left, state, carried)
+            right = self._value(expr.right, state, carried)
+            value = left + right if expr.op == '+' else left - right if expr.op == '-' else left * right
+            if sum(len(coefficient.terms) for coefficient in value.coefficients) > MAX_TERMS:
+                raise NotClosed(f"{expr} has more than {MAX_TERMS} terms")
+            return value
+        raise NotClosed(f"{expr} is not a polynomial")
+
+    def _trips(self, op, step, start, limit):
+        # Iterations of "v op limit" from start by step, as (numerator,
+        # divisor): exact floor division once the loop runs at least once.
+        if op in ('<', '<=') and step > 0:
+            return limit - start + Polynomial.constant(step - (op == '<')), step
+        if op in ('>', '>=') and step < 0:
+            return start - limit + Polynomial.constant(-step - (op == '>')), -step
+        return None
+
+    def _trips_ast(self, trips):
+        numerator, divisor = trips
+        return BinaryOp(self._polynomial_ast(numerator), '/', Number(divisor), 'int', 'int')
+
+    def _reads(self, final, trips):
+        # Variables whose value before the loop a final assignment reads
+        recurrence, _ = final
+        return recurrence.keys() | trips[0].keys()
+
+    def _polynomial_ast(self, polynomial):
+        expr = None
+        for monomial, c in sorted(polynomial.terms.items(), key=repr):
+            term = Number(abs(c))
+            for key in monomial:
+                term = BinaryOp(term, '*', copy.deepcopy(self.identifiers[key]), 'int', 'int')
+            if expr is None:
+                expr = term if c > 0 else BinaryOp(Number(0), '-', term, 'int', 'int')
+            else:
+                expr = BinaryOp(expr, '+' if c > 0 else '-', term, 'int', 'int')
+        return expr if expr is not None else Number(0)
+
+    def _recurrence_ast(self, recurrence, at):
+        # sum(c_j * C(at, j)), with C(at, j) = at (at-1) ... (at-j+1) / j!;
+        # the product of j consecutive integers is divisible by j!.
+        expr = None
+        for j, coefficient in enumerate(recurrence.coefficients):
+            if not coefficient.terms:
+                continue
+            term = self._polynomial_ast(coefficient)
+            if j:
+                choose = copy.deepcopy(at)
+                for i in range(1, j):
+                    factor = BinaryOp(copy.deepcopy(at), '-', Number(i), 'int', 'int')
+                    choose = BinaryOp(choose, '*', factor, 'int', 'int')
+                if j > 1:
+                    choose = BinaryOp(choose, '/', Number(factorial(j)), 'int', 'int')
+                term = BinaryOp(term, '*', choose, 'int', 'int')
+            expr = term if expr is None else BinaryOp(expr, '+', term, 'int', 'int')
+        return expr if expr is not None else Number(0)
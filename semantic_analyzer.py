@@ -1,9 +1,18 @@
 from ast_nodes import *
 from errors import SemanticError
+from printf_format import PrintfFormat
+from symbol_table import SymbolTable
+from typed_ops import INT_ONLY_OPS, result_type
+from visitor import NodeVisitor
 
-class SemanticAnalyzer:
+class SemanticAnalyzer(NodeVisitor):
     def __init__(self, includes=None):
         self.symbols = {}
+        self.table = SymbolTable()
+        # Per-function symbol tables; self.table stays the one for main
+        self.tables = {}
+        self.functions = {}
+        self.return_type = 'int'
         self.includes = includes or set()
         self.has_stdio = 'stdio.h' in self.includes
 
@@ -11,35 +20,86 @@ class SemanticAnalyzer:
         if isinstance(node, Program) and len(node.statements) == 0:
             raise SemanticError("Error: C program cannot be empty.")
         self.visit(node)
+        if isinstance(node, Program):
+            node.frame_size = self.table.frame_size
+            node.slot_names = self.table.slot_names()
         return self.symbols
 
-    def visit(self, node):
-        method = f"visit_{node.__class__.__name__}"
-        if hasattr(self, method):
-            return getattr(self, method)(node)
+    def generic_visit(self, node):
         raise SemanticError(f"Unsupported statement in C: {node.__class__.__name__}")
 
     def visit_Program(self, node):
+        # Signatures are known up front so calls may precede definitions.
+        for function in node.functions:
+            if function.name in self.functions:
+                raise SemanticError(f"Error: Function '{function.name}' already defined.")
+            self.functions[function.name] = function
         for stmt in node.statements:
-            self.visit(stmt)
+            yield stmt
+        for function in node.functions:
+            yield function
+
+    def visit_FunctionDef(self, node):
+        if node.return_type not in {'int', 'float'}:
+            raise SemanticError(f"Error: Invalid return type '{node.return_type}' for function '{node.name}'.")
+        outer = self.table, self.return_type
+        self.table = SymbolTable()
+        self.return_type = node.return_type
+        # Parameters share the outermost scope of the body, as in C.
+        for param in node.params:
+            yield param
+        for stmt in node.body.statements:
+            yield stmt
+        node.frame_size = self.table.frame_size
+        node.slot_names = self.table.slot_names()
+        self.tables[node.name] = self.table
+        self.table, self.return_type = outer
 
     def visit_Block(self, node):
+        self.table.enter_scope()
         for stmt in node.statements:
-            self.visit(stmt)
+            yield stmt
+        self.table.exit_scope()
 
     def visit_Declaration(self, node):
-        if node.name in self.symbols:
-            raise SemanticError(f"Error: Variable '{node.name}' already declared.")
         if node.datatype not in {'int', 'float'}:
             raise SemanticError(f"Error: Invalid C data type '{node.datatype}'. Only 'int' and 'float' are supported.")
-        self.symbols[node.name] = node.datatype
+        # The initializer is resolved before the name comes into scope.
         if node.init_value:
-            self.visit(node.init_value)
+            yield node.init_value
+            node.init_value = self._coerce(node.init_value, node.datatype)
+        symbol = self.table.declare(node.name, node.datatype, node.size)
+        if node.size is None:
+            self.symbols.setdefault(node.name, node.datatype)
+        node.slot = symbol.slot
 
     def visit_Assignment(self, node):
-        if node.name not in self.symbols:
-            raise SemanticError(f"Error: Variable '{node.name}' used before declaration.")
-        self.visit(node.expr)
+        symbol = self._resolve(node.name)
+        if symbol.size is not None:
+            raise SemanticError(f"Error: Cannot assign to array '{node.name}'; assign to an element instead.")
+        node.slot = symbol.slot
+        yield node.expr
+        node.expr = self._coerce(node.expr, symbol.datatype)
+
+    def visit_IndexAssignment(self, node):
+        symbol = yield from self._index(node)
+        yield node.expr
+        node.expr = self._coerce(node.expr, symbol.datatype)
+
+    def visit_Index(self, node):
+        symbol = yield from self._index(node)
+        node.ctype = symbol.datatype
+        return node.ctype
+
+    def _index(self, node):
+        symbol = self._resolve(node.name)
+        if symbol.size is None:
+            raise SemanticError(f"Error: '{node.name}' is not an array.")
+        node.slot = symbol.slot
+        node.size = symbol.size
+        if (yield node.index) != 'int':
+            raise SemanticError(f"Error: Array index for '{node.name}' must be an integer.")
+        return symbol
 
     def visit_PrintStatement(self, node):
         raise SemanticError("Error: 'print' is not valid C syntax. Use 'printf' instead.")
@@ -48,35 +108,95 @@ class SemanticAnalyzer:
         if not self.has_stdio:
             raise SemanticError("Error: 'printf' requires '#include <stdio.h>' at the top of the program.")
         if node.format_str:
-            fmt = node.format_str.strip('"')
+            node.compiled = PrintfFormat(node.format_str)
             arg_count = len(node.args)
-            placeholder_count = fmt.count('%d') + fmt.count('%f') + fmt.count('%s')
+            placeholder_count = node.compiled.arg_count
             if placeholder_count != arg_count:
                 raise SemanticError(f"Error: Format string expects {placeholder_count} placeholders but {arg_count} arguments provided. Check your printf() call.")
         for arg in node.args:
-            self.visit(arg)
+            yield arg
     def visit_ReturnStatement(self, node):
         if node.return_val:
-            self.visit(node.return_val)
+            yield node.return_val
+            node.return_val = self._coerce(node.return_val, self.return_type)
+
+    def visit_ExpressionStatement(self, node):
+        yield node.expr
+
+    def visit_Call(self, node):
+        function = self.functions.get(node.name)
+        if function is None:
+            raise SemanticError(f"Error: Function '{node.name}' is not defined.")
+        if len(node.args) != len(function.params):
+            raise SemanticError(f"Error: Function '{node.name}' expects {len(function.params)} arguments but {len(node.args)} provided.")
+        for i, (arg, param) in enumerate(zip(node.args, function.params)):
+            yield arg
+            node.args[i] = self._coerce(arg, param.datatype)
+        node.ctype = function.return_type
+        return node.ctype
 
     def visit_IfStatement(self, node):
-        self.visit(node.condition)
-        self.visit(node.then_block)
+        yield node.condition
+        yield node.then_block
         if node.else_block:
-            self.visit(node.else_block)
+            yield node.else_block
 
     def visit_WhileStatement(self, node):
-        self.visit(node.condition)
-        self.visit(node.body)
+        yield node.condition
+        yield node.body
+
+    def visit_ForStatement(self, node):
+        # A variable declared in the init clause is scoped to the loop.
+        self.table.enter_scope()
+        if node.init:
+            yield node.init
+        yield node.condition
+        yield node.body
+        if node.step:
+            yield node.step
+        self.table.exit_scope()
 
     def visit_BinaryOp(self, node):
-        self.visit(node.left)
-        self.visit(node.right)
+        left = yield node.left
+        right = yield node.right
+        if node.op in INT_ONLY_OPS and 'float' in (left, right):
+            raise SemanticError(f"Error: Operator '{node.op}' requires integer operands.")
+        node.optype = 'float' if 'float' in (left, right) else 'int'
+        node.left = self._coerce(node.left, node.optype)
+        node.right = self._coerce(node.right, node.optype)
+        node.ctype = result_type(node.op, left, right)
+        return node.ctype
+
+    def visit_Cast(self, node):
+        yield node.expr
+        return node.ctype
 
     def visit_Number(self, node):
-        pass
+        return node.ctype
 
     def visit_Identifier(self, node):
-        if node.name not in self.symbols:
-            raise SemanticError(f"Error: Variable '{node.name}' used before declaration.")
+        symbol = self._resolve(node.name)
+        if symbol.size is not None:
+            raise SemanticError(f"Error: Array '{node.name}' used without an index.")
+        node.slot = symbol.slot
+        node.ctype = symbol.datatype
+        return node.ctype
+
+    def _resolve(self, name):
+        symbol = self.table.lookup(name)
+        if symbol is None:
+            raise SemanticError(f"Error: Variable '{name}' used before declaration.")
+        return symbol
+
+    def _coerce(self, node, ctype):
+        # Implicit conversions become explicit Cast nodes; literals are
+        # converted in place.
+        if node.ctype == ctype:
+            return node
+        if isinstance(node, Number):
+            coerced = Number(float(node.value) if ctype == 'float' else int(node.value))
+        else:
+            coerced = Cast(ctype, node)
+        coerced.line, coerced.end_line = node.line, node.end_line
+        return coerced
 
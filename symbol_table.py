@@ -0,0 +1,63 @@
+from errors import SemanticError
+
+
+class Symbol:
+    def __init__(self, name, datatype, depth, slot, ir_name, size=None):
+        self.name = name
+        self.datatype = datatype
+        # Element count for arrays, None for scalars
+        self.size = size
+        self.depth = depth
+        self.slot = slot
+        # Unique name used in the IR, where shadowed variables must not clash
+        self.ir_name = ir_name
+
+    def __repr__(self):
+        datatype = self.datatype if self.size is None else f"{self.datatype}[{self.size}]"
+        return f"Symbol({self.name}, {datatype}, depth={self.depth}, slot={self.slot})"
+
+
+class SymbolTable:
+    def __init__(self):
+        self.scopes = [{}]
+        self.entries = []
+
+    @property
+    def depth(self):
+        return len(self.scopes) - 1
+
+    @property
+    def frame_size(self):
+        return len(self.entries)
+
+    def enter_scope(self):
+        self.scopes.append({})
+
+    def exit_scope(self):
+        self.scopes.pop()
+
+    def declare(self, name, datatype, size=None):
+        if name in self.scopes[-1]:
+            raise SemanticError(f"Error: Variable '{name}' already declared.")
+        # Every declaration gets its own frame slot, so a shadowing variable
+        # never overwrites the one it hides.
+        slot = len(self.entries)
+        taken = any(entry.name == name for entry in self.entries)
+        symbol = Symbol(name, datatype, self.depth, slot, f"{name}.{slot}" if taken else name, size)
+        self.scopes[-1][name] = symbol
+        self.entries.append(symbol)
+        return symbol
+
+    def lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def slot_names(self):
+        return [entry.ir_name for entry in self.entries]
+
+
+def var_key(node):
+    # Resolved variables are identified by frame slot, unresolved ones by name.
+    return node.slot if node.slot is not None else node.name
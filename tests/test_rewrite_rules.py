@@ -0,0 +1,98 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ast_nodes import BinaryOp, Identifier, Number
+from rewrite_rules import RewriteEngine
+
+
+def var(name, ctype):
+    return Identifier(name, ctype)
+
+
+def binop(left, op, right):
+    ctype = left.ctype if left.ctype == right.ctype else None
+    return BinaryOp(left, op, right, ctype, ctype)
+
+
+class TypeGuardTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = RewriteEngine({'x': 'int', 'f': 'float'})
+
+    def test_int_times_zero_folds(self):
+        result = self.engine.simplify(binop(var('x', 'int'), '*', Number(0)))
+        self.assertIsInstance(result, Number)
+        self.assertEqual(result.value, 0)
+        self.assertEqual(self.engine.hits, {'mul_zero': 1})
+
+    def test_float_times_zero_is_kept(self):
+        # f * 0 is NaN or -0.0 for some f, so it must stay a multiplication.
+        node = binop(var('f', 'float'), '*', Number(0))
+        self.assertIs(self.engine.simplify(node), node)
+        self.assertEqual(self.engine.hits, {})
+
+    def test_float_minus_itself_is_kept(self):
+        node = binop(var('f', 'float'), '-', var('f', 'float'))
+        self.assertIs(self.engine.simplify(node), node)
+
+    def test_int_times_power_of_two_becomes_shift(self):
+        result = self.engine.simplify(binop(var('x', 'int'), '*', Number(8)))
+        self.assertEqual((result.op, result.right.value), ('<<', 3))
+        self.assertEqual((result.ctype, result.optype), ('int', 'int'))
+
+    def test_float_times_power_of_two_is_kept(self):
+        node = binop(var('f', 'float'), '*', Number(8.0))
+        self.assertIs(self.engine.simplify(node), node)
+
+    def test_float_literal_does_not_match_int_pattern(self):
+        node = binop(var('f', 'float'), '+', Number(0.0))
+        self.assertIs(self.engine.simplify(node), node)
+
+
+class NonNegativeGuardTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = RewriteEngine({'i': 'int', 'j': 'int', 'f': 'float'})
+        i, j = var('i', 'int'), var('j', 'int')
+        # i only ever counts up from 0; j counts down and may go negative.
+        self.engine.compute_nonnegative({
+            'i': [Number(0), binop(i, '+', Number(1))],
+            'j': [Number(0), binop(j, '-', Number(1))],
+        })
+
+    def test_counters(self):
+        self.assertEqual(self.engine.nonnegative, {'i'})
+
+    def test_division_of_nonnegative_becomes_shift(self):
+        result = self.engine.simplify(binop(var('i', 'int'), '/', Number(4)))
+        self.assertEqual((result.op, result.right.value), ('>>', 2))
+
+    def test_remainder_of_nonnegative_becomes_mask(self):
+        result = self.engine.simplify(binop(var('i', 'int'), '%', Number(16)))
+        self.assertEqual((result.op, result.right.value), ('&', 15))
+
+    def test_division_of_possibly_negative_is_kept(self):
+        # -7 / 4 truncates to -1 in C but -7 >> 2 is -2.
+        node = binop(var('j', 'int'), '/', Number(4))
+        self.assertIs(self.engine.simplify(node), node)
+
+    def test_remainder_of_possibly_negative_is_kept(self):
+        node = binop(var('j', 'int'), '%', Number(4))
+        self.assertIs(self.engine.simplify(node), node)
+
+    def test_division_by_non_power_of_two_is_kept(self):
+        node = binop(var('i', 'int'), '/', Number(6))
+        self.assertIs(self.engine.simplify(node), node)
+
+    def test_float_counter_is_never_nonnegative(self):
+        f = var('f', 'float')
+        self.assertEqual(self.engine.compute_nonnegative({'f': [Number(0.0), binop(f, '+', Number(1.0))]}), set())
+
+    def test_uninitialised_declaration_is_not_nonnegative(self):
+        i = var('i', 'int')
+        self.assertEqual(self.engine.compute_nonnegative({'i': [None, binop(i, '+', Number(1))]}), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,515 @@
+import sys
+from array import array
+from math import isfinite
+from time import perf_counter
+
+from ir_opcodes import BINOP, BOUNDS, COPY, GOTO, IF_FALSE, LOAD, LOOP, LOOP_IF_FALSE, PRINT, PRINTF, STORE, UNOP
+from typed_ops import COMPARISON_OPS, FLOAT_PREFIX, int_div, int_mod
+
+# Back edges a loop takes before an iteration is recorded, and times a
+# guard fails before the path behind it is recorded as well
+HOT_LOOP = 50
+HOT_EXIT = 50
+# Longest recorded iteration, paths compiled into one loop's trace,
+# recordings a loop may need before it is left to the interpreter, and
+# failed type guards after which its trace is recorded again
+MAX_TRACE = 1000
+MAX_PATHS = 8
+MAX_RECORDINGS = 3
+MAX_TYPE_EXITS = 3
+NEVER = sys.maxsize
+
+TRACED = frozenset((COPY, BINOP, UNOP, GOTO, IF_FALSE, LOAD, STORE, BOUNDS, PRINT, PRINTF, LOOP, LOOP_IF_FALSE))
+CONDITIONAL = frozenset((IF_FALSE, LOOP_IF_FALSE))
+# Operators whose Python spelling behaves like the executor's operator
+# function for int and float operands alike
+INLINE_OPS = {'+', '-', '*', '<<', '>>', '&'}
+ARRAY_ELEMENTS = {'q': 'int', 'd': 'float'}
+EXIT_KINDS = ('type', 'constant', 'branch', 'budget', 'fault')
+# Exits every trace has, taken at its entry guards
+TYPE_EXIT, CONSTANT_EXIT = 0, 1
+
+
+class NotTraceable(Exception):
+    pass
+
+
+def value_kind(value):
+    # What a type guard checks: 'int', 'float' or an array's typecode
+    if type(value) is array:
+        return value.typecode
+    return type(value).__name__
+
+
+def literal(value):
+    # Python source for a value a trace can inline, else None
+    if type(value) is int or (type(value) is float and isfinite(value)):
+        text = repr(value)
+        return f"({text})" if text.startswith('-') else text
+    return None
+
+
+def reads(ins):
+    kind = ins[0]
+    if kind in (COPY, UNOP):
+        return (ins[2],)
+    if kind in (BINOP, LOAD):
+        return (ins[2], ins[3])
+    if kind == STORE:
+        return (ins[1], ins[2], ins[3])
+    if kind in (BOUNDS, PRINT, IF_FALSE, LOOP_IF_FALSE):
+        return (ins[1],)
+    if kind == PRINTF:
+        return tuple(ins[2])
+    return ()
+
+
+def writes(ins):
+    return (ins[1],) if ins[0] in (COPY, BINOP, UNOP, LOAD) else ()
+
+
+class Loop:
+    # A loop header of one compiled function, shared by the backward jumps
+    # to it. The interpreter counts its back edges and calls the JIT once
+    # count reaches threshold: HOT_LOOP to record, 0 once a trace runs the
+    # loop, NEVER when the loop is left to the interpreter.
+    def __init__(self, function, header, threshold=HOT_LOOP):
+        self.function = function
+        self.header = header
+        self.count = 0
+        self.threshold = threshold
+        self.recordings = 0
+        # Recorded iterations as [(pc, taken)]; taken says whether a
+        # conditional jump jumped and is None for other instructions
+        self.paths = []
+        # Kind, and for ints the value, of each register a path reads
+        # before writing it, as recorded
+        self.types = {}
+        self.values = {}
+        # Whether the trace treats loop-invariant ints as constants
+        self.promote = True
+        self.trace = None
+        # (pc, position, kind, path) of each way out of the trace
+        self.exits = []
+        self.exit_counts = []
+        self.type_exits = 0
+
+
+class JITStats:
+    def __init__(self):
+        self.traces = 0
+        self.bridges = 0
+        self.aborted = 0
+        self.entries = 0
+        self.exits = dict.fromkeys(EXIT_KINDS, 0)
+        self.traced_steps = 0
+        self.steps = 0
+        self.trace_time = 0.0
+        self.compile_time = 0.0
+        self.run_time = 0.0
+
+    def speedup(self):
+        # Steps per second inside traces over steps per second elsewhere,
+        # or None until both have run
+        interpreted = self.steps - self.traced_steps
+        elsewhere = self.run_time - self.trace_time - self.compile_time
+        if not (self.traced_steps and self.trace_time > 0 and interpreted and elsewhere > 0):
+            return None
+        return (self.traced_steps / self.trace_time) / (interpreted / elsewhere)
+
+    def report(self):
+        lines = [f"jit: {self.traces} loop(s) traced, {self.bridges} bridge(s), {self.aborted} recording(s) "
+                 f"aborted, {self.compile_time * 1000:.2f} ms compiling",
+                 f"jit: {self.traced_steps} of {self.steps} steps ran in traces over {self.entries} entries",
+                 "jit: guard exits: " + ", ".join(f"{kind} {count}" for kind, count in self.exits.items())]
+        speedup = self.speedup()
+        if speedup is not None:
+            lines.append(f"jit: traces ran {speedup:.1f}x as many steps per second as the interpreter")
+        return lines
+
+
+class TracingJIT:
+    # Hot loops are recorded one iteration at a time while they run, and
+    # the recorded paths are compiled into a Python function that keeps
+    # looping while its guards hold. A failed guard writes the registers
+    # back and hands the instruction it stopped at to the interpreter, so
+    # output, errors and step counts are the same with or without traces.
+    def __init__(self, write, max_steps=NEVER):
+        self.write = write
+        self.max_steps = max_steps
+        self.stats = JITStats()
+
+    def enter(self, loop, code, regs, pc, steps):
+        # Called at a back edge to loop.header once the loop is hot; returns
+        # the pc and step count the interpreter resumes with.
+        if loop.trace is None:
+            return self._record(loop, code, regs, pc, steps)
+        stats = self.stats
+        start = perf_counter()
+        at, after = loop.trace(regs, steps)
+        stats.trace_time += perf_counter() - start
+        pc, position, kind, _ = loop.exits[at]
+        after += position
+        stats.entries += 1
+        stats.traced_steps += after - steps
+        stats.exits[kind] += 1
+        if kind == 'branch':
+            loop.exit_counts[at] += 1
+            if loop.exit_counts[at] == HOT_EXIT and len(loop.paths) < MAX_PATHS:
+                return self._record(loop, code, regs, pc, after, at)
+        elif kind == 'constant':
+            # The invariant values changed between entries; stop relying on them.
+            loop.promote = False
+            try:
+                self._install(loop, code, loop.paths, loop.types, loop.values)
+            except NotTraceable:
+                self._discard(loop)
+        elif kind == 'type':
+            loop.type_exits += 1
+            if loop.type_exits == MAX_TYPE_EXITS:
+                self._discard(loop)
+        return pc, after
+
+    def _record(self, loop, code, regs, pc, steps, bridge=None):
+        # Runs the loop from pc as the interpreter would, noting each
+        # instruction, until the header comes round again. A bridge starts
+        # at the hot exit of that index, behind the path that led to it. An
+        # instruction a trace cannot hold ends the recording before it runs,
+        # so the interpreter picks up exactly there.
+        if bridge is None:
+            path = []
+        else:
+            _, position, _, index = loop.exits[bridge]
+            path = loop.paths[index][:position]
+        header = loop.header
+        constants = loop.function.constants
+        written = {slot for at, _ in path for slot in writes(code[at])}
+        visited = {at for at, _ in path}
+        types, values = {}, {}
+        write = self.write
+        max_steps = self.max_steps
+        complete = False
+        while len(path) < MAX_TRACE:
+            ins = code[pc]
+            kind = ins[0]
+            if kind not in TRACED:
+                break
+            for slot in reads(ins):
+                if slot not in written and slot not in constants and slot not in loop.types and slot not in types:
+                    types[slot] = value_kind(regs[slot])
+                    if types[slot] == 'int':
+                        values[slot] = regs[slot]
+            target = pc + 1
+            jumped = taken = None
+            try:
+                if kind == BINOP:
+                    regs[ins[1]] = ins[4](regs[ins[2]], regs[ins[3]])
+                elif kind == COPY:
+                    regs[ins[1]] = regs[ins[2]]
+                elif kind == LOAD:
+                    regs[ins[1]] = regs[ins[2]][regs[ins[3]]]
+                elif kind == STORE:
+                    regs[ins[1]][regs[ins[2]]] = regs[ins[3]]
+                elif kind == BOUNDS:
+                    if not 0 <= regs[ins[1]] < ins[2]:
+                        break
+                elif kind == UNOP:
+                    regs[ins[1]] = ins[3](regs[ins[2]])
+                elif kind == PRINTF:
+                    write(ins[1].format([regs[slot] for slot in ins[2]]))
+                elif kind == PRINT:
+                    write(f"{regs[ins[1]]}\n")
+                elif kind in (GOTO, LOOP):
+                    target = ins[1]
+                    jumped = True
+                else:
+                    jumped = taken = not regs[ins[1]]
+                    if taken:
+                        target = ins[2]
+            except Exception:
+                break
+            # A jump over budget, or into a loop inside this one, is left to
+            # the interpreter.
+            if jumped and steps >= max_steps:
+                break
+            if target in visited and target != header:
+                break
+            path.append((pc, taken))
+            visited.add(pc)
+            written.update(writes(ins))
+            steps += 1
+            pc = target
+            if pc == header:
+                complete = True
+                break
+
+        if complete:
+            try:
+                self._install(loop, code, loop.paths + [path], {**loop.types, **types}, {**loop.values, **values})
+                if bridge is None:
+                    self.stats.traces += 1
+                else:
+                    self.stats.bridges += 1
+                return pc, steps
+            except NotTraceable:
+                pass
+        self.stats.aborted += 1
+        if bridge is not None:
+            loop.exit_counts[bridge] = -NEVER
+        else:
+            self._retry(loop)
+        return pc, steps
+
+    def _install(self, loop, code, paths, types, values):
+        start = perf_counter()
+        try:
+            compiler = TraceCompiler(loop, code, paths, types, values, self.max_steps)
+            loop.trace, loop.exits = compiler.compile(self.write)
+        finally:
+            self.stats.compile_time += perf_counter() - start
+        loop.paths, loop.types, loop.values = paths, types, values
+        loop.exit_counts = [0] * len(loop.exits)
+        loop.threshold = 0
+
+    def _discard(self, loop):
+        loop.trace = None
+        loop.paths, loop.types, loop.values = [], {}, {}
+        loop.exits, loop.exit_counts = [], []
+        loop.promote = True
+        loop.type_exits = 0
+        self._retry(loop)
+
+    def _retry(self, loop):
+        loop.recordings += 1
+        loop.count = 0
+        loop.threshold = HOT_LOOP if loop.recordings < MAX_RECORDINGS else NEVER
+
+
+class TraceCompiler:
+    # Turns a loop's recorded paths into Python source for one function.
+    # Paths share their code up to the first branch they took differently,
+    # where the function branches as well; a direction no path took is a
+    # guard that leaves the trace. Registers are locals while the trace runs
+    # and constants are inlined, so arithmetic on them folds. Every
+    # instruction that can raise gets its own source line, which tells the
+    # exception handler where the trace stopped.
+    def __init__(self, loop, code, paths, types, values, max_steps=NEVER):
+        self.loop = loop
+        self.code = code
+        self.paths = paths
+        self.types = types
+        self.max_steps = max_steps
+        self.written = {slot for path in paths for pc, _ in path for slot in writes(code[pc])}
+        self.promoted = {}
+        if loop.promote:
+            self.promoted = {slot: values[slot] for slot, kind in types.items()
+                             if kind == 'int' and slot not in self.written}
+        self.lines = []
+        self.exits = [(loop.header, 0, 'type', None), (loop.header, 0, 'constant', None)]
+        # Source line -> exit taken when that line raises
+        self.faults = {}
+        # Objects the source calls, by global name
+        self.names = {}
+
+    def compile(self, write):
+        constants = self.loop.function.constants
+        known = {slot: value for slot, value in constants.items() if literal(value) is not None}
+        slots = sorted({slot for path in self.paths for pc, _ in path
+                        for slot in reads(self.code[pc]) + writes(self.code[pc]) if slot not in known})
+        known.update(self.promoted)
+        kinds = {slot: value_kind(value) for slot, value in constants.items()}
+        kinds.update(self.types)
+
+        self._line(0, "def trace(regs, steps):")
+        for slot in slots:
+            self._line(1, f"r{slot} = regs[{slot}]")
+        guards = [self._type_guard(slot, kind) for slot, kind in sorted(self.types.items())]
+        if guards:
+            self._line(1, f"if {' or '.join(guards)}:")
+            self._line(2, f"return {TYPE_EXIT}, steps")
+        if self.promoted:
+            guards = [f"r{slot} != {literal(value)}" for slot, value in sorted(self.promoted.items())]
+            self._line(1, f"if {' or '.join(guards)}:")
+            self._line(2, f"return {CONSTANT_EXIT}, steps")
+        self._line(1, "try:")
+        self._line(2, "while True:")
+        self._emit(list(range(len(self.paths))), 0, 3, known, kinds)
+        self._line(1, "except Exception as error:")
+        self._line(2, "at = FAULTS[error.__traceback__.tb_lineno]")
+        for slot in sorted(self.written):
+            self._line(1, f"regs[{slot}] = r{slot}")
+        self._line(1, "return at, steps")
+
+        namespace = {'array': array, 'int_div': int_div, 'int_mod': int_mod, 'write': write, 'FAULTS': self.faults}
+        namespace.update(self.names)
+        source = "\n".join(self.lines)
+        exec(compile(source, f"<trace {self.loop.function.name}:{self.loop.header}>", 'exec'), namespace)
+        return namespace['trace'], self.exits
+
+    def _line(self, indent, text):
+        self.lines.append('    ' * indent + text)
+        return len(self.lines)
+
+    def _exit(self, pc, position, kind, path):
+        self.exits.append((pc, position, kind, path))
+        return len(self.exits) - 1
+
+    def _type_guard(self, slot, kind):
+        if kind in ('int', 'float'):
+            return f"type(r{slot}) is not {kind}"
+        if kind in ARRAY_ELEMENTS:
+            return f"type(r{slot}) is not array or r{slot}.typecode != '{kind}'"
+        raise NotTraceable(f"register {slot} holds a {kind}")
+
+    def _operand(self, slot, known):
+        return literal(known[slot]) if slot in known else f"r{slot}"
+
+    def _emit(self, group, position, indent, known, kinds):
+        # Code for the paths in group from position on; they agree on
+        # everything before it.
+        first = self.paths[group[0]]
+        while position < len(first):
+            pc = first[position][0]
+            if any(self.paths[index][position][0] != pc for index in group):
+                raise NotTraceable("paths part without a branch")
+            ins = self.code[pc]
+            kind = ins[0]
+            if kind in CONDITIONAL:
+                jumped = [index for index in group if self.paths[index][position][1]]
+                stayed = [index for index in group if not self.paths[index][position][1]]
+                cond = self._operand(ins[1], known)
+                if jumped and stayed:
+                    self._line(indent, f"if not {cond}:")
+                    self._budget(pc, position, jumped[0], indent + 1)
+                    self._emit(jumped, position + 1, indent + 1, dict(known), dict(kinds))
+                    self._line(indent, "else:")
+                    self._emit(stayed, position + 1, indent + 1, known, kinds)
+                    return
+                at = self._exit(pc, position, 'branch', group[0])
+                if ins[1] in known:
+                    if (not known[ins[1]]) != bool(jumped):
+                        self._line(indent, f"at = {at}; break")
+                        return
+                elif jumped:
+                    self._line(indent, f"if {cond}: at = {at}; break")
+                else:
+                    self._line(indent, f"if not {cond}: at = {at}; break")
+                if jumped:
+                    self._budget(pc, position, group[0], indent)
+            elif kind in (GOTO, LOOP):
+                self._budget(pc, position, group[0], indent)
+            else:
+                self._instruction(ins, pc, position, group[0], indent, known, kinds)
+            position += 1
+
+        for slot, kind in self.types.items():
+            if kinds.get(slot) != kind:
+                raise NotTraceable(f"register {slot} changes type")
+        self._line(indent, f"steps += {len(first)}")
+
+    def _budget(self, pc, position, path, indent):
+        # A taken jump past the step budget leaves the trace, so the
+        # interpreter raises the error.
+        if self.max_steps != NEVER:
+            at = self._exit(pc, position, 'budget', path)
+            self._line(indent, f"if steps + {position} >= {self.max_steps}: at = {at}; break")
+
+    def _instruction(self, ins, pc, position, path, indent, known, kinds):
+        kind = ins[0]
+        if kind in (COPY, BINOP, UNOP, LOAD):
+            dest = ins[1]
+            result = self._result_kind(ins, kinds)
+            value = self._fold(ins, known)
+            if value is not None:
+                kinds[dest] = result
+                known[dest] = value
+                self._line(indent, f"r{dest} = {literal(value)}")
+                return
+            if kind == COPY:
+                expr = self._operand(ins[2], known)
+            elif kind == BINOP:
+                expr = self._binop(ins, known, kinds)
+            elif kind == UNOP:
+                expr = self._conversion(ins, known, kinds)
+            else:
+                expr = f"r{ins[2]}[{self._operand(ins[3], known)}]"
+            kinds[dest] = result
+            known.pop(dest, None)
+            text = f"r{dest} = {expr}"
+        elif kind == STORE:
+            text = f"r{ins[1]}[{self._operand(ins[2], known)}] = {self._operand(ins[3], known)}"
+        elif kind == BOUNDS:
+            at = self._exit(pc, position, 'fault', path)
+            self._line(indent, f"if not 0 <= {self._operand(ins[1], known)} < {ins[2]}: at = {at}; break")
+            return
+        elif kind == PRINTF:
+            name = f"format{pc}"
+            self.names[name] = ins[1]
+            text = f"write({name}.format([{', '.join(self._operand(slot, known) for slot in ins[2])}]))"
+        else:
+            text = 'write(f"{' + self._operand(ins[1], known) + '}\\n")'
+        self.faults[self._line(indent, text)] = self._exit(pc, position, 'fault', path)
+
+    def _fold(self, ins, known):
+        # The value of an instruction whose operands are all constants
+        if ins[0] == LOAD or any(slot not in known for slot in reads(ins)):
+            return None
+        try:
+            if ins[0] == COPY:
+                value = known[ins[2]]
+            elif ins[0] == UNOP:
+                value = ins[3](known[ins[2]])
+            else:
+                value = ins[4](known[ins[2]], known[ins[3]])
+        except Exception:
+            return None
+        return value if literal(value) is not None else None
+
+    def _result_kind(self, ins, kinds):
+        kind = ins[0]
+        if kind == COPY:
+            return kinds.get(ins[2])
+        if kind == UNOP:
+            return 'float' if ins[3] is float else 'int'
+        if kind == LOAD:
+            return ARRAY_ELEMENTS.get(kinds.get(ins[2]))
+        op = ins[5]
+        is_float = op.startswith(FLOAT_PREFIX)
+        if (op[len(FLOAT_PREFIX):] if is_float else op) in COMPARISON_OPS:
+            return 'int'
+        if is_float:
+            return 'float'
+        operands = (kinds.get(ins[2]), kinds.get(ins[3]))
+        if 'float' in operands:
+            return 'float'
+        return 'int' if operands == ('int', 'int') else None
+
+    def _binop(self, ins, known, kinds):
+        op = ins[5]
+        is_float = op.startswith(FLOAT_PREFIX)
+        base = op[len(FLOAT_PREFIX):] if is_float else op
+        left, right = self._operand(ins[2], known), self._operand(ins[3], known)
+        if base in COMPARISON_OPS:
+            return f"(1 if {left} {base} {right} else 0)"
+        if base in INLINE_OPS:
+            return f"{left} {base} {right}"
+        if is_float and base == '/':
+            return f"{left} / {right}"
+        if base in ('/', '%') and kinds.get(ins[2]) == kinds.get(ins[3]) == 'int':
+            # C truncates toward zero where Python floors; they agree when
+            # neither operand is negative.
+            python = '//' if base == '/' else '%'
+            if ins[3] in known and known[ins[3]] > 0:
+                return f"({left} {python} {right} if {left} >= 0 else -(-{left} {python} {right}))"
+            fallback = 'int_div' if base == '/' else 'int_mod'
+            return f"({left} {python} {right} if {left} >= 0 and {right} > 0 else {fallback}({left}, {right}))"
+        name = f"op{len(self.names)}"
+        self.names[name] = ins[4]
+        return f"{name}({left}, {right})"
+
+    def _conversion(self, ins, known, kinds):
+        target = 'float' if ins[3] is float else 'int'
+        operand = self._operand(ins[2], known)
+        if kinds.get(ins[2]) == target:
+            return operand
+        return f"{target}({operand})"
@@ -0,0 +1,90 @@
+import operator
+from array import array
+
+COMPARISON_OPS = {'==', '!=', '<', '>', '<=', '>='}
+INT_ONLY_OPS = {'%', '<<', '>>', '&'}
+FLOAT_PREFIX = 'f'
+CONVERSIONS = {'itof': float, 'ftoi': int}
+
+
+def int_div(left, right):
+    # C division truncates toward zero; Python's // floors.
+    quotient = abs(left) // abs(right)
+    return quotient if (left >= 0) == (right >= 0) else -quotient
+
+
+def int_mod(left, right):
+    return left - right * int_div(left, right)
+
+
+def _compare(op):
+    return lambda left, right: int(op(left, right))
+
+
+INT_OPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': int_div,
+    '%': int_mod,
+    '<<': operator.lshift,
+    '>>': operator.rshift,
+    '&': operator.and_,
+    '==': _compare(operator.eq),
+    '!=': _compare(operator.ne),
+    '<': _compare(operator.lt),
+    '>': _compare(operator.gt),
+    '<=': _compare(operator.le),
+    '>=': _compare(operator.ge),
+}
+
+FLOAT_OPS = {op: INT_OPS[op] for op in INT_OPS if op not in INT_ONLY_OPS}
+FLOAT_OPS['/'] = operator.truediv
+
+TYPED_OPS = {'int': INT_OPS, 'float': FLOAT_OPS}
+
+# Arrays are flat machine-typed buffers: 64-bit ints and doubles.
+ARRAY_TYPECODES = {'int': 'q', 'float': 'd'}
+
+
+def new_array(ctype, size):
+    typecode = ARRAY_TYPECODES[ctype]
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+
+# Float arithmetic is spelled with a prefix in the IR: "t3 = x f* t2".
+FLOAT_IR_OPS = {FLOAT_PREFIX + op: FLOAT_OPS[op] for op in FLOAT_OPS}
+
+
+def ir_op(op, optype):
+    return FLOAT_PREFIX + op if optype == 'float' else op
+
+
+def result_type(op, left, right):
+    if op in COMPARISON_OPS:
+        return 'int'
+    return 'float' if 'float' in (left, right) else 'int'
+
+
+def evaluate(op, left, right):
+    # Used for constant folding: returns None instead of raising so callers
+    # simply leave the expression alone.
+    if op in FLOAT_IR_OPS:
+        table, op = FLOAT_OPS, op[len(FLOAT_PREFIX):]
+    elif isinstance(left, float) or isinstance(right, float):
+        table = FLOAT_OPS
+    else:
+        table = INT_OPS
+    if op not in table:
+        return None
+    try:
+        return table[op](left, right)
+    except (ZeroDivisionError, ValueError, OverflowError, TypeError):
+        return None
+
+
+def convert(op, value):
+    try:
+        return CONVERSIONS[op](value)
+    except (KeyError, ValueError, OverflowError):
+        return None
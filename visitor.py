@@ -0,0 +1,91 @@
+from inspect import isgeneratorfunction
+from types import GeneratorType
+
+
+class NodeVisitor:
+    # visit_<Class> methods either return a value directly or are generators
+    # that yield each child they need (a node, or a (node, *args) tuple) and
+    # receive its result back. Generator methods can then be driven from an
+    # explicit stack, so nesting depth is not bounded by Python's recursion
+    # limit.
+    iterative = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Filled lazily: node class -> (function, is_generator)
+        cls._dispatch = {}
+
+    @classmethod
+    def _lookup(cls, node_class):
+        method = getattr(cls, f"visit_{node_class.__name__}", None)
+        if method is None:
+            method = cls.generic_visit
+        entry = (method, isgeneratorfunction(method))
+        cls._dispatch[node_class] = entry
+        return entry
+
+    def generic_visit(self, node, *args):
+        raise Exception(f"No visitor defined for {node.__class__.__name__}")
+
+    def visit(self, node, *args):
+        try:
+            method, is_generator = self._dispatch[node.__class__]
+        except KeyError:
+            method, is_generator = self._lookup(node.__class__)
+        if not is_generator:
+            return method(self, node, *args)
+        if self.iterative:
+            return self._run_iterative(method(self, node, *args))
+        return self._run_recursive(method(self, node, *args))
+
+    def _run_recursive(self, gen):
+        value, error = None, None
+        while True:
+            try:
+                child = gen.throw(error) if error is not None else gen.send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, error = (self.visit(*child) if type(child) is tuple else self.visit(child)), None
+            except Exception as exc:
+                value, error = None, exc
+
+    def _run_iterative(self, gen):
+        dispatch = self._dispatch
+        stack = [gen]
+        value, error = None, None
+        while True:
+            top = stack[-1]
+            try:
+                child = top.throw(error) if error is not None else top.send(value)
+            except StopIteration as stop:
+                stack.pop()
+                if not stack:
+                    return stop.value
+                value, error = stop.value, None
+                continue
+            except Exception as exc:
+                stack.pop()
+                if not stack:
+                    raise
+                value, error = None, exc
+                continue
+
+            if type(child) is tuple:
+                child, args = child[0], child[1:]
+            else:
+                args = ()
+            try:
+                method, is_generator = dispatch[child.__class__]
+            except KeyError:
+                method, is_generator = self._lookup(child.__class__)
+            try:
+                result = method(self, child, *args)
+            except Exception as exc:
+                value, error = None, exc
+                continue
+            if type(result) is GeneratorType:
+                stack.append(result)
+                value, error = None, None
+            else:
+                value, error = result, None
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import sys
+import time
+
+from artifacts import write_compilation
+from compiler import compile_path, listing
+from errors import LexicalError, PreprocessorError, RuntimeError, SemanticError, SyntaxError
+
+# File written per source for each output, named after the source plus this suffix
+OUTPUT_SUFFIXES = {
+    "tokens": ".tokens", "ast": ".ast", "ir": ".ir", "ir-opt": ".opt.ir", "pseudocode": ".pseudo", "asm": ".s",
+    "artifact": ".mcart",
+}
+DEFAULT_OUTPUTS = ["asm"]
+# Seconds between scans, and how long the tree must stay unchanged before a
+# burst of saves is rebuilt
+POLL_INTERVAL = 0.25
+SETTLE_TIME = 0.1
+# Kept in the output directory: what the last build saw, so a restarted
+# watcher only rebuilds what changed while it was away
+MANIFEST = "watch-manifest.json"
+
+COMPILE_ERRORS = (PreprocessorError, LexicalError, SyntaxError, SemanticError, RuntimeError, OSError,
+                  UnicodeDecodeError)
+
+
+def content_hash(path):
+    with open(path, 'rb') as source:
+        return hashlib.blake2b(source.read(), digest_size=16).hexdigest()
+
+
+class WatchedFile:
+    def __init__(self, path):
+        self.path = path
+        # (mtime, size) and content hash as of the last scan
+        self.stat = None
+        self.hash = None
+        # Content hash this file's outputs were built from, and the hash of
+        # every header that build read
+        self.built = None
+        self.deps = {}
+        self.error = None
+
+
+class Watcher:
+    # Keeps the outputs of every .c file under root up to date. A scan only
+    # stats files; a file is read and hashed when its modification time or
+    # size moves, and rebuilt when its content hash or one of its headers'
+    # hashes differs from the last build. Unchanged sources are never
+    # lexed again: their outputs, and the manifest describing them, stay
+    # as they are.
+    def __init__(self, root, out_dir=None, outputs=None, options=None, report=print):
+        self.root = os.path.abspath(root)
+        self.out_dir = os.path.abspath(out_dir or os.path.join(self.root, "build"))
+        self.outputs = list(outputs or DEFAULT_OUTPUTS)
+        for output in self.outputs:
+            if output not in OUTPUT_SUFFIXES:
+                raise ValueError(f"Unknown output '{output}'")
+        # Keyword arguments for compile_path
+        self.options = dict(options or {})
+        self.report = report
+        self.sources = {}
+        # Headers, inside the tree or found on the include path, by path
+        self.headers = {}
+        self.headers_changed = False
+        # Sources deleted since the last report
+        self.removed = []
+        self._load_manifest()
+
+    def _fingerprint(self):
+        # Outputs built with other options or outputs are not reused.
+        return json.dumps([self.outputs, self.options], sort_keys=True, default=str)
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.out_dir, MANIFEST)) as source:
+                manifest = json.load(source)
+        except (OSError, ValueError):
+            return
+        if manifest.get("options") != self._fingerprint():
+            return
+        for relative, entry in manifest.get("files", {}).items():
+            watched = self.sources[os.path.join(self.root, relative)] = WatchedFile(os.path.join(self.root, relative))
+            watched.built = entry["hash"]
+            watched.deps = entry["deps"]
+            watched.error = entry["error"]
+
+    def _save_manifest(self):
+        files = {os.path.relpath(path, self.root): {"hash": watched.built, "deps": watched.deps, "error": watched.error}
+                 for path, watched in self.sources.items() if watched.built is not None}
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(os.path.join(self.out_dir, MANIFEST), 'w') as out:
+            json.dump({"options": self._fingerprint(), "files": files}, out)
+
+    def _walk(self):
+        # (path, (mtime, size)) of every .c and .h file under root
+        stack = [self.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path != self.out_dir and not entry.name.startswith('.'):
+                        stack.append(entry.path)
+                elif entry.name.endswith(('.c', '.h')):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, (stat.st_mtime_ns, stat.st_size)
+
+    def scan(self):
+        # Updates stats and hashes; returns whether any content changed
+        changed = False
+        seen = set()
+        for path, stat in self._walk():
+            seen.add(path)
+            if path.endswith('.c'):
+                changed = self._update(self.sources, path, stat) or changed
+            elif self._update(self.headers, path, stat):
+                changed = self.headers_changed = True
+        # Headers outside the tree are watched while a source includes them.
+        for path in self.headers:
+            if path not in seen and not path.startswith(self.root + os.sep):
+                seen.add(path)
+                if self._update(self.headers, path, self._stat(path)):
+                    changed = self.headers_changed = True
+        for path in [path for path in self.sources if path not in seen]:
+            self._remove_outputs(path)
+            del self.sources[path]
+            self.removed.append(path)
+            changed = True
+        for path in [path for path in self.headers if path not in seen]:
+            if self.headers[path].hash is not None:
+                changed = self.headers_changed = True
+            del self.headers[path]
+        return changed
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _update(self, table, path, stat):
+        # Rehashes a file whose stat moved; True when its content changed
+        watched = table.get(path)
+        if watched is None:
+            watched = table[path] = WatchedFile(path)
+        if watched.stat == stat:
+            return False
+        watched.stat = stat
+        try:
+            digest = content_hash(path) if stat is not None else None
+        except OSError:
+            digest = None
+        changed = digest != watched.hash
+        watched.hash = digest
+        return changed
+
+    def stale(self):
+        # Sources whose outputs do not match their content and headers.
+        # Any header change also retries sources that failed, in case it
+        # supplies a missing include.
+        stale = []
+        for path, watched in self.sources.items():
+            if (watched.built != watched.hash or (watched.error and self.headers_changed)
+                    or any(self._header_hash(header) != digest for header, digest in watched.deps.items())):
+                stale.append(path)
+        return sorted(stale)
+
+    def _header_hash(self, path):
+        if path not in self.headers:
+            self._update(self.headers, path, self._stat(path))
+        return self.headers[path].hash
+
+    def build(self):
+        # Rebuilds every stale source; returns [(path, seconds, error)]
+        results = []
+        for path in self.stale():
+            watched = self.sources[path]
+            start = time.perf_counter()
+            watched.error = self._build(watched)
+            watched.built = watched.hash
+            results.append((path, time.perf_counter() - start, watched.error))
+        self.headers_changed = False
+        if results or self.removed:
+            self._save_manifest()
+        return results
+
+    def _build(self, watched):
+        try:
+            result = compile_path(watched.path, **self.options)
+        except COMPILE_ERRORS as e:
+            # Until a header changes again, the failure stands.
+            watched.deps = {header: self._header_hash(header) for header in watched.deps}
+            self._remove_outputs(watched.path)
+            return str(e)
+        watched.deps = {header: self._header_hash(header) for header in result.preprocessor.headers}
+        base = self._output_base(watched.path)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        for output in self.outputs:
+            if output == "artifact":
+                with open(base + OUTPUT_SUFFIXES[output], 'wb') as out:
+                    write_compilation(out, result)
+            else:
+                with open(base + OUTPUT_SUFFIXES[output], 'w') as out:
+                    out.write("\n".join(listing(result, output)) + "\n")
+        return None
+
+    def _output_base(self, path):
+        return os.path.join(self.out_dir, os.path.relpath(path, self.root))
+
+    def _remove_outputs(self, path):
+        base = self._output_base(path)
+        for output in self.outputs:
+            try:
+                os.remove(base + OUTPUT_SUFFIXES[output])
+            except OSError:
+                pass
+
+    def report_build(self, results, seconds):
+        for path in self.removed:
+            self.report(f"{os.path.relpath(path, self.root)}: removed")
+        self.removed = []
+        for path, elapsed, error in results:
+            name = os.path.relpath(path, self.root)
+            if error:
+                self.report(f"{name}: failed in {elapsed * 1000:.1f} ms: {error}")
+            else:
+                self.report(f"{name}: rebuilt in {elapsed * 1000:.1f} ms")
+        reused = len(self.sources) - len(results)
+        self.report(f"{len(results)} file(s) rebuilt, {reused} up to date, {seconds * 1000:.1f} ms")
+
+    def once(self):
+        start = time.perf_counter()
+        self.scan()
+        results = self.build()
+        self.report_build(results, time.perf_counter() - start)
+        return results
+
+    def run(self, interval=POLL_INTERVAL, settle=SETTLE_TIME):
+        # Polls until interrupted. A change starts a burst, which lasts until
+        # a scan SETTLE_TIME later finds nothing new; then everything the
+        # burst touched is rebuilt once.
+        self.once()
+        while True:
+            time.sleep(interval)
+            if not self.scan():
+                continue
+            while True:
+                time.sleep(settle)
+                if not self.scan():
+                    break
+            start = time.perf_counter()
+            results = self.build()
+            if results or self.removed:
+                self.report_build(results, time.perf_counter() - start)
+
+
+def watch_main(args):
+    # --watch DIR from the command line
+    options = {"level": args.level, "budget": args.budget, "search_paths": args.include_paths,
+               "defines": dict(define.partition("=")[::2] for define in args.defines), "debug": args.debug,
+               "unroll_factor": args.unroll_factor}
+    outputs = args.outputs.split(",") if args.outputs else DEFAULT_OUTPUTS
+    try:
+        watcher = Watcher(args.watch, args.out_dir, outputs, options)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    if args.once:
+        results = watcher.once()
+        return 1 if any(error for _, _, error in results) else 0
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0